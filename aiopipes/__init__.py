@@ -1,2 +1,5 @@
-from .pipeio import Input, Output, FileIO, IterableIO, QueueIO
+from .pipeio import Input, Output, FileIO, BinaryFileIO, IterableIO, AsyncIterableIO, QueueIO
+from .mmapio import MmapFileIO
+from .shmio import SharedMemoryQueueIO
+from .netio import SocketInput, SocketOutput
 from .pipeline import Pipeline
@@ -0,0 +1,110 @@
+from asyncio import coroutine, sleep
+
+from .monitor import BaseMonitor
+from .pipeio import QueueIO
+from .pipeline import Pipeline
+
+__all__ = ["Autoscaler"]
+
+
+class Autoscaler(BaseMonitor):
+    """
+    Moves workers between the stages of a running pipeline. Only stages marked with autoscale() and fed
+    by an internal queue are touched. Every interval the stage with the most work waiting (queue depth
+    times mean service time, per worker) gets another worker if its queue is deeper than high_water
+    items per worker. Stages that have had fewer items queued than workers for cooldown intervals
+    give one back. With max_total_workers set, a stage that needs a worker when the budget is spent takes it from
+    the least loaded stage instead.
+    """
+    status_props = {"scale_up_count", "scale_down_count"}
+
+    def __init__(self, obj: Pipeline, interval=1, high_water=2, cooldown=3, max_total_workers=None):
+        self.interval = interval
+        self.high_water = high_water
+        self.cooldown = cooldown
+        self.max_total_workers = max_total_workers
+        self._idle = {}
+        super().__init__(obj)
+
+    @coroutine
+    def _run(self):
+        while True:
+            yield from sleep(self.interval)
+            if self.monitor_future.done():
+                return
+
+            try:
+                self.step()
+            except Exception as e:
+                self.status.error(e)
+                return
+
+    def stages(self):
+        return [
+            runner for runner in self.pipe.pipes
+            if runner.max_workers is not None
+            and isinstance(runner.input, QueueIO)
+            and getattr(runner, "pool", None) is None
+            and getattr(runner, "_pool_factory", None) is None
+            and getattr(runner, "partition_key", None) is None
+        ]
+
+    @staticmethod
+    def pressure(runner):
+        """
+        Roughly how many seconds it would take the stage's current workers to clear its queue
+        """
+        depth = runner.input.queue.items_queued
+        mean = getattr(runner, "metrics", None) and runner.metrics.service_time.mean
+        return depth * (mean or 1) / max(runner.concurrency, 1)
+
+    def _add(self, runner):
+        if runner.add_worker():
+            self.status.inc("scale_up_count")
+            return True
+        return False
+
+    def _retire(self, runner):
+        if runner.retire_worker():
+            self.status.inc("scale_down_count")
+            self._idle[runner] = 0
+            return True
+        return False
+
+    def step(self):
+        stages = self.stages()
+        if not stages:
+            return
+
+        for runner in stages:
+            # Fewer items than workers means at least one worker had nothing to do
+            spare = runner.input.queue.items_queued < runner.concurrency
+            self._idle[runner] = self._idle.get(runner, 0) + 1 if spare else 0
+
+        # Give idle workers back first, so the budget below has room in it
+        for runner in stages:
+            if self._idle[runner] >= self.cooldown and runner.concurrency > runner.min_workers:
+                self._retire(runner)
+
+        wanting = [
+            runner for runner in stages
+            if runner.concurrency < runner.max_workers
+            and runner.input.queue.items_queued > runner.concurrency * self.high_water
+        ]
+        if not wanting:
+            return
+
+        bottleneck = max(wanting, key=self.pressure)
+
+        if self.max_total_workers is not None:
+            total = sum(runner.concurrency for runner in self.pipe.pipes)
+            if total >= self.max_total_workers:
+                donors = [
+                    runner for runner in stages
+                    if runner is not bottleneck and runner.concurrency > runner.min_workers
+                    and self.pressure(runner) < self.pressure(bottleneck)
+                ]
+                if not donors or not self._retire(min(donors, key=self.pressure)):
+                    return
+
+        self._add(bottleneck)
@@ -0,0 +1,151 @@
+"""
+Periodic checkpoints of a running pipeline.
+
+A checkpoint briefly stops the pipeline reading its input, waits until every item already read has
+been written to the final output, then records the input's position() along with a snapshot() of each
+stage function that has one. Pipeline.resume() seeks the input back to that position and restores the
+snapshots, so only work done after the checkpoint is repeated. The hot path only pays for a counter
+per read; the pause itself is bounded by timeout and happens once every interval seconds.
+"""
+from asyncio import coroutine, sleep, Future
+import os
+import pickle
+import time
+
+from .pipeio import Input
+
+__all__ = ["Checkpointer", "GatedInput", "load_checkpoint"]
+
+
+class GatedInput(Input):
+    """
+    Wraps the pipeline's input so reads can be held back while a checkpoint is taken
+    """
+    def __init__(self, input: Input):
+        self.input = input
+        self.reading = 0
+        self._opened = None
+        super().__init__()
+        self.status = input.status
+
+    def close_gate(self):
+        if self._opened is None:
+            self._opened = Future()
+
+    def open_gate(self):
+        opened, self._opened = self._opened, None
+        if opened is not None and not opened.done():
+            opened.set_result(None)
+
+    @coroutine
+    def _wait(self):
+        while self._opened is not None:
+            yield from self._opened
+
+    @coroutine
+    def read(self):
+        if self._opened is not None:
+            yield from self._wait()
+
+        self.reading += 1
+        try:
+            return (yield from self.input.read())
+        finally:
+            self.reading -= 1
+
+    @coroutine
+    def read_many(self, count):
+        if self._opened is not None:
+            yield from self._wait()
+
+        self.reading += 1
+        try:
+            return (yield from self.input.read_many(count))
+        finally:
+            self.reading -= 1
+
+    def position(self):
+        return self.input.position()
+
+    def seek(self, position):
+        self.input.seek(position)
+
+
+def load_checkpoint(path):
+    with open(path, "rb") as fd:
+        return pickle.load(fd)
+
+
+class Checkpointer(object):
+    def __init__(self, path, interval=60, timeout=10):
+        self.path = path
+        self.interval = interval
+        self.timeout = timeout
+
+    @coroutine
+    def run(self, pipeline, gate: GatedInput, queues):
+        while True:
+            yield from sleep(self.interval)
+            yield from self.checkpoint(pipeline, gate, queues)
+
+    def _drained(self, pipeline, gate, queues):
+        return (not gate.reading
+                and all(runner.idle() for runner in pipeline.runners)
+                and all(not queue.queue.items_queued and not queue._batch for queue in queues))
+
+    @coroutine
+    def checkpoint(self, pipeline, gate: GatedInput, queues):
+        started = time.monotonic()
+        gate.close_gate()
+
+        try:
+            while not self._drained(pipeline, gate, queues):
+                if gate.input.status.status_data.get("closed"):
+                    # The input has finished, so there is nothing left to skip on a resume
+                    return False
+
+                if time.monotonic() - started > self.timeout:
+                    pipeline.status.error(TimeoutError("Pipeline did not drain for a checkpoint within "
+                                                       "{0} seconds".format(self.timeout)))
+                    return False
+
+                for queue in queues:
+                    if queue._batch:
+                        yield from queue.flush()
+                yield from sleep(0.001)
+
+            # Everything before the position has to be durable, or a resume after a crash would skip it
+            if pipeline.output is not None:
+                yield from pipeline.output.sync()
+
+            position = gate.position()
+            if position is None:
+                return False
+
+            self.write({
+                "position": position,
+                "states": {
+                    index: stage.func.snapshot()
+                    for index, stage in enumerate(pipeline.pipes)
+                    if callable(getattr(getattr(stage, "func", None), "snapshot", None))
+                },
+                "time": time.time(),
+                "finished": False,
+            })
+        finally:
+            gate.open_gate()
+
+        pipeline.status.inc("checkpoint_count")
+        pipeline.status.set("checkpoint_pause", time.monotonic() - started)
+        return True
+
+    def write(self, checkpoint):
+        temp_name = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(temp_name, "wb") as fd:
+            pickle.dump(checkpoint, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(temp_name, self.path)
+
+    def finish(self):
+        self.write({"position": None, "states": {}, "time": time.time(), "finished": True})
@@ -0,0 +1,154 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__all__ = ["Codec", "LineCodec", "JsonCodec", "OrjsonCodec", "TextCodec", "BytesCodec", "MsgpackCodec", "get_codec",
+           "decode_frames"]
+
+
+class Codec(object):
+    """
+    Turns a stream of byte chunks into frames and frames into objects, and back again.
+    Codecs keep partial frames between calls so each file needs its own instance.
+    """
+    def split(self, chunk: bytes):
+        raise NotImplementedError()
+
+    def finish(self):
+        return []
+
+    def loads(self, frame):
+        raise NotImplementedError()
+
+    def loads_many(self, frames):
+        return [self.loads(frame) for frame in frames]
+
+    def dumps(self, item) -> bytes:
+        raise NotImplementedError()
+
+
+class LineCodec(Codec):
+    def __init__(self):
+        self._tail = b""
+
+    def split(self, chunk):
+        lines = (self._tail + chunk).split(b"\n")
+        self._tail = lines.pop()
+        return [line for line in lines if line]
+
+    def finish(self):
+        tail, self._tail = self._tail, b""
+        return [tail] if tail.strip() else []
+
+
+class JsonCodec(LineCodec):
+    def loads(self, frame):
+        return json.loads(frame.decode("utf-8"))
+
+    def loads_many(self, frames):
+        # Each line has to be one value on its own; joining lines into one array would let broken
+        # lines merge into valid looking ones
+        loads = json.loads
+        return [loads(frame.decode("utf-8")) for frame in frames]
+
+    def dumps(self, item):
+        return json.dumps(item).encode("utf-8") + b"\n"
+
+
+class OrjsonCodec(LineCodec):
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("The orjson codec needs the orjson package installed")
+        super().__init__()
+
+    def loads(self, frame):
+        return orjson.loads(frame)
+
+    def dumps(self, item):
+        return orjson.dumps(item) + b"\n"
+
+
+class TextCodec(LineCodec):
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
+        super().__init__()
+
+    def loads(self, frame):
+        return frame.decode(self.encoding).rstrip("\r")
+
+    def dumps(self, item):
+        return str(item).encode(self.encoding) + b"\n"
+
+
+class BytesCodec(LineCodec):
+    def loads(self, frame):
+        return frame
+
+    def dumps(self, item):
+        return bytes(item) + b"\n"
+
+
+class MsgpackCodec(Codec):
+    """
+    Length-free msgpack framing: objects are packed back to back and the unpacker finds the boundaries
+    """
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("The msgpack codec needs the msgpack package installed")
+        self._unpacker = msgpack.Unpacker(raw=False)
+
+    def split(self, chunk):
+        self._unpacker.feed(chunk)
+        return list(self._unpacker)
+
+    def loads(self, frame):
+        return frame
+
+    def dumps(self, item):
+        return msgpack.packb(item, use_bin_type=True)
+
+
+def decode_frames(codec: Codec, frames, on_error):
+    try:
+        return codec.loads_many(frames)
+    except Exception:
+        pass
+
+    # Something in this batch is broken, fall back to decoding one frame at a time
+    items = []
+    for frame in frames:
+        try:
+            items.append(codec.loads(frame))
+        except Exception as e:
+            on_error(e, frame)
+    return items
+
+
+CODECS = {
+    "json": JsonCodec,
+    "orjson": OrjsonCodec,
+    "text": TextCodec,
+    "bytes": BytesCodec,
+    "msgpack": MsgpackCodec,
+}
+
+
+def get_codec(codec) -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+
+    if codec == "auto":
+        codec = "orjson" if orjson is not None else "json"
+
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        raise RuntimeError("Unknown codec {0}".format(codec))
@@ -0,0 +1,284 @@
+"""
+A columnar data path. Each item is a whole batch of rows: an Arrow RecordBatch, a NumPy structured
+array or a dict of columns. Stages take and return whole batches, so the per-item overhead of the
+pipeline is paid once per batch instead of once per row. Run batches through Pipeline(columnar=True)
+so stage and queue counts are in rows.
+
+Reading and writing Parquet and CSV needs pyarrow. JSONL can be read into NumPy arrays without it,
+given a dtype.
+"""
+from asyncio import coroutine, get_event_loop
+import importlib
+import itertools
+import json
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from .pipeio import Input, Output, IOFinished, batch_rows, batch_nbytes
+
+__all__ = ["ColumnarFileInput", "ColumnarFileOutput", "ArrayIO", "batch_rows", "batch_nbytes", "to_arrow",
+           "to_numpy", "to_rows"]
+
+FORMATS = {".parquet": "parquet", ".pq": "parquet", ".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl",
+           ".json": "jsonl"}
+
+
+def _pyarrow(what, module=None):
+    if pyarrow is None:
+        raise RuntimeError("{0} needs the pyarrow package installed".format(what))
+    return importlib.import_module("pyarrow." + module) if module else pyarrow
+
+
+def _format(path, format):
+    if format != "auto":
+        return format
+    format = FORMATS.get(os.path.splitext(path)[1])
+    if format is None:
+        raise RuntimeError("Cannot tell the format of {0}, pass format".format(path))
+    return format
+
+
+def to_arrow(batch):
+    if pyarrow is not None and isinstance(batch, pyarrow.RecordBatch):
+        return batch
+    if numpy is not None and isinstance(batch, numpy.ndarray):
+        names = batch.dtype.names
+        return _pyarrow("to_arrow").RecordBatch.from_arrays([pyarrow.array(batch[name]) for name in names],
+                                                            names=list(names))
+    if isinstance(batch, dict):
+        return _pyarrow("to_arrow").RecordBatch.from_arrays([pyarrow.array(column) for column in batch.values()],
+                                                            names=list(batch))
+    raise TypeError("Cannot turn {0} into an Arrow batch".format(type(batch).__name__))
+
+
+def to_numpy(batch):
+    """
+    A NumPy structured array with the batch's columns
+    """
+    if numpy is None:
+        raise RuntimeError("to_numpy needs the numpy package installed")
+    if isinstance(batch, numpy.ndarray):
+        return batch
+    if isinstance(batch, dict):
+        names, columns = list(batch), [numpy.asarray(column) for column in batch.values()]
+    else:
+        names = batch.schema.names
+        columns = [column.to_numpy(zero_copy_only=False) for column in batch.columns]
+    array = numpy.empty(len(columns[0]) if columns else 0,
+                        dtype=[(name, column.dtype) for name, column in zip(names, columns)])
+    for name, column in zip(names, columns):
+        array[name] = column
+    return array
+
+
+def to_rows(batch):
+    """
+    The batch as a list of dicts, one per row
+    """
+    if numpy is not None and isinstance(batch, numpy.ndarray):
+        names = batch.dtype.names
+        return [dict(zip(names, row)) for row in batch.tolist()]
+    if not isinstance(batch, dict):
+        batch = batch.to_pydict()
+    # NumPy columns hold NumPy scalars, which json can't encode, tolist() gives Python ones
+    columns = [column.tolist() if hasattr(column, "tolist") else column for column in batch.values()]
+    return [dict(zip(batch, row)) for row in zip(*columns)]
+
+
+class ArrayIO(Input):
+    """
+    Reads an in-memory NumPy array or Arrow Table as batches of batch_rows rows. NumPy batches are
+    views of the array, not copies.
+    """
+    status_props = {"left_count", "percentage_done"}
+
+    def __init__(self, array, batch_rows=65536):
+        self.array = array
+        self.batch_rows = batch_rows
+        self.offset = 0
+        super().__init__()
+        self.status.set("left_count", len(array))
+        self.status.percentage("done", "read_count", "left_count")
+
+    @coroutine
+    def read(self):
+        if self.offset >= len(self.array):
+            self.status.set("closed", True)
+            raise IOFinished()
+
+        if hasattr(self.array, "to_batches"):
+            # A slice of an Arrow Table can span chunks, combine them into one batch
+            batch = self.array.slice(self.offset, self.batch_rows).combine_chunks().to_batches()[0]
+        else:
+            batch = self.array[self.offset:self.offset + self.batch_rows]
+        self.offset += self.batch_rows
+        self.status.inc("read_count", batch_rows(batch))
+        return batch
+
+    def position(self):
+        return self.offset
+
+    def seek(self, position):
+        self.offset = position
+        self.status.set("read_count", position)
+
+
+class ColumnarFileInput(Input):
+    """
+    Reads a Parquet, CSV or JSONL file as Arrow RecordBatches of up to batch_rows rows, or as NumPy
+    structured arrays with numpy=True. Files are read and parsed in the default executor. JSONL is read
+    whole by pyarrow; with dtype set it is instead streamed into NumPy arrays of that dtype, which only
+    needs NumPy. CSV batches are sized by pyarrow's block size rather than batch_rows.
+    """
+    status_props = {"left_count", "percentage_done"}
+
+    def __init__(self, path, format="auto", batch_rows=65536, columns=None, numpy=False, dtype=None):
+        self.path = path
+        self.format = _format(path, format)
+        self.batch_rows = batch_rows
+        self.columns = columns
+        self.as_numpy = numpy or dtype is not None
+        self.dtype = dtype
+        self.batches = None
+        self._parquet = None
+        super().__init__()
+
+        if self.format == "parquet":
+            _pyarrow("Reading Parquet")
+
+    def _open_parquet(self):
+        return _pyarrow("Reading Parquet", "parquet").ParquetFile(self.path)
+
+    @coroutine
+    def _open(self):
+        # Reading the footer is file IO too, so it happens on the first read rather than on the loop
+        self._parquet = yield from get_event_loop().run_in_executor(None, self._open_parquet)
+        self.status.set("left_count", self._parquet.metadata.num_rows)
+        self.status.percentage("done", "read_count", "left_count")
+
+    def _parquet_batches(self):
+        parquet = self._parquet
+        if hasattr(parquet, "iter_batches"):
+            return parquet.iter_batches(batch_size=self.batch_rows, columns=self.columns)
+        # pyarrow before 3.0 can only read whole row groups
+        return (batch for group in range(parquet.num_row_groups)
+                for batch in parquet.read_row_group(group, columns=self.columns).to_batches(self.batch_rows))
+
+    def _csv_batches(self):
+        csv = _pyarrow("Reading CSV", "csv")
+        options = csv.ConvertOptions(include_columns=self.columns) if self.columns else None
+        reader = csv.open_csv(self.path, convert_options=options)
+        while True:
+            try:
+                yield reader.read_next_batch()
+            except StopIteration:
+                return
+
+    def _jsonl_batches(self):
+        if self.dtype is not None:
+            return self._jsonl_arrays()
+
+        table = _pyarrow("Reading JSONL without a dtype", "json").read_json(self.path)
+        if self.columns:
+            table = table.select(self.columns) if hasattr(table, "select") else pyarrow.Table.from_arrays(
+                [table.column(name) for name in self.columns], names=self.columns)
+        return iter(table.to_batches(self.batch_rows))
+
+    def _jsonl_arrays(self):
+        dtype = numpy.dtype(self.dtype)
+        names = dtype.names
+        with open(self.path, "rb") as fd:
+            while True:
+                lines = list(itertools.islice(fd, self.batch_rows))
+                if not lines:
+                    return
+                rows = json.loads("[" + b",".join(line for line in lines if line.strip()).decode("utf-8") + "]")
+                yield numpy.array([tuple(row.get(name) for name in names) for row in rows], dtype=dtype)
+
+    def _next(self):
+        if self.batches is None:
+            self.batches = {
+                "parquet": self._parquet_batches,
+                "csv": self._csv_batches,
+                "jsonl": self._jsonl_batches,
+            }[self.format]()
+
+        batch = next(self.batches, None)
+        if batch is not None and self.as_numpy:
+            batch = to_numpy(batch)
+        return batch
+
+    @coroutine
+    def read(self):
+        if self.format == "parquet" and self._parquet is None:
+            yield from self._open()
+
+        batch = yield from get_event_loop().run_in_executor(None, self._next)
+        if batch is None:
+            self.status.set("closed", True)
+            raise IOFinished()
+
+        self.status.inc("read_count", batch_rows(batch))
+        return batch
+
+
+class ColumnarFileOutput(Output):
+    """
+    Writes batches to a Parquet, CSV or JSONL file, in the default executor. NumPy arrays and dicts
+    of columns are converted to Arrow first; JSONL output doesn't need pyarrow at all. compression is
+    passed on to the Parquet writer.
+    """
+    def __init__(self, path, format="auto", compression="snappy"):
+        self.path = path
+        self.format = _format(path, format)
+        self.compression = compression
+        self.writer = None
+        if self.format != "jsonl":
+            _pyarrow("Writing {0}".format(self.format))
+        super().__init__()
+
+    def _write(self, batch):
+        if self.format == "jsonl":
+            if self.writer is None:
+                self.writer = open(self.path, "w")
+            self.writer.write("".join(json.dumps(row) + "\n" for row in to_rows(batch)))
+            return
+
+        batch = to_arrow(batch)
+        if self.writer is None:
+            if self.format == "parquet":
+                parquet = _pyarrow("Writing Parquet", "parquet")
+                self.writer = parquet.ParquetWriter(self.path, batch.schema, compression=self.compression)
+            else:
+                csv = _pyarrow("Writing CSV", "csv")
+                if not hasattr(csv, "CSVWriter"):
+                    raise RuntimeError("Writing CSV needs pyarrow 4.0 or later")
+                self.writer = csv.CSVWriter(self.path, batch.schema)
+
+        if self.format == "parquet":
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    @coroutine
+    def write(self, data):
+        yield from get_event_loop().run_in_executor(None, self._write, data)
+        self.status.inc("write_count", batch_rows(data))
+
+    @coroutine
+    def close(self):
+        yield from get_event_loop().run_in_executor(None, self._close)
+        self.status.set("closed", True)
@@ -0,0 +1,256 @@
+"""
+Streaming compression for BinaryFileIO: gzip, bz2 and xz from the standard library, and zstd when the
+zstandard package is installed. Compressed files are recognised by their first bytes when read and by
+their name when written. Every chunk is (de)compressed in the default executor, off the event loop.
+"""
+from asyncio import coroutine, get_event_loop
+import bz2
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ["detect", "suffix_compression", "Decompressor", "CompressedReader", "CompressedWriter"]
+
+MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+
+SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+
+
+def _zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd compression needs the zstandard package installed")
+    return zstandard
+
+
+class _Inflate(object):
+    """
+    zlib's decompressobj, holding on to the input it couldn't get through when max_length is reached
+    """
+    def __init__(self):
+        # 16 + MAX_WBITS reads a gzip header and trailer
+        self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data, max_length=-1):
+        if self.obj.unconsumed_tail:
+            data = self.obj.unconsumed_tail + data
+        return self.obj.decompress(data, max(max_length, 0))
+
+    @property
+    def needs_input(self):
+        return not self.obj.unconsumed_tail
+
+    @property
+    def eof(self):
+        return self.obj.eof
+
+    @property
+    def unused_data(self):
+        return self.obj.unused_data
+
+
+class _ZstdDecompressor(object):
+    """
+    zstandard's decompressobj takes no max_length, so it's given the input a slice at a time and any
+    output past max_length is kept for the next call
+    """
+    STEP = 1 << 12
+
+    def __init__(self):
+        self.obj = _zstd().ZstdDecompressor().decompressobj()
+        # Without eof there's no telling where one frame ends, or whether the last one was cut short
+        if not hasattr(self.obj, "eof"):
+            raise RuntimeError("Reading zstd needs a newer zstandard package, this one doesn't report the "
+                               "end of a frame")
+        self.input = b""
+        self.position = 0
+        self.output = b""
+
+    def decompress(self, data, max_length=-1):
+        if data:
+            self.input = self.input[self.position:] + data
+            self.position = 0
+
+        output = [self.output]
+        size = len(self.output)
+        while self.position < len(self.input) and not self.obj.eof and (max_length < 0 or size < max_length):
+            piece = self.input[self.position:self.position + self.STEP]
+            self.position += len(piece)
+            output.append(self.obj.decompress(piece))
+            size += len(output[-1])
+
+        output = b"".join(output)
+        if max_length < 0:
+            max_length = len(output)
+        self.output = output[max_length:]
+        return output[:max_length]
+
+    @property
+    def needs_input(self):
+        return self.position >= len(self.input) and not self.output
+
+    @property
+    def eof(self):
+        return self.obj.eof and not self.output
+
+    @property
+    def unused_data(self):
+        return self.obj.unused_data + self.input[self.position:]
+
+
+DECOMPRESSORS = {
+    "gzip": _Inflate,
+    "bz2": bz2.BZ2Decompressor,
+    "xz": lzma.LZMADecompressor,
+    "zstd": _ZstdDecompressor,
+}
+
+COMPRESSORS = {
+    "gzip": lambda level: zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    "bz2": lambda level: bz2.BZ2Compressor(9 if level is None else level),
+    "xz": lambda level: lzma.LZMACompressor(preset=level),
+    "zstd": lambda level: _zstd().ZstdCompressor(level=3 if level is None else level).compressobj(),
+}
+
+
+def detect(header: bytes):
+    for magic, name in MAGIC:
+        if header.startswith(magic):
+            return name
+    return None
+
+
+def suffix_compression(name):
+    if not isinstance(name, str):
+        return None
+    for suffix, compression in SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    return None
+
+
+def _check(name):
+    if name not in DECOMPRESSORS:
+        raise RuntimeError("Unknown compression {0}".format(name))
+    if name == "zstd":
+        _zstd()
+
+
+class Decompressor(object):
+    """
+    Decompresses a stream of one or more compressed members back to back, as left by appending to a
+    .gz file or by parallel compressors. Each call returns at most limit bytes, and while waiting is
+    true there's more to come without any new data.
+    """
+    def __init__(self, name, limit=None):
+        _check(name)
+        self.new = DECOMPRESSORS[name]
+        self.current = self.new()
+        self.limit = limit or -1
+        # Input after the end of a member, not yet given to the next one
+        self.unused = b""
+        # gzip pads files with NUL bytes after the last member, e.g. on tape or after a truncate
+        self.padding = b"\0" if name == "gzip" else b""
+        self.started = False
+
+    def decompress(self, data=b""):
+        if self.unused:
+            data, self.unused = self.unused + data, b""
+
+        output = []
+        remaining = self.limit
+        while remaining:
+            if not self.started and self.padding:
+                data = data.lstrip(self.padding)
+            if not data and (not self.started or self.current.needs_input):
+                break
+
+            self.started = True
+            output.append(self.current.decompress(data, remaining))
+            data = b""
+            if remaining > 0:
+                remaining -= len(output[-1])
+            if self.current.eof:
+                data = self.current.unused_data
+                self.current = self.new()
+                self.started = False
+
+        self.unused = data
+        return b"".join(output)
+
+    @property
+    def waiting(self):
+        return bool(self.unused) or (self.started and not self.current.needs_input)
+
+    @property
+    def finished(self):
+        return not self.started or self.current.eof
+
+
+class CompressedReader(object):
+    """
+    Wraps one of the readers from streams and decompresses what it returns. first is a chunk already
+    read from it, to look at the magic bytes.
+    """
+    def __init__(self, reader, name, first=b"", chunk_size=None):
+        self.reader = reader
+        self.decompressor = Decompressor(name, chunk_size)
+        self.first = first
+        self.compressed_bytes = 0
+
+    @coroutine
+    def read(self):
+        while True:
+            if self.decompressor.waiting:
+                chunk = b""
+            elif self.first:
+                chunk, self.first = self.first, b""
+            else:
+                chunk = yield from self.reader.read()
+
+            if not chunk and not self.decompressor.waiting:
+                if not self.decompressor.finished:
+                    raise EOFError("Compressed stream ended before the end of its data")
+                return b""
+
+            self.compressed_bytes += len(chunk)
+            data = yield from get_event_loop().run_in_executor(None, self.decompressor.decompress, chunk)
+            # A chunk can end inside a compressed block and produce nothing yet
+            if data:
+                return data
+
+
+class CompressedWriter(object):
+    """
+    Wraps one of the writers from streams and compresses everything written to it
+    """
+    def __init__(self, writer, name, level=None):
+        _check(name)
+        self.writer = writer
+        self.compressor = COMPRESSORS[name](level)
+
+    @coroutine
+    def write(self, data):
+        compressed = yield from get_event_loop().run_in_executor(None, self.compressor.compress, data)
+        if compressed:
+            yield from self.writer.write(compressed)
+
+    @coroutine
+    def sync(self):
+        # Only what has left the compressor, data it is still holding on to is not covered
+        yield from self.writer.sync()
+
+    @coroutine
+    def close(self):
+        tail = yield from get_event_loop().run_in_executor(None, self.compressor.flush)
+        if tail:
+            yield from self.writer.write(tail)
+        yield from self.writer.close()
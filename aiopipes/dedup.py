@@ -0,0 +1,248 @@
+"""
+Backends for filters.unique. Each one has add(key), which returns True the first time a key is seen,
+and get_stats() for the stage's status.
+"""
+from collections import OrderedDict
+import hashlib
+import math
+import sqlite3
+import sys
+import time
+
+__all__ = ["SetBackend", "LRUBackend", "BloomBackend", "SqliteBackend"]
+
+
+def _key_bytes(key):
+    # Tagged with the key's type, so 1, "1" and b"1" stay different keys
+    if isinstance(key, bytes):
+        return b"b\0" + key
+    if isinstance(key, str):
+        return b"s\0" + key.encode("utf-8")
+    return "r\0{0}\0{1!r}".format(type(key).__qualname__, key).encode("utf-8")
+
+
+class SetBackend(object):
+    """
+    Exact, in memory and unbounded: every key ever seen is kept
+    """
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def close(self):
+        pass
+
+    def snapshot(self):
+        return list(self.keys)
+
+    def restore(self, state):
+        self.keys = set(state)
+
+    def get_stats(self):
+        # The size of the hash table only, walking every key to size it would be far too slow
+        return {"keys": len(self.keys), "memory_bytes": sys.getsizeof(self.keys)}
+
+
+class LRUBackend(SetBackend):
+    """
+    Remembers the max_keys most recently seen keys, and with ttl set only keys seen in the last ttl
+    seconds. A key that has been forgotten is let through again, so duplicates further apart than the
+    window are not caught.
+    """
+    def __init__(self, max_keys=1000000, ttl=None):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.keys = OrderedDict()
+        self.evicted = 0
+
+    def add(self, key):
+        now = 0
+        if self.ttl is not None:
+            now = time.monotonic()
+            # Keys are kept in the order they were last seen, so expired ones are all at the front
+            while self.keys:
+                oldest, seen_at = next(iter(self.keys.items()))
+                if now - seen_at < self.ttl:
+                    break
+                del self.keys[oldest]
+                self.evicted += 1
+
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            self.keys[key] = now
+            return False
+
+        self.keys[key] = now
+        if len(self.keys) > self.max_keys:
+            self.keys.popitem(last=False)
+            self.evicted += 1
+        return True
+
+    def snapshot(self):
+        return list(self.keys.items()), self.evicted
+
+    def restore(self, state):
+        # Timestamps come from time.monotonic(), so after a restart the ttl is counted from now
+        now = time.monotonic()
+        self.keys = OrderedDict((key, now if self.ttl is not None else 0) for key, _ in state[0])
+        self.evicted = state[1]
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["evicted"] = self.evicted
+        return stats
+
+
+class _BloomSlice(object):
+    __slots__ = ("capacity", "hashes", "size", "bits", "count")
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, first, second):
+        size = self.size
+        return [(first + i * second) % size for i in range(self.hashes)]
+
+    def contains(self, positions):
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class BloomBackend(object):
+    """
+    A scalable Bloom filter: memory grows with the number of distinct keys, not the number checked,
+    and the chance of a new key being wrongly dropped as a duplicate stays below error_rate.
+    When a filter fills up a bigger one (growth times the capacity) with a tighter error rate is added.
+    """
+    def __init__(self, capacity=1000000, error_rate=0.001, growth=2, tightening=0.5):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.slices = [_BloomSlice(capacity, error_rate * (1 - tightening))]
+
+    def add(self, key):
+        digest = hashlib.md5(_key_bytes(key)).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+        for bloom in self.slices:
+            if bloom.contains(bloom.positions(first, second)):
+                return False
+
+        current = self.slices[-1]
+        if current.count >= current.capacity:
+            error_rate = self.error_rate * (1 - self.tightening) * self.tightening ** len(self.slices)
+            current = _BloomSlice(current.capacity * self.growth, error_rate)
+            self.slices.append(current)
+
+        current.add(current.positions(first, second))
+        return True
+
+    def close(self):
+        pass
+
+    def snapshot(self):
+        return [(bloom.capacity, bloom.size, bloom.hashes, bytes(bloom.bits), bloom.count) for bloom in self.slices]
+
+    def restore(self, state):
+        self.slices = []
+        for capacity, size, hashes, bits, count in state:
+            bloom = _BloomSlice.__new__(_BloomSlice)
+            bloom.capacity, bloom.size, bloom.hashes, bloom.bits, bloom.count = capacity, size, hashes, bytearray(bits), count
+            self.slices.append(bloom)
+
+    def get_stats(self):
+        return {
+            "keys": sum(bloom.count for bloom in self.slices),
+            "memory_bytes": sum(len(bloom.bits) for bloom in self.slices),
+            "filters": len(self.slices),
+        }
+
+
+class SqliteBackend(object):
+    """
+    Exact and on disk, so keys survive restarts. Inserts are committed every commit_every keys and when
+    the stage finishes; keys added since the last commit are lost if the process dies.
+    """
+    def __init__(self, path, table="seen_keys", commit_every=10000):
+        self.path = path
+        self.table = table
+        self.commit_every = commit_every
+        self.connection = sqlite3.connect(path)
+        # added numbers keys in the order they were first seen, so a checkpoint can roll back to a point
+        self.connection.execute("CREATE TABLE IF NOT EXISTS {0} (key BLOB PRIMARY KEY, added INTEGER) "
+                                "WITHOUT ROWID".format(table))
+        self.insert = "INSERT OR IGNORE INTO {0} (key, added) VALUES (?, ?)".format(table)
+        self.count = self.connection.execute("SELECT COUNT(*) FROM {0}".format(table)).fetchone()[0]
+        self.uncommitted = 0
+        self.final_stats = None
+
+    def add(self, key):
+        if self.connection.execute(self.insert, (_key_bytes(key), self.count + 1)).rowcount != 1:
+            return False
+
+        self.count += 1
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.connection.commit()
+            self.uncommitted = 0
+        return True
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        if self.final_stats is not None:
+            return
+        self.commit()
+        # Kept for anything still reporting the stage's status once the connection has gone
+        self.final_stats = self.get_stats()
+        self.connection.close()
+
+    def snapshot(self):
+        # The keys are already on disk, they only need committing
+        self.commit()
+        return self.count
+
+    def restore(self, state):
+        # Forget keys first seen after the checkpoint, their items are about to be read again
+        self.connection.execute("DELETE FROM {0} WHERE added > ?".format(self.table), (state,))
+        self.connection.commit()
+        self.count = state
+
+    def _pragma(self, name):
+        return self.connection.execute("PRAGMA {0}".format(name)).fetchone()[0]
+
+    def get_stats(self):
+        if self.final_stats is not None:
+            return self.final_stats
+
+        page_size = self._pragma("page_size")
+        cache_size = self._pragma("cache_size")
+        # A negative cache_size is in KiB, a positive one in pages
+        return {
+            "keys": self.count,
+            "disk_bytes": self._pragma("page_count") * page_size,
+            "memory_bytes": -cache_size * 1024 if cache_size < 0 else cache_size * page_size,
+        }
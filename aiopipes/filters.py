@@ -1,9 +1,27 @@
+from asyncio import coroutine
 import collections
 import functools
+import heapq
+import itertools
+import math
+import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def unique(key):
-    seen_keys = set()
+from .dedup import SetBackend
+from .sketches import CountMinSketch, HyperLogLog
+
+
+def unique(key, backend=None):
+    """
+    Drop items whose key has been seen before. backend decides how keys are remembered, see
+    aiopipes.dedup; by default every key is kept in memory.
+    """
+    backend = backend or SetBackend()
+    counts = {"checked": 0, "duplicates": 0}
 
     @functools.wraps(unique)
     def _inner(item):
@@ -12,10 +30,282 @@ def unique(key):
         else:
             key_value = getattr(item, key)
 
-        if key_value in seen_keys:
+        counts["checked"] += 1
+        if not backend.add(key_value):
+            counts["duplicates"] += 1
+            return None
+
+        return item
+
+    def stats():
+        result = dict(counts, hit_rate=counts["duplicates"] / counts["checked"] if counts["checked"] else 0.0)
+        result.update(backend.get_stats())
+        return result
+
+    _inner.stats = stats
+    _inner.close = backend.close
+    _inner.snapshot = lambda: (dict(counts), backend.snapshot())
+
+    def restore(state):
+        counts.update(state[0])
+        backend.restore(state[1])
+    _inner.restore = restore
+    _inner.backend = backend
+    return _inner
+
+
+def _numeric_array(value):
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _key_getter(key):
+    if key is None or callable(key):
+        return key
+
+    def getter(item):
+        if isinstance(item, collections.Mapping):
+            return item[key]
+        return getattr(item, key)
+    return getter
+
+
+def window(size, step=None):
+    """
+    Collect items into lists of size items, starting a new window every step items. With no step the
+    windows don't overlap (tumbling), with a smaller step they slide. The last partial window is
+    emitted when the stream ends.
+    """
+    step = step or size
+    buffer = collections.deque(maxlen=size)
+    state = {"since_emit": 0, "skip": 0}
+
+    def _inner(item):
+        if state["skip"]:
+            # step is bigger than size: items between windows are dropped
+            state["skip"] -= 1
             return None
 
-        seen_keys.add(key_value)
+        buffer.append(item)
+        state["since_emit"] += 1
+
+        if len(buffer) == size and state["since_emit"] >= min(step, size):
+            state["since_emit"] = 0
+            result = list(buffer)
+            if step >= size:
+                buffer.clear()
+                state["skip"] = step - size
+            else:
+                for _ in range(step):
+                    buffer.popleft()
+            return result
+
+    def flush():
+        if state["since_emit"] and buffer:
+            return [list(buffer)]
+        return []
+
+    def restore(snapshot):
+        state.update(snapshot[0])
+        buffer.clear()
+        buffer.extend(snapshot[1])
+
+    _inner.flush = flush
+    _inner.snapshot = lambda: (dict(state), list(buffer))
+    _inner.restore = restore
+    return _inner
+
+
+def time_window(seconds, step=None, clock=time.monotonic):
+    """
+    Collect items into lists covering seconds each, by when they arrive, starting a new window every
+    step seconds. With no step the windows don't overlap (tumbling), with a smaller step they slide.
+    A window is emitted when the first item after it arrives, or when the stream ends, so quiet
+    windows are not emitted at all.
+    """
+    step = step or seconds
+    # (arrival time, item), oldest first
+    buffer = collections.deque()
+    state = {"next": float("-inf"), "restored": []}
+
+    def first_start(when):
+        # The earliest window that when falls in
+        return (math.floor((when - seconds) / step) + 1) * step
+
+    def close(now):
+        results = []
+        if state["restored"]:
+            results.append(state["restored"])
+            state["restored"] = []
+
+        while buffer:
+            start = max(state["next"], first_start(buffer[0][0]))
+            if buffer[0][0] < start:
+                # Only in windows already emitted, or between windows when step is bigger than seconds
+                buffer.popleft()
+                continue
+
+            end = start + seconds
+            if end > now:
+                break
+            results.append([item for when, item in itertools.takewhile(lambda entry: entry[0] < end, buffer)])
+            state["next"] = start + step
+        return results
+
+    @coroutine
+    def _inner(item, output):
+        now = clock()
+        # With sliding windows one item can close several of them
+        for result in close(now):
+            yield from output(result)
+        buffer.append((now, item))
+
+    def flush():
+        return close(float("inf"))
+
+    def restore(snapshot):
+        state["next"] = float("-inf")
+        state["restored"] = list(snapshot)
+        buffer.clear()
+
+    _inner.flush = flush
+    # Windows are by arrival time, so a restored window is closed by the first item after a restart
+    _inner.snapshot = lambda: state["restored"] + [item for when, item in buffer]
+    _inner.restore = restore
+    return _inner
+
+
+def count(total, item):
+    return total + (len(item) if _numeric_array(item) else 1)
+
+
+def total(field=None):
+    """
+    A reducer that adds up field, or the items themselves. NumPy arrays are summed in one go.
+    """
+    getter = _key_getter(field)
+
+    def _total(current, item):
+        value = getter(item) if getter else item
+        return current + (value.sum() if _numeric_array(value) else value)
+    return _total
+
+
+# minimum and maximum need group_by(..., initial=None)
+def minimum(current, item):
+    value = item.min() if _numeric_array(item) else item
+    return value if current is None or value < current else current
+
+
+def maximum(current, item):
+    value = item.max() if _numeric_array(item) else item
+    return value if current is None or value > current else current
+
+
+def group_by(key, reducer=count, initial=0, emit_every=None):
+    """
+    Fold the items for each key with reducer(accumulated, item), starting from initial. The dict of
+    results is emitted when the stream ends, and every emit_every items if that is set.
+    """
+    getter = _key_getter(key)
+    groups = {}
+    state = {"seen": 0}
+
+    def _inner(item):
+        group = getter(item)
+        groups[group] = reducer(groups.get(group, initial), item)
+
+        state["seen"] += 1
+        if emit_every and state["seen"] % emit_every == 0:
+            return dict(groups)
+
+    def flush():
+        return [dict(groups)] if groups and not (emit_every and state["seen"] % emit_every == 0) else []
+
+    def restore(snapshot):
+        groups.clear()
+        groups.update(snapshot[0])
+        state.update(snapshot[1])
+
+    _inner.flush = flush
+    _inner.stats = lambda: {"groups": len(groups)}
+    _inner.snapshot = lambda: (dict(groups), dict(state))
+    _inner.restore = restore
+    return _inner
+
+
+def top_k(k, key=None):
+    """
+    Keep the k largest items, by key if given, and emit them largest first when the stream ends.
+    NumPy arrays are treated as batches of numbers and are reduced with a partition.
+    """
+    getter = _key_getter(key)
+    heap = []
+    state = {"counter": 0}
+
+    def push(value, item):
+        # The counter breaks ties so items themselves are never compared
+        state["counter"] += 1
+        entry = (value, state["counter"], item)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def _inner(item):
+        if _numeric_array(item) and getter is None:
+            largest = item if len(item) <= k else numpy.partition(item, len(item) - k)[len(item) - k:]
+            for value in largest.tolist():
+                push(value, value)
+        else:
+            push(getter(item) if getter else item, item)
+
+    def flush():
+        return [[item for _, _, item in sorted(heap, reverse=True)]] if heap else []
+
+    def restore(snapshot):
+        heap[:] = snapshot[0]
+        state.update(snapshot[1])
+
+    _inner.flush = flush
+    _inner.snapshot = lambda: (list(heap), dict(state))
+    _inner.restore = restore
+    return _inner
+
+
+def approx_count(key=None, epsilon=0.001, delta=0.01):
+    """
+    Pass items through while counting each key in a CountMinSketch. Look counts up with
+    estimate() on the function's sketch attribute.
+    """
+    getter = _key_getter(key)
+    sketch = CountMinSketch(epsilon, delta)
+
+    def _inner(item):
+        if _numeric_array(item) and getter is None:
+            sketch.add_many(item)
+        else:
+            sketch.add(getter(item) if getter else item)
+        return item
+
+    _inner.sketch = sketch
+    _inner.stats = sketch.get_stats
+    return _inner
+
+
+def distinct_count(key=None, precision=14):
+    """
+    Pass items through while estimating how many distinct keys there are with HyperLogLog
+    """
+    getter = _key_getter(key)
+    sketch = HyperLogLog(precision)
+
+    def _inner(item):
+        if _numeric_array(item) and getter is None:
+            sketch.add_many(item)
+        else:
+            sketch.add(getter(item) if getter else item)
         return item
 
+    _inner.sketch = sketch
+    _inner.stats = sketch.get_stats
     return _inner
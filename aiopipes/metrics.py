@@ -0,0 +1,167 @@
+import time
+
+__all__ = ["Histogram", "RateMeter", "StageMetrics"]
+
+
+class Histogram(object):
+    """
+    A fixed size HDR-style histogram. Values are counted in units of lowest, and every power of two of
+    those units is split into four buckets using the top bits of the value, so percentiles are accurate
+    to within 25% and recording a value needs no floating point maths beyond one multiplication.
+    """
+    __slots__ = ("lowest", "scale", "buckets", "count", "total", "min", "max")
+
+    def __init__(self, lowest=1e-6, octaves=40):
+        self.lowest = lowest
+        self.scale = 1 / lowest
+        self.buckets = [0] * (4 * octaves + 4)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, value, count=1):
+        units = int(value * self.scale)
+
+        if units < 4:
+            bucket = units if units > 0 else 0
+        else:
+            bits = units.bit_length()
+            bucket = min((bits - 2) * 4 + ((units >> (bits - 3)) & 3), len(self.buckets) - 1)
+
+        self.buckets[bucket] += count
+        self.count += count
+        self.total += value * count
+
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def _bucket_value(self, bucket):
+        if bucket < 4:
+            return bucket * self.lowest
+        bits, sub_bucket = bucket // 4 + 2, bucket % 4
+        return ((4 + sub_bucket) << (bits - 3)) * self.lowest
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+
+        wanted = self.count * percent / 100
+        seen = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if bucket_count and seen >= wanted:
+                return min(max(self._bucket_value(bucket), self.min), self.max)
+        return self.max
+
+    def count_below(self, bound):
+        """
+        How many values were recorded in buckets that end at or below bound
+        """
+        below = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            if self._bucket_value(bucket + 1) > bound:
+                break
+            below += bucket_count
+        return below
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def get_stats(self):
+        if not self.count:
+            return {"count": 0}
+
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class RateMeter(object):
+    """
+    Counts events in one second buckets to give rates over sliding windows of up to window seconds
+    """
+    __slots__ = ("window", "buckets", "current", "started")
+
+    def __init__(self, window=60):
+        self.window = window
+        self.buckets = [0] * window
+        self.current = None
+        self.started = None
+
+    def _advance(self, second):
+        if self.current is None:
+            self.current = self.started = second
+            return
+
+        for skipped in range(self.current + 1, min(second, self.current + self.window) + 1):
+            self.buckets[skipped % self.window] = 0
+        self.current = max(self.current, second)
+
+    def mark(self, count=1):
+        second = int(time.monotonic())
+        if second != self.current:
+            self._advance(second)
+        self.buckets[second % self.window] += count
+
+    def rate(self, seconds):
+        """
+        Events per second over the last seconds complete seconds
+        """
+        now = int(time.monotonic())
+        if self.current is None:
+            return 0.0
+
+        self._advance(now)
+        seconds = min(seconds, self.window - 1, max(now - self.started, 1))
+        total = sum(self.buckets[(now - ago) % self.window] for ago in range(1, seconds + 1))
+        return total / seconds
+
+
+class StageMetrics(object):
+    """
+    Per-stage metrics. Only one item in every sample_every is timed, and that sample is weighted by the
+    number of items it stands for, so the counts and rates stay exact while the clock is rarely read.
+    Items done without being timed are passed to skip(), and count is in rows for columnar batches.
+    """
+    sample_every = 8
+
+    def __init__(self):
+        self.service_time = Histogram()
+        self.throughput = RateMeter()
+        self.calls = 0
+        self.unsampled = 0
+
+    def should_sample(self):
+        self.calls += 1
+        if self.calls >= self.sample_every:
+            self.calls = 0
+            return True
+        return False
+
+    def skip(self, count=1):
+        self.unsampled += count
+
+    def record(self, seconds, count=1):
+        weight, self.unsampled = self.unsampled + count, 0
+        self.service_time.record(seconds / count, weight)
+        self.throughput.mark(weight)
+
+    def get_stats(self):
+        return {
+            "throughput": {
+                "1s": self.throughput.rate(1),
+                "10s": self.throughput.rate(10),
+                "60s": self.throughput.rate(60),
+            },
+            "service_time": self.service_time.get_stats(),
+        }
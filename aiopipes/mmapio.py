@@ -0,0 +1,104 @@
+from asyncio import coroutine
+import mmap
+import os
+
+from .codecs import LineCodec, get_codec, decode_frames
+from .pipeio import Input, IOFinished
+
+__all__ = ["MmapFileIO"]
+
+
+class MmapFileIO(Input):
+    """
+    Reads the lines between byte offsets start and end of a memory-mapped file. Line boundaries are found
+    inside the mapping, so only the lines handed to the codec are ever copied.
+    """
+    status_props = {"percentage_read"}
+
+    def __init__(self, path, codec="json", start=0, end=None):
+        self.path = path
+        self.codec = get_codec(codec)
+        if not isinstance(self.codec, LineCodec):
+            raise RuntimeError("MmapFileIO needs a line based codec, not {0}".format(self.codec))
+
+        self.fd = open(path, "rb")
+        size = os.fstat(self.fd.fileno()).st_size
+        self.mmap = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        self.start = start
+        self.end = size if end is None else min(end, size)
+        self.offset = start
+        super().__init__()
+
+        if self.end > self.start:
+            self.status.percentage("read", lambda: self.offset - self.start, lambda: self.end - self.start)
+
+    @classmethod
+    def shards(cls, path, count, codec="json"):
+        """
+        Split a file into count byte ranges that each start at the beginning of a line
+        """
+        size = os.path.getsize(path)
+        boundaries = [0]
+
+        if size:
+            with open(path, "rb") as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for shard in range(1, count):
+                    newline = mapped.find(b"\n", max(shard * size // count - 1, boundaries[-1]))
+                    boundary = size if newline == -1 else newline + 1
+                    if boundary > boundaries[-1]:
+                        boundaries.append(boundary)
+
+        if boundaries[-1] != size or len(boundaries) == 1:
+            boundaries.append(size)
+
+        return [cls(path, codec, start, end) for start, end in zip(boundaries, boundaries[1:])]
+
+    def _frames(self, count):
+        frames = []
+        mapped, offset, end = self.mmap, self.offset, self.end
+
+        while len(frames) < count and offset < end:
+            newline = mapped.find(b"\n", offset, end)
+            if newline == -1:
+                newline = end
+            if newline > offset:
+                frames.append(mapped[offset:newline])
+            offset = newline + 1
+
+        self.offset = min(offset, end)
+        return frames
+
+    @coroutine
+    def read_many(self, count):
+        items = []
+
+        while not items:
+            if self.mmap is None or self.offset >= self.end:
+                yield from self.close()
+                raise IOFinished()
+
+            items = decode_frames(self.codec, self._frames(count), self.status.error)
+
+        self.status.inc("read_count", len(items))
+        return items
+
+    @coroutine
+    def read(self):
+        return (yield from self.read_many(1))[0]
+
+    def position(self):
+        return self.offset
+
+    def seek(self, position):
+        self.offset = position
+
+    @coroutine
+    def close(self):
+        if self.fd.closed:
+            return
+
+        self.status.set("closed", True)
+        if self.mmap is not None:
+            self.mmap.close()
+        self.fd.close()
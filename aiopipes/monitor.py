@@ -1,4 +1,4 @@
-from asyncio import coroutine, sleep
+from asyncio import coroutine, sleep, start_server, wait_for
 
 try:
     from asyncio import ensure_future
@@ -7,7 +7,8 @@ except ImportError:
 
 from .pipeline import Pipeline
 from .runner import Runnable
-from .pipeio import Output, FileIO
+from .pipeio import Output, FileIO, QueueIO
+import os
 import shutil
 
 
@@ -38,32 +39,54 @@ class BaseMonitor(Runnable):
                 return
 
             try:
-                pipe_stats = [
-                    {
-                        "input": r.input.status.get_stats(),
-                        "output": r.output.status.get_stats(),
-                        "task": r.status.get_stats(),
-                        "name": r.name,
-                        "futures": r.worker_futures
-                    }
-                    for r in self.pipe.pipes]
-
+                monitor_info = self.collect()
             except Exception as e:
                 self.status.error(e)
                 return
 
-            monitor_info = {
-                "name": self.pipe.name,
-                "runtime": self.pipe.runtime,
-                "pipes": pipe_stats,
-                "futures": self.pipe.worker_futures
-            }
             yield from self.display(monitor_info)
 
+    def collect(self):
+        pipe_stats = [
+            {
+                "input": r.input.status.get_stats(),
+                "output": r.output.status.get_stats() if r.output is not None else {},
+                "task": r.status.get_stats(),
+                "name": r.name,
+                "concurrency": r.concurrency,
+                "workers": r.workers,
+                "futures": r.worker_futures
+            }
+            for r in self.pipe.pipes]
+
+        return {
+            "name": self.pipe.name,
+            "runtime": self.pipe.runtime,
+            "task": self.pipe.status.get_stats(),
+            "pipes": pipe_stats,
+            "futures": self.pipe.worker_futures
+        }
+
     @coroutine
     def display(self, info):
         raise NotImplementedError()
 
+    @staticmethod
+    def bottleneck(info):
+        """
+        The name of the stage that can handle the fewest items per second, given its mean service time
+        and how many items it works on at once (for an executor stage, the pool's workers)
+        """
+        capacities = {}
+
+        for sub_pipe in info["pipes"]:
+            mean = sub_pipe["task"].get("service_time", {}).get("mean")
+            if mean:
+                capacities[sub_pipe["name"]] = (sub_pipe["workers"] or 1) / mean
+
+        if capacities:
+            return min(capacities, key=capacities.get)
+
 
 class ConsoleMonitor(BaseMonitor):
     def _convert_to_io(self, value, _raise=False):
@@ -99,11 +122,16 @@ class ConsoleMonitor(BaseMonitor):
 
         w("{i[name]}: {pipe_len} pipes", pipe_len=len(info["pipes"]))
         w("Runtime: {i[runtime]:.0f} seconds")
+        if "memory_budget" in info["task"]:
+            w("Memory: {used}/{i[task][memory_budget]} bytes queued", used=info["task"].get("memory_used", 0))
+
+        bottleneck = self.bottleneck(info)
 
         for sub_pipe in info["pipes"]:
-            errors = "[Errors: {}]".format(len(sub_pipe["task"]["error_list"]))\
-                if sub_pipe["task"].get("error_list", None) else ""
-            w(pre(1) + " {p[name]} {errors}", p=sub_pipe, errors=errors)
+            errors = "[Errors: {}]".format(sub_pipe["task"]["error_total"])\
+                if sub_pipe["task"].get("error_total", None) else ""
+            slowest = " << bottleneck" if sub_pipe["name"] == bottleneck and len(info["pipes"]) > 1 else ""
+            w(pre(1) + " {p[name]} {errors}{slowest}", p=sub_pipe, errors=errors, slowest=slowest)
             inp = sub_pipe["input"]
             if "percentage_done" in inp:
                 percent = "{inp[percentage_done][percent]:3}% done".format(inp=inp)
@@ -116,6 +144,15 @@ class ConsoleMonitor(BaseMonitor):
             w(pre() + " Input: {current}/{max} read. {percent}", inp=inp, current=current, max=max, percent=percent)
             if "percentage_done" in inp:
                 w(pre() + " " + prog(inp["percentage_done"]["percent"], current, max))
+            if "maxsize" in inp:
+                w(pre() + " Queue: {queued}/{inp[maxsize]} full", inp=inp, queued=inp.get("queued", 0))
+
+            service_time = sub_pipe["task"].get("service_time", {})
+            if service_time.get("count"):
+                w(pre() + " Rate: {rate[10s]:.1f}/s. Service: p50 {s[p50]:.4f}s p99 {s[p99]:.4f}s",
+                  rate=sub_pipe["task"]["throughput"], s=service_time)
+            if inp.get("queue_wait", {}).get("count"):
+                w(pre() + " Queue wait: p50 {q[p50]:.4f}s p99 {q[p99]:.4f}s", q=inp["queue_wait"])
 
             if sub_pipe["task"]["subtasks"]:
                 w(pre() + " Tasks:")
@@ -126,3 +163,137 @@ class ConsoleMonitor(BaseMonitor):
                     w(pre(2) + " " + prog(subtask["percentage_done"]["percent"], current=current, max=max))
 
         yield from self.output.write("\n".join(outputs))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsMonitor(BaseMonitor):
+    """
+    Publishes pipeline metrics in the Prometheus text format, either on an HTTP /metrics endpoint or by
+    rewriting a textfile collector file every interval seconds. Metrics are read straight from the live
+    counters when they are asked for instead of walking get_stats().
+    """
+    # Histogram bucket bounds, in seconds: powers of four from 1us to about 18 minutes
+    buckets = [1e-6 * 4 ** power for power in range(16)]
+
+    def __init__(self, obj: Pipeline, host="127.0.0.1", port=None, textfile=None, interval=1, prefix="aiopipes"):
+        self.host = host
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.prefix = prefix
+        self.server = None
+        super().__init__(obj)
+
+    @coroutine
+    def start_server(self):
+        self.server = yield from start_server(self._handle, self.host, self.port)
+        return self.server.sockets[0].getsockname()[1]
+
+    @coroutine
+    def stop_server(self):
+        if self.server is not None:
+            self.server.close()
+            yield from self.server.wait_closed()
+            self.server = None
+
+    @coroutine
+    def monitor(self, future):
+        if self.port is not None:
+            yield from self.start_server()
+
+        try:
+            yield from super().monitor(future)
+        finally:
+            yield from self.stop_server()
+
+    @coroutine
+    def _run(self):
+        while True:
+            yield from sleep(self.interval)
+            if self.textfile:
+                self.write_textfile()
+            if self.monitor_future.done():
+                return
+
+    def write_textfile(self):
+        temp_name = "{0}.{1}.tmp".format(self.textfile, os.getpid())
+        with open(temp_name, "w") as fd:
+            fd.write(self.render())
+        os.replace(temp_name, self.textfile)
+
+    @coroutine
+    def _handle(self, reader, writer):
+        try:
+            request = yield from wait_for(reader.readline(), 5)
+            while (yield from wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render()
+            else:
+                status, body = "404 Not Found", "Not found\n"
+
+            body = body.encode("utf-8")
+            writer.write("HTTP/1.0 {0}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         "Content-Length: {1}\r\n\r\n".format(status, len(body)).encode("ascii") + body)
+            yield from writer.drain()
+        except Exception as e:
+            self.status.error(e)
+        finally:
+            writer.close()
+
+    def render(self):
+        families = {}
+
+        def add(name, kind, labels, value, suffix=""):
+            family = families.setdefault(self.prefix + "_" + name, (kind, []))
+            label_text = ",".join('{0}="{1}"'.format(k, _label(v)) for k, v in labels)
+            family[1].append("{0}{1}{{{2}}} {3}".format(self.prefix + "_" + name, suffix, label_text, value))
+
+        def histogram(name, labels, histogram):
+            for bound in self.buckets:
+                bucket_labels = labels + [("le", "{0:g}".format(bound))]
+                add(name, "histogram", bucket_labels, histogram.count_below(bound), "_bucket")
+            add(name, "histogram", labels + [("le", "+Inf")], histogram.count, "_bucket")
+            add(name, "histogram", labels, histogram.total, "_sum")
+            add(name, "histogram", labels, histogram.count, "_count")
+
+        pipeline = [("pipeline", self.pipe.name)]
+        add("runtime_seconds", "gauge", pipeline, self.pipe.runtime)
+        if self.pipe.memory_budget:
+            memory_used = self.pipe.status.status_data.get("memory_used")
+            add("memory_used_bytes", "gauge", pipeline, memory_used() if callable(memory_used) else 0)
+            add("memory_budget_bytes", "gauge", pipeline, self.pipe.memory_budget)
+
+        for position, runner in enumerate(self.pipe.pipes):
+            labels = pipeline + [("stage", runner.name), ("position", position)]
+            data = runner.status.status_data
+
+            if runner.input is not None and "read_count" in runner.input.status.status_data:
+                add("items_read_total", "counter", labels, runner.input.status.status_data["read_count"])
+            if runner.output is not None and "write_count" in runner.output.status.status_data:
+                add("items_written_total", "counter", labels, runner.output.status.status_data["write_count"])
+            if "done_count" in data:
+                add("items_processed_total", "counter", labels, data["done_count"])
+            add("errors_total", "counter", labels, runner.status.error_total)
+            add("workers", "gauge", labels, sum(1 for f in runner.worker_futures if not f.done()))
+
+            if isinstance(runner.input, QueueIO):
+                add("queue_depth", "gauge", labels, runner.input.queue.items_queued)
+                add("queue_maxsize", "gauge", labels, runner.input.queue.maxsize)
+                if runner.input.queue.wait_times is not None:
+                    histogram("queue_wait_seconds", labels, runner.input.queue.wait_times)
+
+            metrics = getattr(runner, "metrics", None)
+            if metrics is not None:
+                histogram("service_time_seconds", labels, metrics.service_time)
+
+        lines = []
+        for name, (kind, samples) in sorted(families.items()):
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,330 @@
+"""
+Inputs and outputs that connect pipelines over TCP or Unix sockets, so the tail of one pipeline can
+feed the head of another in a different process or on a different host.
+
+Every message is a frame: a 4 byte length, a 1 byte kind and a body. Items travel in batches encoded
+with one of the usual codecs. A SocketInput gives each connection window items of credit to start with,
+and hands credit back for a batch only once its items fit in the input's own bounded queue, so a slow
+consumer pushes back on its producers just as a full QueueIO would.
+"""
+from asyncio import coroutine, get_event_loop, open_connection, start_server, sleep, Future, Lock
+from asyncio import IncompleteReadError
+import json
+import struct
+import time
+import uuid
+
+try:
+    from asyncio import ensure_future
+except ImportError:
+    from asyncio import async as ensure_future
+
+try:
+    from asyncio import open_unix_connection, start_unix_server
+except ImportError:
+    open_unix_connection = start_unix_server = None
+
+from .codecs import get_codec, decode_frames
+from .pipeio import Input, Output, IOFinished
+from .queue import Queue
+
+__all__ = ["SocketInput", "SocketOutput"]
+
+_FRAME = struct.Struct(">IB")
+_COUNT = struct.Struct(">I")
+HELLO, DATA, CREDIT, END = b"HDCE"
+# Anything bigger is a broken or hostile peer, not a batch
+MAX_FRAME = 1 << 28
+
+
+def _send_frame(writer, kind, body=b""):
+    writer.write(_FRAME.pack(len(body), kind) + body)
+
+
+@coroutine
+def _read_frame(reader):
+    length, kind = _FRAME.unpack((yield from reader.readexactly(_FRAME.size)))
+    if length > MAX_FRAME:
+        raise ValueError("Frame of {0} bytes is too big".format(length))
+    return kind, (yield from reader.readexactly(length))
+
+
+class SocketInput(Input):
+    """
+    Listens on host and port (port 0 picks a free one) or on the Unix socket path, and reads the items
+    sent by SocketOutputs. It finishes once producers outputs have closed, however many connections
+    each of them opened. Call listen() first to find the port, otherwise the first read starts it.
+    """
+    status_props = {"connections", "queued"}
+
+    def __init__(self, host="127.0.0.1", port=0, path=None, codec="json", producers=1, window=1000, buffer=1000):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.codec = codec
+        self.producers = producers
+        self.window = window
+        self.queue = Queue(maxsize=buffer)
+        self.server = None
+        self.finished_producers = 0
+        # producer id: [connections it opened, connections that have ended]
+        self.producer_connections = {}
+        self.open_connections = 0
+        super().__init__()
+        self.status.func("connections", lambda: self.open_connections)
+        self.status.func("queued", lambda: self.queue.items_queued)
+
+    @coroutine
+    def listen(self):
+        if self.server is not None:
+            return
+
+        if self.path is not None:
+            if start_unix_server is None:
+                raise RuntimeError("Unix sockets are not supported here")
+            self.server = yield from start_unix_server(self._handle, self.path)
+        else:
+            self.server = yield from start_server(self._handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    def _decode_error(self, ex, frame):
+        self.status.error(ex, frame)
+
+    @coroutine
+    def _handle(self, reader, writer):
+        self.open_connections += 1
+        codec = get_codec(self.codec)
+        producer = None
+
+        try:
+            kind, body = yield from _read_frame(reader)
+            if kind != HELLO:
+                raise ValueError("Expected a hello frame, not {0!r}".format(bytes([kind])))
+
+            hello = json.loads(body.decode("utf-8"))
+            producer = hello["producer"]
+            self.producer_connections.setdefault(producer, [hello["connections"], 0])
+
+            _send_frame(writer, CREDIT, _COUNT.pack(self.window))
+            while True:
+                kind, body = yield from _read_frame(reader)
+                if kind == END:
+                    break
+                if kind != DATA:
+                    raise ValueError("Unexpected frame {0!r}".format(bytes([kind])))
+
+                count = _COUNT.unpack_from(body)[0]
+                frames = codec.split(body[_COUNT.size:]) + codec.finish()
+                items = decode_frames(codec, frames, self._decode_error)
+                self.status.inc("read_count", len(items))
+
+                # Blocks while the pipeline is behind, which holds back this producer's credit
+                yield from self.queue.put_many(items)
+                _send_frame(writer, CREDIT, _COUNT.pack(count))
+                try:
+                    yield from writer.drain()
+                except ConnectionError:
+                    # The producer isn't listening for credit any more, but its frames may still be buffered
+                    pass
+        except (IncompleteReadError, ConnectionError, ValueError) as ex:
+            self.status.error(ex)
+        finally:
+            self.open_connections -= 1
+            writer.close()
+            if producer is not None:
+                yield from self._connection_ended(producer)
+
+    @coroutine
+    def _connection_ended(self, producer):
+        connections = self.producer_connections[producer]
+        connections[1] += 1
+        if connections[1] < connections[0]:
+            return
+
+        self.finished_producers += 1
+        if self.finished_producers == self.producers:
+            self.server.close()
+            yield from self.queue.close()
+
+    @coroutine
+    def read(self):
+        if self.server is None:
+            yield from self.listen()
+
+        item = yield from self.queue.get_object()
+        if item is None:
+            self.status.set("closed", True)
+            raise IOFinished()
+        return item
+
+    @coroutine
+    def read_many(self, count):
+        if self.server is None:
+            yield from self.listen()
+
+        items = yield from self.queue.get_many(count)
+        if not items:
+            self.status.set("closed", True)
+            raise IOFinished()
+        return items
+
+
+class _Connection(object):
+    __slots__ = ("reader", "writer", "credits", "task", "closed")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.credits = 0
+        self.task = None
+        self.closed = False
+
+
+class SocketOutput(Output):
+    """
+    Sends items to a SocketInput at host and port, or at the Unix socket path. Items go in batches of
+    batch_size, or whatever has built up after linger seconds, over a pool of connections: each batch
+    takes the connection with the most credit, and writes wait when none has any. The consumer doesn't
+    have to be up yet, connecting is retried for connect_timeout seconds.
+    """
+    status_props = {"connections", "credit_wait_count"}
+
+    def __init__(self, host="127.0.0.1", port=None, path=None, codec="json", batch_size=100, linger=0.1,
+                 connections=1, connect_timeout=30):
+        if port is None and path is None:
+            raise RuntimeError("SocketOutput needs a port or a path to connect to")
+
+        self.host = host
+        self.port = port
+        self.path = path
+        self.codec = get_codec(codec)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.connections = connections
+        self.connect_timeout = connect_timeout
+        self.pool = []
+        self._batch = []
+        self._linger_handle = None
+        self._credit = None
+        self._lock = Lock()
+        super().__init__()
+        self.status.func("connections", lambda: sum(1 for connection in self.pool if not connection.closed))
+
+    @coroutine
+    def _open(self):
+        deadline = time.monotonic() + self.connect_timeout
+        delay = 0.05
+        while True:
+            try:
+                if self.path is not None:
+                    return (yield from open_unix_connection(self.path))
+                return (yield from open_connection(self.host, self.port))
+            except OSError:
+                if time.monotonic() + delay > deadline:
+                    raise
+                yield from sleep(delay)
+                delay = min(delay * 2, 1)
+
+    @coroutine
+    def connect(self):
+        if self.pool:
+            return
+
+        hello = json.dumps({"producer": uuid.uuid4().hex, "connections": self.connections}).encode("utf-8")
+        for _ in range(self.connections):
+            reader, writer = yield from self._open()
+            _send_frame(writer, HELLO, hello)
+            connection = _Connection(reader, writer)
+            connection.task = ensure_future(self._read_credit(connection))
+            self.pool.append(connection)
+
+    @coroutine
+    def _read_credit(self, connection):
+        try:
+            while True:
+                kind, body = yield from _read_frame(connection.reader)
+                if kind == CREDIT:
+                    connection.credits += _COUNT.unpack(body)[0]
+                    self._wake()
+        except (IncompleteReadError, ConnectionError, ValueError):
+            connection.closed = True
+            self._wake()
+
+    def _wake(self):
+        if self._credit is not None and not self._credit.done():
+            self._credit.set_result(None)
+
+    @coroutine
+    def _send(self, items):
+        if not self.pool:
+            yield from self.connect()
+
+        while items:
+            open_connections = [connection for connection in self.pool if not connection.closed]
+            if not open_connections:
+                raise ConnectionError("The consumer closed every connection")
+
+            connection = max(open_connections, key=lambda c: c.credits)
+            if connection.credits <= 0:
+                self.status.inc("credit_wait_count")
+                self._credit = Future()
+                yield from self._credit
+                continue
+
+            batch, items = items[:connection.credits], items[connection.credits:]
+            connection.credits -= len(batch)
+            body = b"".join([_COUNT.pack(len(batch))] + [self.codec.dumps(item) for item in batch])
+            _send_frame(connection.writer, DATA, body)
+            yield from connection.writer.drain()
+
+    @coroutine
+    def _send_batches(self, final=False):
+        # One sender at a time, so batches leave in the order they were written
+        with (yield from self._lock):
+            while len(self._batch) >= self.batch_size or (final and self._batch):
+                batch, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+                yield from self._send(batch)
+
+        if not self._batch and self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        elif self._batch and self.linger is not None and self._linger_handle is None:
+            self._linger_handle = get_event_loop().call_later(self.linger, self._linger_expired)
+
+    def _linger_expired(self):
+        self._linger_handle = None
+        ensure_future(self.flush())
+
+    @coroutine
+    def write(self, data):
+        self._batch.append(data)
+        self.status.inc("write_count")
+        yield from self._send_batches()
+
+    @coroutine
+    def write_many(self, items):
+        self._batch.extend(items)
+        self.status.inc("write_count", len(items))
+        yield from self._send_batches()
+
+    @coroutine
+    def flush(self):
+        yield from self._send_batches(final=True)
+
+    @coroutine
+    def close(self):
+        yield from self.flush()
+        if not self.pool:
+            yield from self.connect()
+
+        for connection in self.pool:
+            if not connection.closed:
+                _send_frame(connection.writer, END)
+                yield from connection.writer.drain()
+
+        # Wait for the consumer to hang up, so closing our end can't throw away frames it hasn't read
+        for connection in self.pool:
+            yield from connection.task
+            connection.writer.close()
+
+        self.status.set("closed", True)
@@ -1,25 +1,83 @@
-from asyncio import coroutine
+from asyncio import coroutine, get_event_loop, Lock
 import json
-from collections import Iterable, Sized
+from collections import Iterable, Sized, deque
 import io
+import itertools
 import os
-
-from .queue import Queue
+import sys
+
+try:
+    from asyncio import ensure_future
+except ImportError:
+    from asyncio import async as ensure_future
+
+from .codecs import Codec, get_codec, decode_frames
+from .compression import detect, suffix_compression, CompressedReader, CompressedWriter
+from .metrics import Histogram
+from .queue import Queue, MemoryBudget
+from .streams import open_reader, open_writer
 from .status import StatusMixin
 
-__all__ = ["Input", "Output", "FileIO", "QueueIO"]
+__all__ = ["Input", "Output", "FileIO", "BinaryFileIO", "IterableIO", "AsyncIterableIO", "QueueIO"]
 
 
 class IOFinished(Exception):
     pass
 
 
+def batch_rows(batch):
+    """
+    The number of rows in a columnar batch: an Arrow RecordBatch or Table, a NumPy array, a dict of
+    equal length columns or a list of rows
+    """
+    num_rows = getattr(batch, "num_rows", None)
+    if num_rows is not None:
+        return num_rows
+    if isinstance(batch, dict):
+        return len(next(iter(batch.values()))) if batch else 0
+    return len(batch)
+
+
+def batch_nbytes(batch):
+    """
+    Memory held by a batch's columns, for a memory budget. sys.getsizeof only sees the wrapper.
+    """
+    nbytes = getattr(batch, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    return sys.getsizeof(batch)
+
+
 class Input(StatusMixin):
     status_props = {"read_count", "closed", "error_count"}
     @coroutine
     def read(self):
         raise NotImplementedError()
 
+    @coroutine
+    def read_many(self, count):
+        items = []
+
+        while len(items) < count:
+            try:
+                items.append((yield from self.read()))
+            except IOFinished:
+                if not items:
+                    raise
+                break
+
+        return items
+
+    def position(self):
+        """
+        Where the next read will come from, as something seek() takes, or None if this input can't say.
+        Used by checkpoints.
+        """
+        return None
+
+    def seek(self, position):
+        raise NotImplementedError("{0} cannot seek".format(self.__class__.__name__))
+
 
 class Output(StatusMixin):
     status_props = {"write_count", "closed", "error_count"}
@@ -28,30 +86,110 @@ class Output(StatusMixin):
     def write(self, data):
         raise NotImplementedError()
 
+    @coroutine
+    def write_many(self, items):
+        for item in items:
+            yield from self.write(item)
+
+    @coroutine
+    def flush(self):
+        pass
+
+    @coroutine
+    def sync(self):
+        """
+        Flush, then wait until everything written so far has reached its destination, e.g. the disk.
+        Used by checkpoints.
+        """
+        yield from self.flush()
+
     @coroutine
     def close(self):
         raise NotImplementedError()
 
 
 class FileIO(Input, Output):
+    """
+    Reads and writes one JSON object per line of a text file. Files with a binary buffer underneath
+    (anything from open(), sys.stdin and sys.stdout) go through the same readers and writers as
+    BinaryFileIO, so with nonblocking=True pipes and terminals use asyncio streams and regular files
+    are read and written in a background thread. Output is written every flush_size bytes, or every
+    line for a terminal.
+    """
     status_props = {"percentage_read"}
 
-    def __init__(self, fd: io.TextIOBase, raw_strings=False):
+    def __init__(self, fd: io.TextIOBase, raw_strings=False, chunk_size=1 << 16, flush_size=1 << 16,
+                 nonblocking=True):
         self.fd = fd
         self.raw_strings = raw_strings
+        # The binary file under the text one, or None for in-memory files like StringIO
+        self.raw = getattr(fd, "buffer", None)
+        self.encoding = getattr(fd, "encoding", None) or "utf-8"
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.nonblocking = nonblocking
+        self.reader = None
+        self.writer = None
+        # Byte offset of the next line to be read
+        self.offset = 0
+        self._lines = deque()
+        self._tail = b""
+        self._eof = False
+        self._fill_lock = Lock()
+        self._write_buffer = bytearray()
         super().__init__()
 
-        if isinstance(fd, io.FileIO):
-            try:
-                os.path.getsize(fd.name)
-            except os.error:
-                pass
-            else:
-                self.status.percentage("read", lambda: self.fd.tell(), lambda: os.path.getsize(fd.name))
+        try:
+            size = os.fstat(fd.fileno()).st_size
+            if fd.isatty():
+                self.flush_size = 0
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            size = 0
+
+        if size and self.raw is not None:
+            self.status.percentage("read", lambda: self.offset, lambda: max(size, self.offset))
+
+    @coroutine
+    def _fill(self):
+        # Parallel workers share one input, and each chunk must be read and split by only one of them
+        with (yield from self._fill_lock):
+            if self.reader is None:
+                try:
+                    self.offset = self.fd.tell()
+                except (OSError, io.UnsupportedOperation):
+                    self.offset = 0
+                self.reader = yield from open_reader(self.raw, self.chunk_size, self.nonblocking)
+
+            while not self._lines and not self._eof:
+                chunk = yield from self.reader.read()
+                if not chunk:
+                    self._eof = True
+                    lines = [self._tail] if self._tail else []
+                    self._tail = b""
+                else:
+                    lines = (self._tail + chunk).split(b"\n")
+                    self._tail = lines.pop()
+                    lines = [line + b"\n" for line in lines]
+                self._lines.extend(lines)
+
+    @coroutine
+    def _readline(self):
+        if self.raw is None:
+            return self.fd.readline()
+
+        yield from self._fill()
+        if not self._lines:
+            return ""
+        line = self._lines.popleft()
+        self.offset += len(line)
+        return line.decode(self.encoding)
 
     @coroutine
     def read(self):
-        line = self.fd.readline()
+        if self.fd.closed:
+            raise IOFinished()
+
+        line = yield from self._readline()
 
         if not line:
             yield from self.close()
@@ -70,42 +208,337 @@ class FileIO(Input, Output):
         try:
             if not self.raw_strings or not isinstance(data, str):
                 data = json.dumps(data)
-            self.fd.write(data + "\n")
-            self.status.inc("write_count")
         except Exception as e:
             self.status.error(e)
             raise IOError("Could not encode JSON object")
 
+        self.status.inc("write_count")
+        if self.raw is None:
+            self.fd.write(data + "\n")
+            return
+
+        self._write_buffer += (data + "\n").encode(self.encoding)
+        if len(self._write_buffer) >= self.flush_size:
+            yield from self.flush()
+
+    def position(self):
+        if self.fd.closed:
+            return None
+        return self.fd.tell() if self.raw is None else self.offset
+
+    def seek(self, position):
+        self.fd.seek(position)
+        if self.raw is not None:
+            self.offset = position
+            self.reader = None
+            self._lines.clear()
+            self._tail = b""
+            self._eof = False
+
+    @coroutine
+    def flush(self):
+        if self.raw is None:
+            self.fd.flush()
+            return
+
+        if self._write_buffer:
+            if self.writer is None:
+                # Anything already written through the text file goes first
+                self.fd.flush()
+                self.writer = yield from open_writer(self.raw, self.nonblocking)
+
+            data, self._write_buffer = bytes(self._write_buffer), bytearray()
+            yield from self.writer.write(data)
+
+    @coroutine
+    def sync(self):
+        yield from self.flush()
+        if self.writer is not None:
+            yield from self.writer.sync()
+
     @coroutine
     def close(self):
+        yield from self.flush()
+        if self.writer is not None and not self.fd.closed:
+            yield from self.writer.close()
+
         self.status.set("closed", True)
         self.fd.close()
 
 
-class QueueIO(Input, Output):
-    status_props = {"queued", "percentage_done"}
+class BinaryFileIO(Input, Output):
+    """
+    Reads a binary file in large chunks and decodes every complete frame in the chunk at once.
+    Writes are encoded into a buffer that is flushed to the file every flush_size bytes.
 
-    def __init__(self, queue: Queue = None):
-        self.queue = queue or Queue()
+    With nonblocking=True pipes, sockets and terminals go through asyncio streams and regular files
+    are read ahead and written in a background thread, so a slow disk never stalls the event loop.
+
+    gzip, bz2, xz and zstd input is recognised and decompressed as it is read, and output is compressed
+    if the file's name ends in .gz, .bz2, .xz or .zst. Pass compression to choose (or None to turn this
+    off) and compression_level to trade speed for size.
+    """
+    status_props = {"percentage_read"}
+
+    def __init__(self, fd: io.BufferedIOBase, codec="auto", chunk_size=1 << 20, flush_size=1 << 16,
+                 nonblocking=True, compression="auto", compression_level=None):
+        self.fd = fd
+        self.codec = get_codec(codec)
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.nonblocking = nonblocking
+        self.compression = compression
+        self.compression_level = compression_level
+        self.reader = None
+        self.writer = None
+        self.bytes_read = 0
+        self._items = deque()
+        self._write_buffer = bytearray()
+        self._eof = False
+        self._fill_lock = Lock()
+        # The first chunk of an uncompressed file, read while looking for a compression header
+        self._first = b""
         super().__init__()
-        self.status.func("queued", lambda: self.queue.items_queued)
-        self.status.percentage("done", "read_count", "write_count")
+
+        try:
+            size = os.fstat(fd.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            size = 0
+
+        if size:
+            self.status.percentage("read", self._file_position, lambda: max(size, self._file_position()))
+
+    def _file_position(self):
+        # Progress through the file itself, so compressed bytes for a compressed file
+        if isinstance(self.reader, CompressedReader):
+            return self.reader.compressed_bytes
+        return self.bytes_read
+
+    @coroutine
+    def _open_reader(self):
+        reader = yield from open_reader(self.fd, self.chunk_size, self.nonblocking)
+        if self.compression is None:
+            return reader
+
+        first = b""
+        compression = self.compression
+        if compression == "auto":
+            first = yield from reader.read()
+            compression = detect(first)
+            if compression is None:
+                self._first = first
+                return reader
+        return CompressedReader(reader, compression, first, self.chunk_size)
+
+    @coroutine
+    def _fill(self):
+        # Parallel workers share one input, and each chunk must be read and decoded by only one of them
+        with (yield from self._fill_lock):
+            if self.reader is None:
+                self.reader = yield from self._open_reader()
+
+            while not self._items and not self._eof:
+                if self._first:
+                    chunk, self._first = self._first, b""
+                else:
+                    chunk = yield from self.reader.read()
+
+                if chunk:
+                    self.bytes_read += len(chunk)
+                    frames = self.codec.split(chunk)
+                else:
+                    self._eof = True
+                    frames = self.codec.finish()
+
+                self._items.extend(decode_frames(self.codec, frames, self.status.error))
+
+    @coroutine
+    def _ensure_items(self):
+        if not self._items:
+            yield from self._fill()
+
+            if not self._items:
+                if not self.fd.closed:
+                    yield from self.close()
+                raise IOFinished()
+
+    @coroutine
+    def read(self):
+        yield from self._ensure_items()
+        self.status.inc("read_count")
+        return self._items.popleft()
+
+    @coroutine
+    def read_many(self, count):
+        yield from self._ensure_items()
+        items = [self._items.popleft() for _ in range(min(count, len(self._items)))]
+        self.status.inc("read_count", len(items))
+        return items
+
+    def _encode(self, data):
+        try:
+            self._write_buffer += self.codec.dumps(data)
+        except Exception as e:
+            self.status.error(e, data)
+            raise IOError("Could not encode object")
 
     @coroutine
     def write(self, data):
+        self._encode(data)
         self.status.inc("write_count")
-        yield from self.queue.put_object(data)
+
+        if len(self._write_buffer) >= self.flush_size:
+            yield from self.flush()
+
+    @coroutine
+    def write_many(self, items):
+        for item in items:
+            self._encode(item)
+        self.status.inc("write_count", len(items))
+
+        if len(self._write_buffer) >= self.flush_size:
+            yield from self.flush()
+
+    @coroutine
+    def _open_writer(self):
+        writer = yield from open_writer(self.fd, self.nonblocking)
+        compression = self.compression
+        if compression == "auto":
+            compression = suffix_compression(getattr(self.fd, "name", None))
+        if compression is None:
+            return writer
+        return CompressedWriter(writer, compression, self.compression_level)
+
+    @coroutine
+    def flush(self):
+        if self._write_buffer:
+            if self.writer is None:
+                self.writer = yield from self._open_writer()
+
+            data, self._write_buffer = bytes(self._write_buffer), bytearray()
+            yield from self.writer.write(data)
+
+    @coroutine
+    def sync(self):
+        yield from self.flush()
+        if self.writer is not None:
+            yield from self.writer.sync()
+
+    @coroutine
+    def close(self):
+        yield from self.flush()
+        if self.writer is not None:
+            yield from self.writer.close()
+
+        self.status.set("closed", True)
+        self.fd.close()
+
+
+class QueueIO(Input, Output):
+    status_props = {"queued", "maxsize", "queue_wait", "percentage_done"}
+
+    def __init__(self, queue: Queue = None, batch_size=None, linger=0.1, maxsize=0, budget: MemoryBudget = None,
+                 columnar=False):
+        self.queue = queue or Queue(maxsize=maxsize, wait_times=Histogram())
+        self.batch_size = batch_size
+        self.linger = linger
+        self.budget = budget
+        # Items are columnar batches, and read_count and write_count count their rows
+        self.columnar = columnar
+        self._batch = []
+        self._linger_handle = None
+        super().__init__()
+        self.status.func("queued", lambda: self.queue.items_queued + len(self._batch))
+        self.status.set("maxsize", self.queue.maxsize)
+        if self.queue.wait_times is not None:
+            self.status.func("queue_wait", self.queue.wait_times.get_stats)
+        self.status.percentage("done", "read_count", "write_count")
+
+    def _rows(self, items):
+        return sum(batch_rows(item) for item in items) if self.columnar else len(items)
+
+    def _empty(self):
+        return not self.queue.items_queued and not self._batch
+
+    @coroutine
+    def write(self, data):
+        self.status.inc("write_count", batch_rows(data) if self.columnar else 1)
+
+        if self.budget:
+            yield from self.budget.acquire(self.budget.sizeof(data), self._empty)
+
+        if not self.batch_size:
+            yield from self.queue.put_object(data)
+            return
+
+        self._batch.append(data)
+        yield from self._check_batch()
+
+    @coroutine
+    def write_many(self, items):
+        self.status.inc("write_count", self._rows(items))
+
+        if self.budget:
+            yield from self.budget.acquire(sum(self.budget.sizeof(item) for item in items), self._empty)
+
+        if not self.batch_size:
+            yield from self.queue.put_many(items)
+            return
+
+        self._batch.extend(items)
+        yield from self._check_batch()
+
+    @coroutine
+    def _check_batch(self):
+        while len(self._batch) >= self.batch_size:
+            batch, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+            yield from self.queue.put_many(batch)
+
+        if not self._batch and self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        elif self._batch and self.linger is not None and self._linger_handle is None:
+            self._linger_handle = get_event_loop().call_later(self.linger, self._linger_expired)
+
+    def _linger_expired(self):
+        self._linger_handle = None
+        ensure_future(self.flush())
+
+    @coroutine
+    def flush(self):
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+
+        if self._batch:
+            batch, self._batch = self._batch, []
+            yield from self.queue.put_many(batch)
 
     @coroutine
     def read(self):
         d = yield from self.queue.get_object()
         if d is None:
             raise IOFinished()
-        self.status.inc("read_count")
+        self.status.inc("read_count", batch_rows(d) if self.columnar else 1)
+
+        if self.budget:
+            self.budget.release(self.budget.sizeof(d))
         return d
 
+    @coroutine
+    def read_many(self, count):
+        items = yield from self.queue.get_many(count)
+        if not items:
+            raise IOFinished()
+        self.status.inc("read_count", self._rows(items))
+
+        if self.budget:
+            self.budget.release(sum(self.budget.sizeof(item) for item in items))
+        return items
+
     @coroutine
     def close(self):
+        yield from self.flush()
         self.status.set("closed", True)
         return (yield from self.queue.close())
 
@@ -136,3 +569,34 @@ class IterableIO(Input):
     def reset(self):
         self.it = iter(self.iterable)
         self.status.set("read_count", 0)
+
+    def position(self):
+        return self.status.status_data["read_count"]
+
+    def seek(self, position):
+        # Iterators can only go forwards: start again and skip the first position items
+        self.reset()
+        next(itertools.islice(self.it, position, position), None)
+        self.status.set("read_count", position)
+
+
+class AsyncIterableIO(Input):
+    """
+    Reads from anything that works with async for, such as an async generator, so a source that has
+    to wait on IO does it without blocking the loop
+    """
+    def __init__(self, it):
+        self.iterable = it
+        self.it = it.__aiter__()
+        super().__init__()
+
+    @coroutine
+    def read(self):
+        try:
+            o = yield from self.it.__anext__()
+            self.status.inc("read_count")
+        except StopAsyncIteration:
+            self.status.set("closed", True)
+            raise IOFinished()
+
+        return o
@@ -1,5 +1,6 @@
 from collections import Iterable
 import inspect
+import sys
 from asyncio import coroutine, wait
 
 try:
@@ -8,15 +9,30 @@ except ImportError:
     from asyncio import async as ensure_future
 
 from . import QueueIO
+from .checkpoint import Checkpointer, GatedInput, load_checkpoint
+from .pipeio import batch_nbytes
+from .queue import MemoryBudget
 from aiopipes.runner import Runnable
-from .runner import FunctionRunner
+from .runner import FunctionRunner, FusedRunner, _is_async_generator
 
 
 class Pipeline(Runnable):
-    def __init__(self, name, input=None, output=None, pipes: Iterable = None):
+    status_props = {"memory_used", "memory_budget", "checkpoint_count", "checkpoint_pause"}
+
+    def __init__(self, name, input=None, output=None, pipes: Iterable = None, batch_size=None, linger=0.1,
+                 maxsize=0, memory_budget=None, fuse=True, columnar=False):
         self._name = name
         self.pipes = pipes or []
+        self.fuse = fuse
+        self.runners = []
+        self.checkpointer = None
+        self.resume_from = None
+        self.linger = linger
+        self.memory_budget = memory_budget
         super().__init__(input, output)
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self.columnar = columnar
 
     @property
     def name(self):
@@ -29,36 +45,147 @@ class Pipeline(Runnable):
             else:
                 raise RuntimeError("Cannot convert {type} to a pipe".format(type=type(other)))
 
-        return self.__class__(
+        pipeline = self.__class__(
             self.name,
             self.input,
             self.output,
-            self.pipes + [other]
+            self.pipes + [other],
+            batch_size=self.batch_size,
+            linger=self.linger,
+            maxsize=self.maxsize,
+            memory_budget=self.memory_budget,
+            fuse=self.fuse,
+            columnar=self.columnar
         )
+        pipeline.checkpointer, pipeline.resume_from = self.checkpointer, self.resume_from
+        return pipeline
+
+    def checkpoint(self, path, interval=60, timeout=10):
+        """
+        Write a checkpoint to path every interval seconds, see aiopipes.checkpoint. The pipeline pauses
+        its input for at most timeout seconds while each one is taken.
+        """
+        self.checkpointer = Checkpointer(path, interval, timeout)
+        return self
+
+    def resume(self, checkpoint):
+        """
+        Carry on from a checkpoint, given as a path or as loaded by load_checkpoint()
+        """
+        if not isinstance(checkpoint, dict):
+            checkpoint = load_checkpoint(checkpoint)
+        if checkpoint["finished"]:
+            raise RuntimeError("The pipeline finished after this checkpoint was taken, there is nothing to resume")
+
+        self.resume_from = checkpoint
+        return self
 
     @coroutine
     def _run(self):
         if not self.pipes:
             self.pipes = [FunctionRunner(lambda x: x)]  # Make the pipeline a no-op
 
-        # Hook all our aiopipes together
-        internal_ios = [QueueIO() for _ in self.pipes]
+        budget = None
+        if self.memory_budget:
+            budget = MemoryBudget(self.memory_budget, sizeof=batch_nbytes if self.columnar else sys.getsizeof)
+            self.status.set("memory_budget", budget.limit)
+            self.status.func("memory_used", lambda: budget.used)
+
+        if self.batch_size:
+            for pipe in self.pipes:
+                if pipe.batch_size is None:
+                    pipe.batch_size = self.batch_size
 
-        for idx, pipe in enumerate(self.pipes):
+        # Every item is a whole batch, so stages and queues count rows instead
+        if self.columnar:
+            for pipe in self.pipes:
+                pipe.columnar = True
+
+        self.runners = self._fuse(self.pipes) if self.fuse else list(self.pipes)
+
+        # Hook all our aiopipes together. A stage's own maxsize bounds the queue feeding it.
+        internal_ios = [
+            QueueIO(batch_size=self.batch_size, linger=self.linger, budget=budget,
+                    maxsize=self.maxsize if runner.maxsize is None else runner.maxsize, columnar=self.columnar)
+            for runner in self.runners
+        ]
+
+        for idx, runner in enumerate(self.runners):
             if idx != 0:
-                pipe < internal_ios[idx]
+                runner < internal_ios[idx]
 
             if idx + 1 != len(internal_ios):
-                pipe > internal_ios[idx + 1]
+                runner > internal_ios[idx + 1]
+
+        if self.resume_from is not None:
+            self._restore(self.resume_from)
+
+        gate = None
+        if self.checkpointer is not None:
+            if self.input.position() is None:
+                raise RuntimeError("Cannot checkpoint {0}, it has no position".format(self.input))
+            # They can hold items in their own locals, where a checkpoint can't see them
+            for pipe in self.pipes:
+                if isinstance(pipe, FunctionRunner) and _is_async_generator(pipe.func):
+                    raise RuntimeError("Cannot checkpoint a pipeline with an async generator stage ({0})".format(
+                        pipe.name))
+            gate = GatedInput(self.input)
 
-        self.pipes[0] < self.input
-        self.pipes[-1] > self.output
+        self.runners[0] < (gate or self.input)
+        self.runners[-1] > self.output
+
+        # Fused stages share their runner's ends so monitors can still look at each one
+        for runner in self.runners:
+            for stage in getattr(runner, "stages", []):
+                stage.input, stage.output = runner.input, runner.output
 
         self.worker_futures = [
-            ensure_future(pipe.start()) for pipe in self.pipes
+            ensure_future(runner.start()) for runner in self.runners
             ]
 
-        yield from wait(self.worker_futures)
+        if gate is None:
+            yield from wait(self.worker_futures)
+            return
+
+        checkpoints = ensure_future(self.checkpointer.run(self, gate, internal_ios[1:]))
+        try:
+            yield from wait(self.worker_futures)
+        finally:
+            checkpoints.cancel()
+
+        if not any(future.exception() for future in self.worker_futures if not future.cancelled()):
+            self.checkpointer.finish()
+
+    def _restore(self, checkpoint):
+        self.input.seek(checkpoint["position"])
+        for index, state in checkpoint["states"].items():
+            self.pipes[index].func.restore(state)
+
+    @staticmethod
+    def _fuse(pipes):
+        """
+        Replace every run of two or more adjacent fusable stages with the same batch size by one FusedRunner
+        """
+        runners, run = [], []
+
+        def end_run():
+            if len(run) > 1:
+                runners.append(FusedRunner(list(run)))
+            else:
+                runners.extend(run)
+            del run[:]
+
+        for pipe in pipes:
+            if isinstance(pipe, FunctionRunner) and pipe.fusable():
+                if run and run[0].batch_size != pipe.batch_size:
+                    end_run()
+                run.append(pipe)
+            else:
+                end_run()
+                runners.append(pipe)
+
+        end_run()
+        return runners
 
     def __repr__(self):
         return "<Pipeline {name}>".format(name=self.name)
@@ -1,4 +1,7 @@
-from asyncio import coroutine, Future, Queue as ioQueue
+from asyncio import coroutine, Future, Queue as ioQueue, QueueFull
+from collections import deque
+import sys
+import time
 
 
 class QueueDone(Exception):
@@ -6,34 +9,146 @@ class QueueDone(Exception):
         self.future = future
 
 
+class Batch(list):
+    """
+    A list of items that travels through the queue as a single entry
+    """
+
+
 class Queue(object):
-    def __init__(self, queue: ioQueue=None):
+    """
+    maxsize counts items, however they are batched into entries. A batch bigger than maxsize is still
+    let into an empty queue, so it can't block forever.
+    """
+    def __init__(self, queue: ioQueue=None, maxsize=0, wait_times=None):
         self._queue = queue or ioQueue()
+        self._maxsize = maxsize
+        self._space_waiters = deque()
+        self._pending = deque()
+        self._count = 0
         self.finished = False
+        # A Histogram of how long entries sat in the queue, if given. Only one entry in every
+        # wait_sample_every is timed, weighted by the number of items it stands for.
+        self.wait_times = wait_times
+        self.wait_sample_every = 8
+        self._put_times = deque()
+        self._puts = 0
+        self._unsampled = 0
 
     @property
     def items_queued(self):
-        return self._queue.qsize()
+        return self._count
+
+    @property
+    def maxsize(self):
+        return self._maxsize or self._queue.maxsize
+
+    @coroutine
+    def _wait_for_space(self, count):
+        while self._maxsize and self._count and self._count + count > self._maxsize:
+            waiter = Future()
+            self._space_waiters.append(waiter)
+            yield from waiter
+
+    def _wake_writers(self):
+        while self._space_waiters:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _finish(self, done: QueueDone):
+        if not done.future.done():
+            done.future.set_result(True)
+        self.finished = True
+
+        # Put the marker back so any other reader blocked on this queue also sees the end
+        try:
+            self._queue.put_nowait(done)
+        except QueueFull:
+            pass
+
+    def _take(self, obj):
+        # Returns the first item from a queue entry, stashing the rest of a batch
+        if isinstance(obj, QueueDone):
+            self._finish(obj)
+            return None
+
+        if self.wait_times is not None:
+            self._unsampled += len(obj) if isinstance(obj, Batch) else 1
+            put_at = self._put_times.popleft()
+
+            if put_at is not None:
+                self.wait_times.record(time.monotonic() - put_at, self._unsampled)
+                self._unsampled = 0
+
+        if isinstance(obj, Batch):
+            self._pending.extend(obj)
+            obj = self._pending.popleft()
+
+        self._count -= 1
+        return obj
 
     @coroutine
     def get_object(self):
+        if self._pending:
+            self._count -= 1
+            self._wake_writers()
+            return self._pending.popleft()
+
         if self.finished:
             return
 
         obj = yield from self._queue.get()
+        obj = self._take(obj)
+        self._wake_writers()
+        return obj
 
-        if isinstance(obj, QueueDone):
-            for getter in self._queue._getters:
-                getter.set_result(None)
+    @coroutine
+    def get_many(self, count):
+        first = yield from self.get_object()
+        if first is None:
+            return []
+
+        objects = [first]
+        while len(objects) < count:
+            if self._pending:
+                self._count -= 1
+                objects.append(self._pending.popleft())
+            elif self.finished or self._queue.empty():
+                break
+            else:
+                obj = self._take(self._queue.get_nowait())
+                if obj is None:
+                    break
+                objects.append(obj)
 
-            obj.future.set_result(True)
-            self.finished = True
-        else:
-            return obj
+        self._wake_writers()
+        return objects
 
     @coroutine
     def put_object(self, object):
+        # The end marker never waits for room, closing a full queue must not block
+        if not isinstance(object, QueueDone):
+            yield from self._wait_for_space(1)
         yield from self._queue.put(object)
+        if not isinstance(object, QueueDone):
+            self._count += 1
+            if self.wait_times is not None:
+                self._put_time()
+
+    @coroutine
+    def put_many(self, objects):
+        if not objects:
+            return
+        yield from self._wait_for_space(len(objects))
+        yield from self._queue.put(Batch(objects))
+        self._count += len(objects)
+        if self.wait_times is not None:
+            self._put_time()
+
+    def _put_time(self):
+        self._puts += 1
+        self._put_times.append(time.monotonic() if self._puts % self.wait_sample_every == 1 else None)
 
     @coroutine
     def close(self):
@@ -43,4 +158,36 @@ class Queue(object):
             QueueDone(future)
         )
 
-        return future
\ No newline at end of file
+        return future
+
+
+class MemoryBudget(object):
+    """
+    A byte limit shared between several queues. Producers wait in acquire() until consumers release
+    enough memory, except when nothing is held at all so a single oversized item can still pass, or
+    when the queue being written to is empty. Otherwise a stage whose outputs are bigger than its inputs
+    could wait forever for memory held by the queue it reads from.
+    """
+    def __init__(self, limit, sizeof=sys.getsizeof):
+        self.limit = limit
+        self.sizeof = sizeof
+        self.used = 0
+        self._waiters = deque()
+
+    @coroutine
+    def acquire(self, size, empty=None):
+        # empty, if given, says whether the destination queue is empty, and is checked again on every wakeup
+        while self.used and self.used + size > self.limit and not (empty is not None and empty()):
+            waiter = Future()
+            self._waiters.append(waiter)
+            yield from waiter
+
+        self.used += size
+
+    def release(self, size):
+        self.used = max(self.used - size, 0)
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
@@ -1,16 +1,22 @@
-from asyncio import coroutine, iscoroutine, wait, FIRST_COMPLETED, get_event_loop
+from asyncio import coroutine, iscoroutine, iscoroutinefunction, wait, FIRST_COMPLETED, get_event_loop, \
+    Queue as ioQueue, Semaphore, Future, CancelledError
 try:
     from asyncio import ensure_future
 except ImportError:
     from asyncio import async as ensure_future
 
-from collections import Iterable
-from io import TextIOBase
+from collections import Iterable, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import TextIOBase, BufferedIOBase, RawIOBase
 import inspect
+import os
+import pickle
 import time
+import traceback
 
-from aiopipes import Input, Output, IterableIO, FileIO
-from .pipeio import IOFinished
+from aiopipes import Input, Output, IterableIO, AsyncIterableIO, FileIO, BinaryFileIO, QueueIO
+from .metrics import StageMetrics
+from .pipeio import IOFinished, batch_rows
 from .status import StatusMixin
 
 
@@ -19,8 +25,20 @@ class Runnable(StatusMixin):
         self.input = self._convert_to_io(input, _raise=False)
         self.output = self._convert_to_io(output)
         self.concurrency = 1
+        self.ordered = False
+        self.reorder_buffer = None
+        self.batch_size = None
+        self.maxsize = None
+        self.dead_letter = None
         self.started = None
         self.worker_futures = []
+        self.min_workers = self.max_workers = None
+        # Items that have been read but whose results have not been written yet
+        self.in_flight = 0
+        self._retiring = 0
+        self._workers_changed = None
+        # Items are columnar batches, so counts and rates are in rows
+        self.columnar = False
 
         super().__init__()
 
@@ -44,19 +62,19 @@ class Runnable(StatusMixin):
         ev.run_until_complete(self.start())
 
     @coroutine
-    def start(self):
-        @coroutine
-        def runner_task():
-            try:
-                yield from self._run()
-            except IOFinished:
-                return
-            except Exception as ex:
-                self.status.error(ex)
+    def _runner_task(self):
+        try:
+            yield from self._run()
+        except IOFinished:
+            return
+        except Exception as ex:
+            self.status.error(ex)
 
+    @coroutine
+    def start(self):
         if not self.concurrency:
             # Just run a single runner_task don't bother with multiple stuff.
-            fut = runner_task()
+            fut = self._runner_task()
             self.worker_futures = [fut]
             try:
                 yield from fut
@@ -64,18 +82,84 @@ class Runnable(StatusMixin):
                 if self.output:
                     yield from self.output.close()
 
-        self.worker_futures = [ensure_future(runner_task()) for _ in range(self.concurrency)]
+        self._retiring = 0
+        self.in_flight = 0
+        self.worker_futures = [ensure_future(self._runner_task()) for _ in range(self.concurrency)]
         self.started = time.time()
 
         try:
             while True:
-                done, pending = yield from wait(self.worker_futures, return_when=FIRST_COMPLETED)
-                self.worker_futures = list(pending)
-                if not pending:
+                # _workers_changed lets add_worker() wake us up to wait on the new worker too
+                self._workers_changed = Future()
+                yield from wait(self.worker_futures + [self._workers_changed], return_when=FIRST_COMPLETED)
+                self.worker_futures = [f for f in self.worker_futures if not f.done()]
+                if not self.worker_futures:
                     break
         finally:
-            if self.output:
-                yield from self.output.close()
+            self._workers_changed = None
+            try:
+                yield from self._finish()
+            finally:
+                if self.output:
+                    yield from self.output.close()
+            if self.dead_letter:
+                yield from self.dead_letter.close()
+
+    @coroutine
+    def _finish(self):
+        # Called once every worker has stopped and before the output is closed
+        pass
+
+    def idle(self):
+        return self.in_flight == 0
+
+    def add_worker(self):
+        """
+        Start one more worker while the runnable is running. Returns False if it is not running.
+        """
+        if not self.worker_futures or self._workers_changed is None:
+            return False
+
+        self.worker_futures.append(ensure_future(self._runner_task()))
+        self.concurrency += 1
+        if not self._workers_changed.done():
+            self._workers_changed.set_result(None)
+        return True
+
+    def retire_worker(self):
+        """
+        Ask one worker to stop once it has finished its current item. At least one worker always remains.
+        """
+        if self.concurrency - self._retiring <= 1:
+            return False
+
+        self._retiring += 1
+        self.concurrency -= 1
+        return True
+
+    def _should_retire(self):
+        if self._retiring:
+            self._retiring -= 1
+            return True
+        return False
+
+    @property
+    def workers(self):
+        """
+        How many items this stage works on at once, which with its service time gives its capacity
+        """
+        return self.concurrency
+
+    def autoscale(self, min_workers, max_workers):
+        """
+        Let an Autoscaler move this stage's concurrency between min_workers and max_workers
+        """
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.concurrency = max(min(self.concurrency, max_workers), min_workers)
+        if self.reorder_buffer is not None:
+            self.reorder_buffer = max(self.reorder_buffer, max_workers * 4)
+        return self
 
     @coroutine
     def _run(self):
@@ -86,8 +170,12 @@ class Runnable(StatusMixin):
             return value
         elif isinstance(value, TextIOBase):
             return FileIO(value)
+        elif isinstance(value, (BufferedIOBase, RawIOBase)):
+            return BinaryFileIO(value)
         elif isinstance(value, Iterable):
             return IterableIO(value)
+        elif hasattr(value, "__aiter__"):
+            return AsyncIterableIO(value)
         elif _raise:
             raise RuntimeError("Cannot type {0} to input or output".format(type(value)))
 
@@ -99,10 +187,46 @@ class Runnable(StatusMixin):
         self.output = self._convert_to_io(output)
         return self
 
-    def parallel(self, concurrency):
+    def parallel(self, concurrency, ordered=False, reorder_buffer=None):
         self.concurrency = concurrency
+        self.ordered = ordered
+        self.reorder_buffer = reorder_buffer or concurrency * 4
+        return self
+
+    def batched(self, batch_size):
+        self.batch_size = batch_size
+        return self
+
+    def buffered(self, maxsize):
+        self.maxsize = maxsize
+        return self
+
+    def errors_to(self, output):
+        """
+        Write every item that fails in this stage, with the error, to output instead of only keeping it in memory
+        """
+        self.dead_letter = self._convert_to_io(output, _raise=True)
         return self
 
+    @coroutine
+    def _failed(self, status, ex, data):
+        status.error(ex, data)
+
+        if self.dead_letter is not None:
+            try:
+                yield from self.dead_letter.write({"error": repr(ex), "type": type(ex).__name__, "data": data})
+            except Exception as write_ex:
+                self.status.error(write_ex)
+
+
+class _RemoteTraceback(Exception):
+    # Tracebacks don't survive pickling, so errors from a worker process bring theirs along as text
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
 
 class _Continue(object):
     def __init__(self, data, done=None, max=None):
@@ -111,10 +235,65 @@ class _Continue(object):
         self.done = done
 
 
+def _apply_chunk(func, param_names, items):
+    # Runs inside an executor, so output() and _continue are handled locally and everything
+    # is sent back in one go.
+    results, errors = [], []
+    started = time.perf_counter()
+
+    params = {}
+    if "output" in param_names:
+        params["output"] = results.append
+    if "_continue" in param_names:
+        params["_continue"] = _Continue
+
+    for data in items:
+        while True:
+            try:
+                result = func(data, **params)
+            except Exception as ex:
+                errors.append((ex, data, "".join(traceback.format_exception(type(ex), ex, ex.__traceback__))))
+                break
+
+            if isinstance(result, _Continue):
+                data = result.data
+                continue
+
+            if result is not None:
+                results.append(result)
+            break
+
+    return results, errors, time.perf_counter() - started
+
+
 class FunctionRunner(Runnable):
+    status_props = {"done_count", "reorder_buffered", "hol_blocked_count", "throughput", "service_time"}
+
     def __init__(self, func, input=None, output=None):
         self.func = func
+        self.metrics = StageMetrics()
+        self.pool = None
+        self._pool_factory = None
+        self.chunk_size = 100
+        self.window = 1
+        self.pool_workers = 1
+        self.partition_key = None
+        self.partition_maxsize = 0
+        self._partitions = None
+        self._next_partition = 0
+        self._dispatcher = None
+        # Set once the dispatcher has stopped reading, after which partition workers may finish
+        self._dispatched = False
+        self._dead_partitions = set()
         super().__init__(input, output)
+        self._reset_reorder()
+        self.status.func("reorder_buffered", lambda: len(self._reorder))
+        self.status.func("throughput", lambda: self.metrics.get_stats()["throughput"])
+        self.status.func("service_time", self.metrics.service_time.get_stats)
+
+        # Stateful functions, like filters.unique, can report their own stats and be closed at the end
+        if callable(getattr(func, "stats", None)):
+            self.status.func("func_stats", func.stats)
 
     @property
     def name(self):
@@ -141,6 +320,204 @@ class FunctionRunner(Runnable):
             return params
         return params.intersection(allowed_args)
 
+    def executor(self, pool, chunk_size=100, ordered=False, window=None):
+        """
+        Run this stage in a concurrent.futures executor, sending chunks of chunk_size items at a time.
+        Up to window chunks are in flight at once, one more than the number of CPUs unless given;
+        with ordered=True results keep their input order.
+        """
+        if iscoroutinefunction(self.func) or inspect.isgeneratorfunction(self.func) or _is_async_generator(self.func):
+            raise RuntimeError("Cannot run coroutine {name} in an executor".format(name=self.name))
+
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.ordered = ordered
+        self.window = window or (os.cpu_count() or 1) + 1
+        # A pool doesn't say how big it is, but all but one of the chunks in flight can be running
+        self.pool_workers = max(self.window - 1, 1)
+        self.concurrency = 1
+        return self
+
+    @property
+    def workers(self):
+        if self.pool is None and self._pool_factory is None:
+            return self.concurrency
+        return self.pool_workers
+
+    def parallel(self, concurrency, ordered=False, reorder_buffer=None):
+        if ordered and self.partition_key is not None:
+            raise RuntimeError("Cannot order {name}, it is partitioned and keeps order per key".format(name=self.name))
+        return super().parallel(concurrency, ordered, reorder_buffer)
+
+    def partition_by(self, key_fn, partitions, maxsize=100):
+        """
+        Run partitions workers that each have their own queue, and send every item to the one picked by
+        hashing key_fn(item). All items with the same key go to the same worker in the order they arrived,
+        so stateful functions like unique or group_by can be parallelised without locks. Each worker queue
+        holds up to maxsize items, so one busy key holds back the stage instead of buffering without limit.
+        """
+        if self.pool is not None or self._pool_factory is not None:
+            raise RuntimeError("Cannot partition {name}, it runs in an executor".format(name=self.name))
+
+        self.partition_key = key_fn
+        self.partition_maxsize = maxsize
+        self.concurrency = partitions
+        self.ordered = False
+        return self
+
+    def processes(self, workers, chunk_size=100, ordered=False):
+        # The pool can't report a function it fails to send, its futures just never finish
+        try:
+            pickle.dumps(self.func)
+        except Exception as ex:
+            raise RuntimeError("Cannot run {name} in processes, it can't be pickled ({ex}). Use a "
+                               "module level function".format(name=self.name, ex=ex)) from ex
+        self.executor(None, chunk_size, ordered, window=workers + 1)
+        self._pool_factory = lambda: ProcessPoolExecutor(workers)
+        self.pool_workers = workers
+        return self
+
+    def threads(self, workers, chunk_size=100, ordered=False):
+        self.executor(None, chunk_size, ordered, window=workers + 1)
+        self._pool_factory = lambda: ThreadPoolExecutor(workers)
+        self.pool_workers = workers
+        return self
+
+    def idle(self):
+        if self._partitions is not None and any(p.queue.items_queued or p._batch for p in self._partitions):
+            return False
+        return self.in_flight == 0 and not self._reorder
+
+    @coroutine
+    def _start_partitioned(self):
+        self._partitions = [QueueIO(batch_size=self.batch_size, maxsize=self.partition_maxsize)
+                            for _ in range(self.concurrency)]
+        self._next_partition = 0
+        self._dispatched = False
+        self._dead_partitions = set()
+        self._dispatcher = ensure_future(self._dispatch())
+
+        try:
+            yield from super().start()
+        finally:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+            self._partitions = None
+
+    @coroutine
+    def _runner_task(self):
+        if self._partitions is None:
+            return (yield from super()._runner_task())
+
+        # The partition _run is about to take, it does so before its first yield
+        partition = self._partitions[self._next_partition]
+        yield from super()._runner_task()
+
+        if not self._dispatched:
+            # Nothing reads this partition any more, the dispatcher would block on it for good
+            self._dead_partitions.add(partition)
+            self.status.error(RuntimeError("A partition worker of {name} exited early".format(name=self.name)))
+            self._dispatcher.cancel()
+
+    @coroutine
+    def _dispatch(self):
+        # Reads this stage's input and hands every item to its partition's queue
+        partitions = self._partitions
+        key_fn = self.partition_key
+
+        try:
+            while True:
+                try:
+                    items = yield from self.input.read_many(self.batch_size or 100)
+                except IOFinished:
+                    break
+
+                self.in_flight += len(items)
+                routed = {}
+                for item in items:
+                    try:
+                        partition = partitions[hash(key_fn(item)) % len(partitions)]
+                    except Exception as ex:
+                        yield from self._failed(self.status, ex, item)
+                        continue
+                    routed.setdefault(partition, []).append(item)
+
+                for partition, partition_items in routed.items():
+                    yield from partition.write_many(partition_items)
+                self.in_flight -= len(items)
+        except CancelledError:
+            raise
+        except Exception as ex:
+            self.status.error(ex)
+        finally:
+            self._dispatched = True
+            for partition in partitions:
+                if partition not in self._dead_partitions:
+                    yield from partition.close()
+
+    def _reset_reorder(self):
+        self._reorder = {}
+        self._reorder_waiters = []
+        self._read_seq = 0
+        self._write_seq = 0
+
+    @coroutine
+    def start(self):
+        self._reset_reorder()
+
+        try:
+            if self.partition_key is not None:
+                return (yield from self._start_partitioned())
+
+            if self._pool_factory is None:
+                return (yield from super().start())
+
+            self.pool = self._pool_factory()
+            try:
+                yield from super().start()
+            finally:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+        finally:
+            self._close_func()
+
+    @coroutine
+    def _finish(self):
+        # Stages that hold items back, like windows, hand over what they have left at the end of the stream
+        flush = getattr(self.func, "flush", None)
+        if not callable(flush) or self.output is None:
+            return
+
+        try:
+            results = [result for result in flush() if result is not None]
+        except Exception as ex:
+            self.status.error(ex)
+            return
+
+        if results:
+            yield from self.output.write_many(results)
+
+    def _close_func(self):
+        close = getattr(self.func, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as ex:
+                self.status.error(ex)
+
+    def fusable(self):
+        """
+        Whether this stage can be run inline in a FusedRunner: a plain synchronous function with one
+        worker, no output or _continue parameters and nothing else that needs its own loop
+        """
+        func = self.func
+        return (type(self) is FunctionRunner and self.concurrency == 1 and not self.ordered
+                and self.pool is None and self._pool_factory is None and self.maxsize is None
+                and self.min_workers is None and self.partition_key is None
+                and not callable(getattr(func, "flush", None))
+                and not (iscoroutinefunction(func) or inspect.isgeneratorfunction(func) or _is_async_generator(func))
+                and not self._get_params(func, {"output", "_continue"}))
+
     def _get_param_values(self):
         @coroutine
         def _output(data):
@@ -153,38 +530,408 @@ class FunctionRunner(Runnable):
 
     @coroutine
     def _run(self):
+        input = self.input
+        if self._partitions is not None:
+            # Workers start in order, and each one takes the next partition's queue
+            input = self._partitions[self._next_partition]
+            self._next_partition += 1
+
         param_values = self._get_param_values()
         func_params = self._get_params(self.func, set(param_values.keys()))
+        params = {p: param_values[p] for p in func_params if p in param_values}
+
+        if self.pool is not None or self._pool_factory is not None:
+            return (yield from self._run_executor(func_params))
+
+        if _is_async_generator(self.func):
+            return (yield from self._run_async_generator(input))
+
+        # Not just when concurrency > 1, an autoscaler can add workers to a stage that started with one
+        if self.ordered:
+            return (yield from self._run_ordered(params))
+
+        while not self._should_retire():
+            if self.batch_size:
+                items = yield from input.read_many(self.batch_size)
+                self.in_flight += len(items)
+                try:
+                    results = []
+                    for data in items:
+                        result = yield from self._process(data, params)
+                        if result is not None:
+                            results.append(result)
 
-        while True:
-            data = yield from self.input.read()
-            if data is None:
-                pass
+                    if results:
+                        yield from self.output.write_many(results)
+                finally:
+                    self.in_flight -= len(items)
+            else:
+                data = yield from input.read()
+                self.in_flight += 1
+                try:
+                    result = yield from self._process(data, params)
+
+                    if result is not None:
+                        yield from self.output.write(result)
+                finally:
+                    self.in_flight -= 1
+
+    @coroutine
+    def _run_ordered(self, params):
+        # Every read is tagged with a sequence number and its results wait in a bounded reorder
+        # buffer until everything read before it has been written.
+        while not self._should_retire():
+            while self._read_seq - self._write_seq >= self.reorder_buffer:
+                waiter = Future()
+                self._reorder_waiters.append(waiter)
+                yield from waiter
+
+            if self.batch_size:
+                items = yield from self.input.read_many(self.batch_size)
+            else:
+                items = [(yield from self.input.read())]
+
+            self.in_flight += len(items)
+            seq, self._read_seq = self._read_seq, self._read_seq + 1
+            results = []
+            item_params = dict(params)
+
+            if "output" in item_params:
+                @coroutine
+                def _output(data):
+                    results.append(data)
+                item_params["output"] = _output
+
+            try:
+                for data in items:
+                    result = yield from self._process(data, item_params)
+                    if result is not None:
+                        results.append(result)
+
+                yield from self._emit_ordered(seq, results)
+            finally:
+                self.in_flight -= len(items)
+
+    @coroutine
+    def _run_async_generator(self, input):
+        # The stage pulls its own items with async for and yields as many results as it likes,
+        # so there is no per-item call and no output callback. If it raises, the error is recorded
+        # and a new generator carries on with the rest of the input. If it returns, it has taken
+        # all it wants and whatever is left of the input is read and dropped.
+        inputs = _InputIterator(self, input)
+        results = []
+
+        while not inputs.finished:
+            generator = self.func(inputs)
+
+            while True:
+                try:
+                    result = yield from generator.__anext__()
+                except StopAsyncIteration:
+                    yield from inputs.drain()
+                    break
+                except Exception as ex:
+                    yield from self._failed(self.status, ex, inputs.current)
+                    break
+
+                if not self.batch_size:
+                    yield from self.output.write(result)
+                    continue
+
+                results.append(result)
+                if len(results) >= self.batch_size:
+                    yield from self.output.write_many(results)
+                    results = []
 
-            params = {p: param_values[p] for p in func_params if p in param_values}
+        if results:
+            yield from self.output.write_many(results)
 
-            with self.status.subtask("percentage_done", "done_count", "max_count") as subtask:
-                subtask.percentage("done", "done_count", "max_count")
+    @coroutine
+    def _emit_ordered(self, seq, results):
+        self._reorder[seq] = results
+
+        if seq != self._write_seq:
+            # Finished before an earlier item: it is blocked behind the head of the line
+            self.status.inc("hol_blocked_count")
+            return
+
+        try:
+            while self._write_seq in self._reorder:
+                results = self._reorder.pop(self._write_seq)
+                try:
+                    if len(results) == 1:
+                        yield from self.output.write(results[0])
+                    elif results:
+                        yield from self.output.write_many(results)
+                except Exception as ex:
+                    # Every later result is waiting behind this one, so a failed write can't stop the line
+                    for data in results:
+                        yield from self._failed(self.status, ex, data)
+                finally:
+                    self._write_seq += 1
+        finally:
+            waiters, self._reorder_waiters = self._reorder_waiters, []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    @coroutine
+    def _run_executor(self, param_names):
+        loop = get_event_loop()
+        slots = Semaphore(self.window)
+        completed = ioQueue()
+        submitted = []
+        chunk_sizes = {}
 
+        @coroutine
+        def submit():
+            try:
                 while True:
                     try:
-                        result = self.func(data, **params)
+                        items = yield from self.input.read_many(self.chunk_size)
+                    except IOFinished:
+                        break
+
+                    self.in_flight += len(items)
+                    yield from slots.acquire()
+                    future = loop.run_in_executor(self.pool, _apply_chunk, self.func, param_names, items)
+                    chunk_sizes[future] = len(items)
+                    submitted.append(future)
+
+                    if self.ordered:
+                        completed.put_nowait(future)
+                    else:
+                        future.add_done_callback(completed.put_nowait)
+
+                if submitted:
+                    yield from wait(submitted)
+            finally:
+                completed.put_nowait(None)
+
+        submitter = ensure_future(submit())
+
+        try:
+            while True:
+                future = yield from completed.get()
+                if future is None:
+                    break
+
+                submitted.remove(future)
+                try:
+                    results, errors, elapsed = yield from future
+                finally:
+                    slots.release()
+
+                chunk_size = chunk_sizes.pop(future)
+                self.metrics.record(elapsed, chunk_size)
+
+                for ex, data, tb in errors:
+                    if ex.__traceback__ is None:
+                        ex.__cause__ = _RemoteTraceback(tb)
+                    yield from self._failed(self.status, ex, data)
+
+                if results:
+                    yield from self.output.write_many(results)
+                self.in_flight -= chunk_size
+
+            yield from submitter
+        finally:
+            submitter.cancel()
+
+    @coroutine
+    def _process(self, data, params):
+        # Only functions that can hand back a _Continue get their own progress subtask
+        started = time.perf_counter() if self.metrics.should_sample() else None
+
+        if "_continue" not in params:
+            try:
+                result = self.func(data, **params)
+                if iscoroutine(result):
+                    result = yield from result
+            except Exception as ex:
+                yield from self._failed(self.status, ex, data)
+                return
+
+            rows = batch_rows(data) if self.columnar else 1
+            if started is not None:
+                self.metrics.record(time.perf_counter() - started, rows)
+            else:
+                self.metrics.skip(rows)
+            self.status.inc("done_count", rows)
+            return result
+
+        subtask = self.status.acquire_subtask("percentage_done", "done_count", "max_count")
+        subtask.percentage("done", "done_count", "max_count")
+
+        try:
+            while True:
+                try:
+                    result = self.func(data, **params)
+                    if iscoroutine(result):
+                        result = yield from result
+                    subtask.inc("done_count")
+
+                except Exception as ex:
+                    yield from self._failed(subtask, ex, data)
+                    return
+
+                if isinstance(result, _Continue):
+                    data = result.data
+                    if result.max:
+                        subtask.set("max_count", result.max)
+                    if result.done:
+                        subtask.set("done_count", result.done)
+                    continue
+
+                if started is not None:
+                    self.metrics.record(time.perf_counter() - started)
+                else:
+                    self.metrics.skip()
+                self.status.inc("done_count")
+                return result
+        finally:
+            self.status.release_subtask(subtask)
+
+
+class FusedRunner(Runnable):
+    """
+    Runs several adjacent synchronous stages as one, calling each function in turn on every item so
+    items skip the queues and loops between them. Every stage keeps its own status, metrics and
+    dead letter output.
+    """
+    def __init__(self, stages, input=None, output=None):
+        self.stages = stages
+        super().__init__(input, output)
+        self.batch_size = stages[0].batch_size
+
+    @property
+    def name(self):
+        return "+".join(stage.name for stage in self.stages)
+
+    @coroutine
+    def start(self):
+        try:
+            yield from super().start()
+        finally:
+            for stage in self.stages:
+                stage._close_func()
+                if stage.dead_letter:
+                    yield from stage.dead_letter.close()
+
+    @coroutine
+    def _runner_task(self):
+        # Lets monitors see this runner's workers through each of the stages
+        for stage in self.stages:
+            stage.worker_futures = self.worker_futures
+        yield from super()._runner_task()
+
+    @coroutine
+    def _run(self):
+        stages = [(stage, stage.func, stage.status, stage.metrics) for stage in self.stages]
+
+        while not self._should_retire():
+            if self.batch_size:
+                items = yield from self.input.read_many(self.batch_size)
+            else:
+                items = [(yield from self.input.read())]
+
+            self.in_flight += len(items)
+            results = []
+            for data in items:
+                for stage, func, status, metrics in stages:
+                    rows = batch_rows(data) if stage.columnar else 1
+                    started = time.perf_counter() if metrics.should_sample() else None
+                    try:
+                        result = func(data)
+                        # A plain function can still hand back a coroutine, such as a lambda wrapping one
                         if iscoroutine(result):
                             result = yield from result
-                        subtask.inc("done_count")
-
                     except Exception as ex:
-                        subtask.error(ex, data)
+                        yield from stage._failed(status, ex, data)
+                        break
+
+                    if started is not None:
+                        metrics.record(time.perf_counter() - started, rows)
                     else:
-                        if isinstance(result, _Continue):
-                            data = result.data
-                            if result.max:
-                                subtask.set("max_count", result.max)
-                            if result.done:
-                                subtask.set("done_count", result.done)
-                            continue
+                        metrics.skip(rows)
+                    status.inc("done_count", rows)
+                    if result is None:
+                        break
+                    data = result
+                else:
+                    results.append(data)
+
+            if len(results) == 1 and not self.batch_size:
+                yield from self.output.write(results[0])
+            elif results:
+                yield from self.output.write_many(results)
+            self.in_flight -= len(items)
+
+
+def _is_async_generator(func):
+    # Async generators only exist on Python 3.6 and up
+    isasyncgenfunction = getattr(inspect, "isasyncgenfunction", None)
+    return isasyncgenfunction is not None and isasyncgenfunction(func)
+
+
+class _InputIterator(object):
+    """
+    What an async generator stage is given: an async iterator over the stage's input. Items are read
+    batch_size at a time when the stage is batched. Retiring the worker ends the iteration.
+    """
+    def __init__(self, runner: FunctionRunner, input: Input):
+        self.runner = runner
+        self.input = input
+        self.buffer = deque()
+        self.current = None
+        self.finished = False
+        self.holding = False
+
+    def __aiter__(self):
+        return self
 
-                        if result is not None:
-                            yield from self.output.write(result)
+    @coroutine
+    def __anext__(self):
+        runner = self.runner
 
-                    break
+        # Asking for the next item means the stage is done with the last one
+        if self.holding:
+            runner.in_flight -= 1
+            self.holding = False
+
+        if not self.buffer:
+            if self.finished or runner._should_retire():
+                self.finished = True
+                raise StopAsyncIteration()
+
+            try:
+                if runner.batch_size:
+                    self.buffer.extend((yield from self.input.read_many(runner.batch_size)))
+                else:
+                    self.buffer.append((yield from self.input.read()))
+            except IOFinished:
+                self.finished = True
+                raise StopAsyncIteration()
+            runner.in_flight += len(self.buffer)
+
+        self.holding = True
+        self.current = self.buffer.popleft()
+        runner.status.inc("done_count", batch_rows(self.current) if runner.columnar else 1)
+        return self.current
+
+    @coroutine
+    def drain(self):
+        runner = self.runner
+        if self.holding:
+            runner.in_flight -= 1
+            self.holding = False
+
+        # Read but never handed to the stage
+        runner.in_flight -= len(self.buffer)
+        self.buffer.clear()
+        while not self.finished and not runner._should_retire():
+            try:
+                yield from self.input.read_many(runner.batch_size or 100)
+            except IOFinished:
+                break
+        self.finished = True
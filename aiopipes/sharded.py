@@ -0,0 +1,317 @@
+"""
+Runs copies of a pipeline in worker processes, each on its own slice of the input, and merges their
+outputs and stats back in the parent.
+"""
+from asyncio import coroutine, get_event_loop, new_event_loop, set_event_loop, sleep
+import multiprocessing
+import numbers
+import queue
+
+try:
+    from asyncio import ensure_future
+except ImportError:
+    from asyncio import async as ensure_future
+
+from .mmapio import MmapFileIO
+from .pipeio import Input, Output, IOFinished
+from .pipeline import Pipeline
+
+__all__ = ["ShardedPipeline", "merge_stats"]
+
+# Stats whose merged value is the worst of the shards', not their total
+_WORST = {"p50", "p90", "p99", "max", "maxsize"}
+
+
+def merge_stats(stats):
+    """
+    Combine get_stats() dicts from several shards into one: counts and rates add up, percentiles and
+    maximums take the worst shard, means are weighted by their counts and lists are joined.
+    """
+    stats = [s for s in stats if s]
+    if not stats:
+        return {}
+
+    merged = {}
+    for key in {key for s in stats for key in s}:
+        values = [s[key] for s in stats if key in s]
+
+        if key.startswith("percentage_"):
+            first = sum(v["data"][0] for v in values)
+            second = sum(v["data"][1] for v in values)
+            merged[key] = {"percent": int(first / second * 100) if second else 0, "data": (first, second)}
+        elif all(isinstance(v, dict) for v in values):
+            merged[key] = merge_stats(values)
+        elif all(isinstance(v, list) for v in values):
+            merged[key] = [item for v in values for item in v]
+        elif all(isinstance(v, numbers.Number) and not isinstance(v, bool) for v in values):
+            if key in _WORST:
+                merged[key] = max(values)
+            elif key == "min":
+                merged[key] = min(values)
+            elif key == "mean":
+                counts = [s.get("count", 1) for s in stats if key in s]
+                merged[key] = sum(v * c for v, c in zip(values, counts)) / (sum(counts) or 1)
+            else:
+                merged[key] = sum(values)
+        else:
+            merged[key] = values[0]
+
+    return merged
+
+
+def _collect(pipeline):
+    # A picklable snapshot of the stats a monitor looks at
+    def stats(obj):
+        if obj is None:
+            return {}
+        result = obj.status.get_stats()
+        result["error_list"] = [repr(e) for e in result.get("error_list", [])]
+        return result
+
+    return {
+        "task": stats(pipeline),
+        "pipes": [
+            {"name": r.name, "concurrency": r.concurrency, "workers": r.workers, "input": stats(r.input), "output": stats(r.output),
+             "task": stats(r)}
+            for r in pipeline.pipes
+        ],
+    }
+
+
+class _QueueReader(Input):
+    # Reads the batches the parent sends a shard, in a thread so the shard's loop keeps running
+    def __init__(self, source):
+        self.source = source
+        self.buffer = []
+        super().__init__()
+
+    @coroutine
+    def read_many(self, count):
+        if not self.buffer:
+            batch = yield from get_event_loop().run_in_executor(None, self.source.get)
+            if batch is None:
+                raise IOFinished()
+            self.buffer = batch
+            self.status.inc("read_count", len(batch))
+
+        items, self.buffer = self.buffer[:count], self.buffer[count:]
+        return items
+
+    @coroutine
+    def read(self):
+        return (yield from self.read_many(1))[0]
+
+
+class _QueueWriter(Output):
+    # Sends a shard's output back to the parent in batches
+    def __init__(self, results, shard, batch_size):
+        self.results = results
+        self.shard = shard
+        self.batch_size = batch_size
+        self.batch = []
+        super().__init__()
+
+    @coroutine
+    def write(self, data):
+        self.batch.append(data)
+        self.status.inc("write_count")
+        if len(self.batch) >= self.batch_size:
+            yield from self.flush()
+
+    @coroutine
+    def write_many(self, items):
+        self.batch.extend(items)
+        self.status.inc("write_count", len(items))
+        if len(self.batch) >= self.batch_size:
+            yield from self.flush()
+
+    @coroutine
+    def flush(self):
+        if self.batch:
+            batch, self.batch = self.batch, []
+            self.results.put(("items", self.shard, batch))
+
+    @coroutine
+    def close(self):
+        yield from self.flush()
+        self.status.set("closed", True)
+
+
+def _run_shard(factory, shard, source, results, stats_interval, batch_size):
+    loop = new_event_loop()
+    set_event_loop(loop)
+
+    pipeline = factory()
+    pipeline < (MmapFileIO(*source) if isinstance(source, tuple) else _QueueReader(source))
+    pipeline > _QueueWriter(results, shard, batch_size)
+
+    @coroutine
+    def report():
+        while True:
+            yield from sleep(stats_interval)
+            results.put(("stats", shard, _collect(pipeline)))
+
+    reporter = ensure_future(report())
+    try:
+        loop.run_until_complete(pipeline.start())
+    finally:
+        reporter.cancel()
+        results.put(("done", shard, _collect(pipeline)))
+        loop.close()
+
+
+class _StatsView(object):
+    # Stands in for a runner, input or output so monitors see the stats merged across shards
+    def __init__(self, get_stats):
+        self.get_stats = get_stats
+
+    @property
+    def status(self):
+        return self
+
+
+class _StageView(object):
+    def __init__(self, sharded, index, name):
+        self.name = name
+        self.worker_futures = []
+        self.status = _StatsView(lambda: sharded._merged(index, "task"))
+        self.input = _StatsView(lambda: sharded._merged(index, "input"))
+        self.output = _StatsView(lambda: sharded._merged(index, "output"))
+        self._sharded = sharded
+        self._index = index
+
+    @property
+    def concurrency(self):
+        return sum(s["pipes"][self._index]["concurrency"] for s in self._sharded.shard_stats if s) or 1
+
+    @property
+    def workers(self):
+        return sum(s["pipes"][self._index]["workers"] for s in self._sharded.shard_stats if s) or 1
+
+
+class ShardedPipeline(Pipeline):
+    """
+    Runs the pipeline factory() returns in shards worker processes. With a path as input (mode "bytes")
+    every worker reads its own newline aligned byte range of the file with MmapFileIO; any other input is
+    read here and dealt out round-robin in batches (mode "round_robin"). Every worker's output is sent
+    back and written to this pipeline's output. Stats from the workers are merged, so a ConsoleMonitor
+    on a ShardedPipeline shows one view of all of them.
+
+    Workers are forked where possible. Elsewhere factory and the items have to be picklable.
+    """
+    def __init__(self, name, factory, shards=None, input=None, output=None, mode="auto", codec="json",
+                 batch_size=100, stats_interval=1):
+        self.factory = factory
+        self.shards = shards or multiprocessing.cpu_count()
+        self.path = input if isinstance(input, str) else None
+        self.mode = ("bytes" if self.path else "round_robin") if mode == "auto" else mode
+        self.codec = codec
+        self.shard_batch_size = batch_size
+        self.stats_interval = stats_interval
+        self.shard_stats = [None] * self.shards
+
+        if self.mode == "bytes" and self.path is None:
+            raise RuntimeError("Sharding by bytes needs a file path as the input")
+
+        super().__init__(name, None if self.path else input, output)
+        self.pipes = [_StageView(self, index, pipe.name) for index, pipe in enumerate(factory().pipes)]
+        self.status.func("shards", lambda: merge_stats(s["task"] for s in self.shard_stats if s))
+
+    def __or__(self, other):
+        raise RuntimeError("Add stages to the pipeline the factory of a ShardedPipeline returns")
+
+    def _merged(self, index, part):
+        return merge_stats(s["pipes"][index][part] for s in self.shard_stats if s and len(s["pipes"]) > index)
+
+    def _context(self):
+        try:
+            return multiprocessing.get_context("fork")
+        except ValueError:
+            return multiprocessing.get_context()
+
+    @staticmethod
+    def _put(source, process, shard, items):
+        # In the executor: wait for room in a shard's queue for only as long as the shard is alive to make it
+        while True:
+            try:
+                source.put(items, timeout=0.5)
+                return
+            except queue.Full:
+                if not process.is_alive():
+                    raise RuntimeError("Shard {0} exited with code {1}".format(shard, process.exitcode))
+
+    @coroutine
+    def _feed(self, loop, sources, processes):
+        # Deal the input out round-robin, a batch at a time
+        shard = 0
+        try:
+            while True:
+                try:
+                    items = yield from self.input.read_many(self.shard_batch_size)
+                except IOFinished:
+                    break
+                yield from loop.run_in_executor(None, self._put, sources[shard], processes[shard], shard, items)
+                shard = (shard + 1) % self.shards
+        except RuntimeError as ex:
+            self.status.error(ex)
+        finally:
+            for shard, (source, process) in enumerate(zip(sources, processes)):
+                if not process.is_alive():
+                    continue
+                try:
+                    yield from loop.run_in_executor(None, self._put, source, process, shard, None)
+                except RuntimeError:
+                    pass
+
+    @coroutine
+    def _run(self):
+        loop = get_event_loop()
+        context = self._context()
+        results = context.Queue()
+
+        if self.mode == "bytes":
+            sources = []
+            for shard in MmapFileIO.shards(self.path, self.shards, self.codec):
+                sources.append((self.path, self.codec, shard.start, shard.end))
+                yield from shard.close()
+        else:
+            sources = [context.Queue(maxsize=4) for _ in range(self.shards)]
+
+        processes = [
+            context.Process(target=_run_shard, daemon=True,
+                            args=(self.factory, shard, source, results, self.stats_interval, self.shard_batch_size))
+            for shard, source in enumerate(sources)
+        ]
+        for process in processes:
+            process.start()
+
+        feeder = ensure_future(self._feed(loop, sources, processes)) if self.mode != "bytes" else None
+        running = set(range(len(processes)))
+
+        try:
+            while running:
+                try:
+                    kind, shard, data = yield from loop.run_in_executor(None, results.get, True, 0.5)
+                except queue.Empty:
+                    for shard in list(running):
+                        if not processes[shard].is_alive():
+                            running.discard(shard)
+                            self.status.error(RuntimeError("Shard {0} exited with code {1}".format(
+                                shard, processes[shard].exitcode)))
+                    continue
+
+                if kind == "items":
+                    if self.output is not None:
+                        yield from self.output.write_many(data)
+                    continue
+
+                self.shard_stats[shard] = data
+                if kind == "done":
+                    running.discard(shard)
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+            for process in processes:
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
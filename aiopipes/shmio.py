@@ -0,0 +1,281 @@
+"""
+A single producer, single consumer ring buffer in shared memory, for passing items between two
+processes without pickling them. Each item is copied into the ring once by the writer and out of it
+once by the reader, and a whole write_many() or read_many() batch moves the ring's positions once.
+"""
+from asyncio import coroutine, get_event_loop, sleep, wait, Future
+import mmap
+import os
+import struct
+import tempfile
+
+from .pipeio import Input, Output, IOFinished
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+__all__ = ["SharedMemoryQueueIO"]
+
+# write position, read position, closed, reader waiting, writer waiting
+_HEADER = struct.Struct("<QQQQQ")
+_HEADER_SIZE = 64
+_WRITE, _READ, _CLOSED, _READER_WAITING, _WRITER_WAITING = (i * 8 for i in range(5))
+_LENGTH = struct.Struct("<I")
+# In place of a length: the rest of the ring is unused, the next item is at the start
+_WRAP = 0xffffffff
+
+
+class _Segment(object):
+    # A named block of shared memory: multiprocessing.shared_memory where there is one, otherwise a
+    # memory-mapped file in /dev/shm (or the temp directory)
+    def __init__(self, size, name=None):
+        self.owner = name is None
+
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(name, create=self.owner, size=size)
+            self.name, self.buf, self.size = self.shm.name, self.shm.buf, self.shm.size
+            return
+
+        self.shm = None
+        if self.owner:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            fd, name = tempfile.mkstemp(prefix="aiopipes-", dir=directory)
+            os.ftruncate(fd, size)
+        else:
+            fd = os.open(name, os.O_RDWR)
+
+        try:
+            self.size = os.fstat(fd).st_size
+            self.buf = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.name = name
+
+    def close(self):
+        if self.shm is not None:
+            self.buf = None
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            return
+
+        self.buf.close()
+        if self.owner:
+            try:
+                os.unlink(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class SharedMemoryQueueIO(Input, Output):
+    """
+    Carries bytes-like items, or with record set (a struct format) fixed layout tuples, from one
+    process to another. Create it before forking and use it for writing in one process and reading in
+    the other. Readers and writers wake each other through a pipe, so waiting costs nothing on the loop;
+    a copy that has been pickled to another process (e.g. with the spawn start method) attaches to the
+    same memory by name and polls instead.
+    """
+    status_props = {"queued_bytes", "size"}
+
+    # How long to wait for a wakeup before looking at the ring again
+    poll_interval = 0.05
+
+    def __init__(self, size=1 << 22, record=None, name=None):
+        self.segment = _Segment(size, name)
+        self.buf = self.segment.buf
+        self.capacity = self.segment.size - _HEADER_SIZE
+        self.record = struct.Struct(record) if isinstance(record, str) else record
+        if name is None:
+            _HEADER.pack_into(self.buf, 0, 0, 0, 0, 0, 0)
+
+        self.write_position = self._get(_WRITE)
+        self.read_position = self._get(_READ)
+        # Wakeups for the reader (data written) and for the writer (space freed)
+        self.data_pipe = self._pipe()
+        self.space_pipe = self._pipe()
+        super().__init__()
+        self.status.set("size", self.capacity)
+        self.status.func("queued_bytes", lambda: self._get(_WRITE) - self._get(_READ) if self.buf is not None else 0)
+
+    @staticmethod
+    def _pipe():
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        return read_fd, write_fd
+
+    def __getstate__(self):
+        return {"name": self.segment.name, "record": self.record.format if self.record else None}
+
+    def __setstate__(self, state):
+        self.__init__(name=state["name"], record=state["record"])
+        # The other side's pipes don't survive pickling
+        for pipe in (self.data_pipe, self.space_pipe):
+            os.close(pipe[0])
+            os.close(pipe[1])
+        self.data_pipe = self.space_pipe = None
+
+    def _get(self, offset):
+        return struct.unpack_from("<Q", self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        struct.pack_into("<Q", self.buf, offset, value)
+
+    def _notify(self, waiting, pipe, force=False):
+        if pipe is None or not (force or self._get(waiting)):
+            return
+        self._set(waiting, 0)
+        try:
+            os.write(pipe[1], b"\0")
+        except BlockingIOError:
+            # The pipe is full of wakeups already
+            pass
+
+    @coroutine
+    def _wait(self, waiting, pipe, ready):
+        self._set(waiting, 1)
+        if ready():
+            self._set(waiting, 0)
+            return
+
+        if pipe is None:
+            yield from sleep(self.poll_interval)
+            return
+
+        loop = get_event_loop()
+        woken = Future()
+        loop.add_reader(pipe[0], lambda: woken.done() or woken.set_result(None))
+        try:
+            # The timeout covers a wakeup lost between setting the flag and the other side checking it
+            yield from wait([woken], timeout=self.poll_interval)
+        finally:
+            loop.remove_reader(pipe[0])
+            try:
+                os.read(pipe[0], 4096)
+            except BlockingIOError:
+                pass
+
+    def _encode(self, data):
+        if self.record is not None:
+            return self.record.pack(*data)
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise TypeError("SharedMemoryQueueIO carries bytes or records, not {0}".format(type(data).__name__))
+        return data
+
+    def _put(self, payload):
+        # Copy one item into the ring, or return False if there isn't room for it yet
+        need = _LENGTH.size + len(payload)
+        if need > self.capacity // 2:
+            # Any bigger and an item that has to wrap might never find room, even in an empty ring
+            raise ValueError("An item of {0} bytes is too big for a ring of {1}".format(len(payload), self.capacity))
+
+        free = self.capacity - (self.write_position - self._get(_READ))
+        offset = self.write_position % self.capacity
+        tail = self.capacity - offset
+
+        if need > tail:
+            if free < tail + need:
+                return False
+            if tail >= _LENGTH.size:
+                _LENGTH.pack_into(self.buf, _HEADER_SIZE + offset, _WRAP)
+            self.write_position += tail
+            offset = 0
+        elif free < need:
+            return False
+
+        start = _HEADER_SIZE + offset
+        _LENGTH.pack_into(self.buf, start, len(payload))
+        self.buf[start + _LENGTH.size:start + need] = payload
+        self.write_position += need
+        return True
+
+    def _take(self, written):
+        # Copy one item out of the ring, or return None if it is empty
+        while self.read_position != written:
+            offset = self.read_position % self.capacity
+            tail = self.capacity - offset
+            start = _HEADER_SIZE + offset
+
+            length = _LENGTH.unpack_from(self.buf, start)[0] if tail >= _LENGTH.size else _WRAP
+            if length == _WRAP:
+                self.read_position += tail
+                continue
+
+            start += _LENGTH.size
+            if self.record is not None:
+                item = self.record.unpack_from(self.buf, start)
+            else:
+                item = bytes(self.buf[start:start + length])
+            self.read_position += _LENGTH.size + length
+            return item
+        return None
+
+    @coroutine
+    def write(self, data):
+        yield from self.write_many([data])
+
+    @coroutine
+    def write_many(self, items):
+        for item in items:
+            payload = self._encode(item)
+            while not self._put(payload):
+                self._set(_WRITE, self.write_position)
+                self._notify(_READER_WAITING, self.data_pipe)
+                full_at = self._get(_READ)
+                yield from self._wait(_WRITER_WAITING, self.space_pipe, lambda: self._get(_READ) != full_at)
+
+        self._set(_WRITE, self.write_position)
+        self._notify(_READER_WAITING, self.data_pipe)
+        self.status.inc("write_count", len(items))
+
+    @coroutine
+    def read(self):
+        return (yield from self.read_many(1))[0]
+
+    @coroutine
+    def read_many(self, count):
+        while True:
+            written = self._get(_WRITE)
+            items = []
+            while len(items) < count:
+                item = self._take(written)
+                if item is None:
+                    break
+                items.append(item)
+
+            if items:
+                self._set(_READ, self.read_position)
+                self._notify(_WRITER_WAITING, self.space_pipe)
+                self.status.inc("read_count", len(items))
+                return items
+
+            # Only finished once everything written before the close has been read
+            if self._get(_CLOSED) and self._get(_WRITE) == self.read_position:
+                self.status.set("closed", True)
+                raise IOFinished()
+
+            yield from self._wait(_READER_WAITING, self.data_pipe,
+                                  lambda: self._get(_WRITE) != self.read_position or self._get(_CLOSED))
+
+    @coroutine
+    def close(self):
+        self._set(_WRITE, self.write_position)
+        self._set(_CLOSED, 1)
+        self._notify(_READER_WAITING, self.data_pipe, force=True)
+        self.status.set("closed", True)
+
+    def release(self):
+        """
+        Unmap the shared memory. The process that created the queue also removes it.
+        """
+        if self.buf is None:
+            return
+        self.buf = None
+        self.segment.close()
+        for pipe in (self.data_pipe, self.space_pipe):
+            if pipe is not None:
+                os.close(pipe[0])
+                os.close(pipe[1])
+        self.data_pipe = self.space_pipe = None
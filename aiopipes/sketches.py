@@ -0,0 +1,172 @@
+"""
+Fixed size summaries of a stream: a count-min sketch for approximate per-key counts and HyperLogLog
+for approximate distinct counts. Both take single keys with add() or whole NumPy integer arrays with
+add_many(), which hashes and counts the array without a Python loop when NumPy is installed.
+"""
+import hashlib
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .dedup import _key_bytes
+
+__all__ = ["CountMinSketch", "HyperLogLog", "hash64"]
+
+_MASK = (1 << 64) - 1
+
+
+def _splitmix64(x):
+    x = (x + 0x9e3779b97f4a7c15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & _MASK
+    return x ^ (x >> 31)
+
+
+def hash64(key):
+    """
+    A 64 bit hash that is the same in every process, unlike hash(). Integers hash the same way here
+    as in a NumPy array, so single keys and arrays can be mixed.
+    """
+    if isinstance(key, int):
+        return _splitmix64(key & _MASK)
+    # Type tagged like dedup keys, so 1.5 and "1.5" (or "x" and b"x") don't share a hash
+    return int.from_bytes(hashlib.md5(_key_bytes(key)).digest()[:8], "little")
+
+
+def _is_int_array(values):
+    return numpy is not None and isinstance(values, numpy.ndarray) and values.dtype.kind in "iu"
+
+
+def _hash64_array(values):
+    with numpy.errstate(over="ignore"):
+        x = values.astype(numpy.uint64) + numpy.uint64(0x9e3779b97f4a7c15)
+        x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+        return x ^ (x >> numpy.uint64(31))
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts in width * depth counters. Estimates are never too low and, with probability
+    1 - delta, too high by at most epsilon times the total count.
+    """
+    def __init__(self, epsilon=0.001, delta=0.01, width=None, depth=None):
+        self.width = width or int(math.ceil(math.e / epsilon))
+        self.depth = depth or int(math.ceil(math.log(1 / delta)))
+        self.total = 0
+
+        if numpy is not None:
+            self.rows = numpy.zeros((self.depth, self.width), dtype=numpy.int64)
+        else:
+            self.rows = [[0] * self.width for _ in range(self.depth)]
+
+    def _columns(self, hashed):
+        first, second = hashed & 0xffffffff, (hashed >> 32) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        self.total += count
+        for row, column in enumerate(self._columns(hash64(key))):
+            self.rows[row][column] += count
+
+    def add_many(self, keys):
+        if not _is_int_array(keys):
+            for key in keys:
+                self.add(key)
+            return
+
+        hashed = _hash64_array(keys)
+        first = hashed & numpy.uint64(0xffffffff)
+        second = (hashed >> numpy.uint64(32)) | numpy.uint64(1)
+        with numpy.errstate(over="ignore"):
+            for row in range(self.depth):
+                columns = (first + numpy.uint64(row) * second) % numpy.uint64(self.width)
+                numpy.add.at(self.rows[row], columns.astype(numpy.intp), 1)
+        self.total += len(keys)
+
+    def estimate(self, key):
+        return int(min(self.rows[row][column] for row, column in enumerate(self._columns(hash64(key)))))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Only sketches of the same size can be merged")
+
+        if numpy is not None:
+            self.rows += other.rows
+        else:
+            self.rows = [[a + b for a, b in zip(mine, theirs)] for mine, theirs in zip(self.rows, other.rows)]
+        self.total += other.total
+
+    def get_stats(self):
+        return {"total": self.total, "width": self.width, "depth": self.depth,
+                "memory_bytes": self.width * self.depth * 8}
+
+
+class HyperLogLog(object):
+    """
+    Approximate distinct counts in 2 ** precision one byte registers, with a standard error of about
+    1.04 / sqrt(2 ** precision): 0.8% for the default of 14, in 16KB.
+    """
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = numpy.zeros(self.size, dtype=numpy.uint8) if numpy is not None else bytearray(self.size)
+
+    def add(self, key):
+        hashed = hash64(key)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_many(self, keys):
+        if not _is_int_array(keys):
+            for key in keys:
+                self.add(key)
+            return
+
+        bits = 64 - self.precision
+        hashed = _hash64_array(keys)
+        index = (hashed >> numpy.uint64(bits)).astype(numpy.intp)
+        rest = (hashed & numpy.uint64((1 << bits) - 1)).astype(numpy.float64)
+        # floor(log2(rest)) + 1 is the bit length, and an all zero remainder gets the highest rank
+        with numpy.errstate(divide="ignore"):
+            bit_length = numpy.where(rest > 0, numpy.floor(numpy.log2(rest)) + 1, 0)
+        ranks = (bits - bit_length + 1).astype(numpy.uint8)
+        numpy.maximum.at(self.registers, index, ranks)
+
+    def count(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        if numpy is not None:
+            harmonic = float(numpy.sum(numpy.exp2(-self.registers.astype(numpy.float64))))
+            zeros = int(numpy.count_nonzero(self.registers == 0))
+        else:
+            harmonic = sum(2.0 ** -register for register in self.registers)
+            zeros = self.registers.count(0)
+
+        estimate = alpha * size * size / harmonic
+
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is much more accurate while most registers are still empty
+            return int(round(size * math.log(size / zeros)))
+        return int(round(estimate))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("Only HyperLogLogs with the same precision can be merged")
+
+        if numpy is not None:
+            numpy.maximum(self.registers, other.registers, out=self.registers)
+        else:
+            self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def get_stats(self):
+        return {"distinct": self.count(), "precision": self.precision, "memory_bytes": self.size}
@@ -1,11 +1,27 @@
+from collections import deque
 import contextlib
 import inspect
-import traceback
+import logging
+import time
+
+logger = logging.getLogger("aiopipes")
 
 
 class StatusTracker(object):
+    __slots__ = ("parent", "names", "percentages", "status_data", "error_list", "error_counts", "error_total",
+                 "task_list", "_initial", "_pool", "_log_window", "_log_logged", "_log_suppressed")
+
+    # How many released subtasks are kept around for reuse, per set of names
+    pool_size = 64
+    # Only the last max_errors errors (and the data that caused them) are kept
+    max_errors = 100
+    # At most log_burst errors are logged every log_interval seconds, the rest are only counted
+    log_burst = 10
+    log_interval = 10
+
     def __init__(self, *names):
         self.parent = None
+        self.names = names
 
         self.percentages = {
             name.split("_", 1)[1]: {}
@@ -13,14 +29,21 @@ class StatusTracker(object):
             if name.startswith("percentage_")
             }
 
-        self.status_data = {
+        self._initial = {
             name: 0 if name.endswith("_count") else None
             for name in names
             if name not in self.percentages
             }
+        self.status_data = dict(self._initial)
 
-        self.error_list = []
+        self.error_list = deque(maxlen=self.max_errors)
+        self.error_counts = {}
+        self.error_total = 0
         self.task_list = []
+        self._pool = {}
+        self._log_window = 0
+        self._log_logged = 0
+        self._log_suppressed = 0
 
     def get_stats(self):
         # Calculate percentages
@@ -53,25 +76,58 @@ class StatusTracker(object):
             else:
                 second = self.status_data[second]
 
-            if 0 in (first, second):
+            if not first or not second:
                 continue
             percent_done = int((int(first) / int(second)) * 100)
             if percent_done > 100:
-                raise RuntimeError("You messed your percentage variables up: {0} & {1}".format(*data))
+                raise RuntimeError("You messed your percentage variables up: {0} & {1}".format(first, second))
             returner["percentage_" + percentage] = {"percent": percent_done, "data": (first, second)}
 
         returner["subtasks"] = [t.get_stats() for t in self.task_list]
         returner["error_list"] = [e[0] for e in self.error_list]
+        if self.error_total:
+            returner["error_total"] = self.error_total
+            returner["error_counts"] = dict(self.error_counts)
         return returner
 
-    @contextlib.contextmanager
-    def subtask(self, *names):
-        task = StatusTracker(*names)
-        task.parent = self
+    def snapshot(self):
+        """
+        A copy of the raw counters, without calling any functions or working out percentages
+        """
+        return {key: value for key, value in self.status_data.items() if not callable(value)}
+
+    def acquire_subtask(self, *names):
+        pool = self._pool.get(names)
+
+        if pool:
+            task = pool.pop()
+        else:
+            task = StatusTracker(*names)
+            task.parent = self
+
         self.task_list.append(task)
-        yield task
+        return task
+
+    def release_subtask(self, task):
         self.task_list.remove(task)
 
+        pool = self._pool.setdefault(task.names, [])
+        if len(pool) < self.pool_size:
+            task.status_data = dict(task._initial)
+            task.error_list.clear()
+            task.error_counts.clear()
+            task.error_total = 0
+            del task.task_list[:]
+            pool.append(task)
+
+    @contextlib.contextmanager
+    def subtask(self, *names):
+        task = self.acquire_subtask(*names)
+        try:
+            yield task
+        finally:
+            self.release_subtask(task)
+
     def func(self, key_name, func):
         self.status_data[key_name] = func
 
@@ -82,14 +138,42 @@ class StatusTracker(object):
     def set(self, key, value):
         self.status_data[key] = value
 
-    def inc(self, key):
-        self.status_data[key] += 1
+    def inc(self, key, amount=1):
+        self.status_data[key] += amount
 
     def error(self, ex, data=None):
-        traceback.print_exc()
+        self._record(ex, data)
+
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        root._log(ex, data)
+
+    def _record(self, ex, data):
+        name = type(ex).__name__
         self.error_list.append((ex, data))
-        if self.parent:
-            self.parent.error_list.append((ex, data))
+        self.error_counts[name] = self.error_counts.get(name, 0) + 1
+        self.error_total += 1
+
+        if "error_count" in self.status_data:
+            self.status_data["error_count"] += 1
+        if self.parent is not None:
+            self.parent._record(ex, data)
+
+    def _log(self, ex, data):
+        now = time.monotonic()
+
+        if now - self._log_window >= self.log_interval:
+            if self._log_suppressed:
+                logger.warning("%d more errors in the last %d seconds were not logged",
+                               self._log_suppressed, self.log_interval)
+            self._log_window, self._log_logged, self._log_suppressed = now, 0, 0
+
+        if self._log_logged < self.log_burst:
+            self._log_logged += 1
+            logger.error("Error processing %.200r", data, exc_info=(type(ex), ex, ex.__traceback__))
+        else:
+            self._log_suppressed += 1
 
 
 class StatusMixin(object):
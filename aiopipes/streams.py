@@ -0,0 +1,179 @@
+from asyncio import coroutine, get_event_loop, StreamReader, StreamReaderProtocol, StreamWriter
+from asyncio.streams import FlowControlMixin
+import io
+import os
+import stat
+
+__all__ = ["open_reader", "open_writer"]
+
+
+def _is_pipe(fd):
+    try:
+        mode = os.fstat(fd.fileno()).st_mode
+    except (AttributeError, OSError, ValueError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)
+
+
+def _has_fileno(fd):
+    try:
+        fd.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+def _sync(fd):
+    fd.flush()
+    try:
+        os.fsync(fd.fileno())
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Pipes, sockets and in-memory files have nothing to sync
+        pass
+
+
+class SyncReader(object):
+    def __init__(self, fd, chunk_size):
+        self.fd = fd
+        self.chunk_size = chunk_size
+
+    @coroutine
+    def read(self):
+        return self.fd.read(self.chunk_size)
+
+
+class ThreadReader(SyncReader):
+    """
+    Reads the next chunk in the default executor while the current one is being decoded
+    """
+    def __init__(self, fd, chunk_size):
+        super().__init__(fd, chunk_size)
+        self._next = None
+
+    def _read_ahead(self):
+        self._next = get_event_loop().run_in_executor(None, self.fd.read, self.chunk_size)
+
+    @coroutine
+    def read(self):
+        if self._next is None:
+            self._read_ahead()
+
+        chunk = yield from self._next
+        self._next = None
+
+        if chunk:
+            self._read_ahead()
+        return chunk
+
+
+class PipeReader(SyncReader):
+    def __init__(self, fd, chunk_size, reader: StreamReader):
+        super().__init__(fd, chunk_size)
+        self.reader = reader
+
+    @coroutine
+    def read(self):
+        return (yield from self.reader.read(self.chunk_size))
+
+
+class SyncWriter(object):
+    def __init__(self, fd):
+        self.fd = fd
+
+    @coroutine
+    def write(self, data):
+        self.fd.write(data)
+
+    @coroutine
+    def sync(self):
+        _sync(self.fd)
+
+    @coroutine
+    def close(self):
+        self.fd.flush()
+
+
+class ThreadWriter(SyncWriter):
+    """
+    Hands each write to the default executor and only waits for it when the next write comes in,
+    so encoding the next buffer overlaps with writing the previous one.
+    """
+    def __init__(self, fd):
+        super().__init__(fd)
+        self._pending = None
+
+    @coroutine
+    def write(self, data):
+        if self._pending is not None:
+            yield from self._pending
+        self._pending = get_event_loop().run_in_executor(None, self.fd.write, data)
+
+    @coroutine
+    def sync(self):
+        if self._pending is not None:
+            yield from self._pending
+            self._pending = None
+        yield from get_event_loop().run_in_executor(None, _sync, self.fd)
+
+    @coroutine
+    def close(self):
+        if self._pending is not None:
+            yield from self._pending
+            self._pending = None
+        yield from get_event_loop().run_in_executor(None, self.fd.flush)
+
+
+class PipeWriter(SyncWriter):
+    def __init__(self, fd, writer: StreamWriter):
+        super().__init__(fd)
+        self.writer = writer
+
+    @coroutine
+    def write(self, data):
+        self.writer.write(data)
+        yield from self.writer.drain()
+
+    @coroutine
+    def sync(self):
+        yield from self.writer.drain()
+
+    @coroutine
+    def close(self):
+        yield from self.writer.drain()
+        self.writer.close()
+
+
+@coroutine
+def open_reader(fd, chunk_size, nonblocking=True):
+    if not nonblocking or not _has_fileno(fd):
+        return SyncReader(fd, chunk_size)
+
+    if _is_pipe(fd):
+        loop = get_event_loop()
+        reader = StreamReader(limit=chunk_size * 2, loop=loop)
+        try:
+            yield from loop.connect_read_pipe(lambda: StreamReaderProtocol(reader, loop=loop), fd)
+        except (OSError, ValueError, NotImplementedError):
+            # Some character devices (like /dev/null) cannot be polled
+            pass
+        else:
+            return PipeReader(fd, chunk_size, reader)
+
+    return ThreadReader(fd, chunk_size)
+
+
+@coroutine
+def open_writer(fd, nonblocking=True):
+    if not nonblocking or not _has_fileno(fd):
+        return SyncWriter(fd)
+
+    if _is_pipe(fd):
+        loop = get_event_loop()
+        try:
+            transport, protocol = yield from loop.connect_write_pipe(lambda: FlowControlMixin(loop=loop), fd)
+        except (OSError, ValueError, NotImplementedError):
+            pass
+        else:
+            return PipeWriter(fd, StreamWriter(transport, protocol, None, loop))
+
+    return ThreadWriter(fd)
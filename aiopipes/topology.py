@@ -0,0 +1,194 @@
+"""
+Stages that turn a linear pipeline into a graph. tee() sends every item to every branch, route() sends
+each item to one branch, and merge() reads from several inputs at once. Branches are outputs or whole
+pipelines; a pipeline branch is fed through its own queue so a slow branch only holds back the items
+sent to it. Items are passed by reference, never copied, so work done before the split happens once.
+"""
+from asyncio import coroutine, wait
+
+try:
+    from asyncio import ensure_future
+except ImportError:
+    from asyncio import async as ensure_future
+
+from .pipeio import Input, IterableIO, QueueIO, IOFinished
+from .runner import Runnable
+
+__all__ = ["Tee", "Route", "MergeIO", "tee", "route", "merge"]
+
+
+class _Branches(Runnable):
+    def __init__(self, branches, maxsize=0):
+        self.branch_maxsize = maxsize
+        self.branch_runners = []
+        self.branch_outputs = []
+        super().__init__()
+
+        for branch in branches:
+            self.branch_outputs.append(self._branch_output(branch))
+
+    def _branch_output(self, branch):
+        if isinstance(branch, Runnable):
+            queue = QueueIO(maxsize=self.branch_maxsize)
+            branch < queue
+            self.branch_runners.append(branch)
+            return queue
+
+        return self._convert_to_io(branch, _raise=True)
+
+    @coroutine
+    def start(self):
+        branch_futures = [ensure_future(runner.start()) for runner in self.branch_runners]
+        try:
+            yield from super().start()
+        finally:
+            if branch_futures:
+                yield from wait(branch_futures)
+
+    @coroutine
+    def _finish(self):
+        for output in self.branch_outputs:
+            yield from output.close()
+
+    @coroutine
+    def _read(self):
+        if self.batch_size:
+            return (yield from self.input.read_many(self.batch_size))
+        return [(yield from self.input.read())]
+
+    @coroutine
+    def _send(self, output, items):
+        if len(items) == 1:
+            yield from output.write(items[0])
+        else:
+            yield from output.write_many(items)
+
+
+class Tee(_Branches):
+    """
+    Writes every item to every branch, and to its own output if it has one
+    """
+    @coroutine
+    def _run(self):
+        while not self._should_retire():
+            items = yield from self._read()
+            self.in_flight += len(items)
+
+            for output in self.branch_outputs:
+                yield from self._send(output, items)
+            if self.output is not None:
+                yield from self._send(self.output, items)
+
+            self.in_flight -= len(items)
+
+
+class Route(_Branches):
+    """
+    Writes each item to the branch key_fn(item) picks: an index into a list of branches or a key of a
+    dict of them. Items with no matching branch go to this stage's own output, or are counted as errors.
+    """
+    status_props = {"unrouted_count"}
+
+    def __init__(self, key_fn, branches, maxsize=0):
+        self.key_fn = key_fn
+        if isinstance(branches, dict):
+            keys, branches = zip(*branches.items()) if branches else ((), ())
+        else:
+            keys = range(len(branches))
+
+        super().__init__(branches, maxsize)
+        self.routes = dict(zip(keys, self.branch_outputs))
+
+    @coroutine
+    def _run(self):
+        while not self._should_retire():
+            items = yield from self._read()
+            self.in_flight += len(items)
+            routed = {}
+
+            for item in items:
+                try:
+                    output = self.routes.get(self.key_fn(item), self.output)
+                except Exception as ex:
+                    yield from self._failed(self.status, ex, item)
+                    continue
+
+                if output is None:
+                    self.status.inc("unrouted_count")
+                    yield from self._failed(self.status, KeyError("No branch for item"), item)
+                    continue
+
+                routed.setdefault(output, []).append(item)
+
+            for output, routed_items in routed.items():
+                yield from self._send(output, routed_items)
+
+            self.in_flight -= len(items)
+
+
+class MergeIO(QueueIO):
+    """
+    A queue with several writers. It is only closed once all of its producers have closed it, so the
+    branches of a tee or route can feed one downstream pipeline.
+    """
+    def __init__(self, producers, **kwargs):
+        self.producers = producers
+        super().__init__(**kwargs)
+
+    @coroutine
+    def close(self):
+        self.producers -= 1
+        if self.producers <= 0:
+            return (yield from super().close())
+
+
+class _MergedInput(MergeIO):
+    # Reads every input into the queue at once, starting on the first read
+    def __init__(self, inputs, maxsize):
+        self.inputs = [input if isinstance(input, Input) else IterableIO(input) for input in inputs]
+        self.pumps = None
+        super().__init__(len(self.inputs), maxsize=maxsize)
+
+    @coroutine
+    def _pump(self, input: Input):
+        try:
+            while True:
+                try:
+                    items = yield from input.read_many(100)
+                except IOFinished:
+                    return
+                yield from self.write_many(items)
+        except Exception as ex:
+            self.status.error(ex)
+        finally:
+            yield from self.close()
+
+    def _start(self):
+        self.pumps = [ensure_future(self._pump(input)) for input in self.inputs]
+
+    @coroutine
+    def read(self):
+        if self.pumps is None:
+            self._start()
+        return (yield from super().read())
+
+    @coroutine
+    def read_many(self, count):
+        if self.pumps is None:
+            self._start()
+        return (yield from super().read_many(count))
+
+
+def tee(*branches, maxsize=0):
+    return Tee(branches, maxsize)
+
+
+def route(key_fn, branches, maxsize=0):
+    return Route(key_fn, branches, maxsize)
+
+
+def merge(*inputs, maxsize=0):
+    """
+    An input that reads from all of inputs concurrently, in whatever order items arrive
+    """
+    return _MergedInput(inputs, maxsize)
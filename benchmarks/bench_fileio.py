@@ -0,0 +1,87 @@
+"""
+Compares reading and writing JSON lines through FileIO and BinaryFileIO.
+
+    python -m benchmarks.bench_fileio [lines]
+"""
+from asyncio import coroutine, get_event_loop
+import json
+import os
+import sys
+import tempfile
+import time
+
+from aiopipes import FileIO, BinaryFileIO
+from aiopipes.codecs import orjson
+from aiopipes.pipeio import IOFinished
+
+
+def make_input(path, lines):
+    with open(path, "w") as fd:
+        for i in range(lines):
+            fd.write(json.dumps({"id": i, "name": "item {0}".format(i), "tags": ["a", "b"], "score": i / 3}) + "\n")
+
+
+@coroutine
+def drain(io, batch=None):
+    count = 0
+    while True:
+        try:
+            if batch:
+                count += len((yield from io.read_many(batch)))
+            else:
+                yield from io.read()
+                count += 1
+        except IOFinished:
+            return count
+
+
+@coroutine
+def fill(io, items, batch=None):
+    if batch:
+        for i in range(0, len(items), batch):
+            yield from io.write_many(items[i:i + batch])
+    else:
+        for item in items:
+            yield from io.write(item)
+    yield from io.close()
+
+
+def timed(run, coro):
+    started = time.perf_counter()
+    result = run(coro)
+    return time.perf_counter() - started, result
+
+
+def bench(lines=200000):
+    run = get_event_loop().run_until_complete
+    results = {}
+    codecs = ["json", "orjson"] if orjson is not None else ["json"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "input.jsonl")
+        make_input(path, lines)
+
+        elapsed, count = timed(run, drain(FileIO(open(path))))
+        results["read.FileIO"] = count / elapsed
+
+        for codec in codecs:
+            elapsed, count = timed(run, drain(BinaryFileIO(open(path, "rb"), codec=codec), batch=1000))
+            results["read.BinaryFileIO." + codec] = count / elapsed
+
+        with open(path) as fd:
+            items = [json.loads(line) for line in fd]
+
+        elapsed, _ = timed(run, fill(FileIO(open(os.path.join(tmp, "out.jsonl"), "w")), items))
+        results["write.FileIO"] = lines / elapsed
+
+        for codec in codecs:
+            out = BinaryFileIO(open(os.path.join(tmp, "out.jsonl"), "wb"), codec=codec)
+            elapsed, _ = timed(run, fill(out, items, batch=1000))
+            results["write.BinaryFileIO." + codec] = lines / elapsed
+
+    return results
+
+
+if __name__ == "__main__":
+    for name, rate in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<32} {1:>12,.0f} items/sec".format(name, rate))
@@ -0,0 +1,49 @@
+"""
+Peak memory, as seen by tracemalloc, while a fast producer feeds a slow consumer. Without a bound the
+queue in between holds nearly every item; maxsize and memory_budget should keep it flat.
+
+    python -m benchmarks.bench_memory [items]
+"""
+from asyncio import coroutine, get_event_loop, sleep
+import sys
+import tracemalloc
+
+from aiopipes import Pipeline, IterableIO
+
+from .bench_status import Sink
+
+
+def payload(item):
+    return "x" * 1000
+
+
+@coroutine
+def slow(item):
+    yield from sleep(0)
+    return None
+
+
+def peak_memory(items, **options):
+    pipeline = Pipeline("bench", **options) | payload | slow
+    pipeline < IterableIO(range(items))
+    pipeline > Sink()
+
+    tracemalloc.start()
+    try:
+        get_event_loop().run_until_complete(pipeline.start())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(items=20000):
+    return {
+        "memory.peak_bytes.unbounded": peak_memory(items),
+        "memory.peak_bytes.maxsize_100": peak_memory(items, maxsize=100),
+        "memory.peak_bytes.budget_1mb": peak_memory(items, memory_budget=1 << 20),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<36} {1:>14,}".format(name, value))
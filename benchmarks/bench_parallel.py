@@ -0,0 +1,56 @@
+"""
+Shows how parallel(n) scales, for stages that wait on IO (async sleeps) and for CPU bound stages
+run on the loop and in a process pool.
+
+    python -m benchmarks.bench_parallel [items]
+"""
+from asyncio import coroutine, get_event_loop, sleep
+import sys
+import time
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.runner import FunctionRunner
+
+from .bench_status import Sink
+
+
+@coroutine
+def wait_io(item):
+    yield from sleep(0.001)
+    return item
+
+
+def burn(item):
+    total = 0
+    for i in range(2000):
+        total += i * i
+    return item + total % 2
+
+
+def run_stage(items, stage):
+    pipeline = Pipeline("bench") | stage
+    pipeline < IterableIO(range(items))
+    pipeline > Sink()
+
+    started = time.perf_counter()
+    get_event_loop().run_until_complete(pipeline.start())
+    return items / (time.perf_counter() - started)
+
+
+def bench(items=2000):
+    results = {}
+
+    for workers in (1, 4, 16, 64):
+        results["parallel.sleep.{0}".format(workers)] = run_stage(items, FunctionRunner(wait_io).parallel(workers))
+
+    for workers in (1, 4):
+        results["parallel.cpu.{0}".format(workers)] = run_stage(items, FunctionRunner(burn).parallel(workers))
+        results["parallel.cpu.processes.{0}".format(workers)] = run_stage(
+            items, FunctionRunner(burn).processes(workers, chunk_size=50))
+
+    return results
+
+
+if __name__ == "__main__":
+    for name, rate in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<32} {1:>12,.0f} items/sec".format(name, rate))
@@ -0,0 +1,85 @@
+"""
+Measures the engine's own overhead: no-op pipelines of increasing length, and the cost of a single
+QueueIO hop on its own.
+
+    python -m benchmarks.bench_pipeline [items]
+"""
+from asyncio import coroutine, get_event_loop
+import sys
+import time
+
+from aiopipes import Pipeline, IterableIO, QueueIO
+from aiopipes.pipeio import IOFinished
+from aiopipes.runner import FunctionRunner
+
+from .bench_status import Sink, noop
+
+
+def run_stages(items, stages, batch_size=None, fuse=False):
+    pipeline = Pipeline("bench", batch_size=batch_size, fuse=fuse)
+    for _ in range(stages):
+        pipeline = pipeline | FunctionRunner(noop)
+
+    pipeline < IterableIO(range(items))
+    pipeline > Sink()
+
+    started = time.perf_counter()
+    get_event_loop().run_until_complete(pipeline.start())
+    return items / (time.perf_counter() - started)
+
+
+@coroutine
+def hop(queue_io, items, batch=None):
+    @coroutine
+    def produce():
+        if batch:
+            for i in range(0, items, batch):
+                yield from queue_io.write_many(list(range(i, min(i + batch, items))))
+        else:
+            for i in range(items):
+                yield from queue_io.write(i)
+        yield from queue_io.close()
+
+    @coroutine
+    def consume():
+        count = 0
+        while True:
+            try:
+                if batch:
+                    count += len((yield from queue_io.read_many(batch)))
+                else:
+                    yield from queue_io.read()
+                    count += 1
+            except IOFinished:
+                return count
+
+    producer = get_event_loop().create_task(produce())
+    count = yield from consume()
+    yield from producer
+    return count
+
+
+def bench(items=100000):
+    run = get_event_loop().run_until_complete
+    results = {}
+
+    for stages in (1, 2, 4, 8):
+        results["pipeline.noop.{0}_stages".format(stages)] = run_stages(items, stages)
+    results["pipeline.noop.4_stages.batched"] = run_stages(items, 4, batch_size=100)
+    results["pipeline.noop.8_stages.fused"] = run_stages(items, 8, fuse=True)
+
+    for name, queue_io, batch in [("queueio.hop", QueueIO(), None),
+                                  ("queueio.hop.bounded", QueueIO(maxsize=100), None),
+                                  ("queueio.hop.batched", QueueIO(batch_size=100), 100)]:
+        started = time.perf_counter()
+        run(hop(queue_io, items, batch))
+        elapsed = time.perf_counter() - started
+        results[name] = items / elapsed
+        results[name + ".us_per_item"] = elapsed / items * 1e6
+
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<36} {1:>12,.1f}".format(name, value))
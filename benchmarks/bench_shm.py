@@ -0,0 +1,87 @@
+"""
+Items per second from a child process to this one, through a pickling multiprocessing.Queue (an item
+at a time and in batches of 100) and through SharedMemoryQueueIO.
+
+    python -m benchmarks.bench_shm [items] [item_size]
+"""
+from asyncio import get_event_loop, new_event_loop, set_event_loop
+import multiprocessing
+import sys
+import time
+
+from aiopipes import SharedMemoryQueueIO
+from aiopipes.pipeio import IOFinished
+
+BATCH = 100
+
+
+def payloads(item_size):
+    # Distinct objects, so pickle can't send a batch of them as one item and 99 references
+    return [bytes([i]) * item_size for i in range(BATCH)]
+
+
+def produce_queue(queue, items, item_size, batch):
+    batch_items = payloads(item_size)
+    if batch:
+        for _ in range(items // BATCH):
+            queue.put(batch_items)
+    else:
+        for i in range(items):
+            queue.put(batch_items[i % BATCH])
+    queue.put(None)
+
+
+def produce_shm(queue, items, item_size):
+    set_event_loop(new_event_loop())
+    batch_items = payloads(item_size)
+    for _ in range(items // BATCH):
+        get_event_loop().run_until_complete(queue.write_many(batch_items))
+    get_event_loop().run_until_complete(queue.close())
+
+
+def queue_rate(context, items, item_size, batch):
+    queue = context.Queue(maxsize=64)
+    process = context.Process(target=produce_queue, args=(queue, items, item_size, batch))
+
+    started = time.perf_counter()
+    process.start()
+    while queue.get() is not None:
+        pass
+    elapsed = time.perf_counter() - started
+
+    process.join()
+    return items / elapsed
+
+
+def shm_rate(context, items, item_size):
+    queue = SharedMemoryQueueIO()
+    process = context.Process(target=produce_shm, args=(queue, items, item_size))
+    loop = get_event_loop()
+
+    started = time.perf_counter()
+    process.start()
+    try:
+        while True:
+            loop.run_until_complete(queue.read_many(BATCH))
+    except IOFinished:
+        pass
+    elapsed = time.perf_counter() - started
+
+    process.join()
+    queue.release()
+    return items / elapsed
+
+
+def bench(items=200000, item_size=100):
+    # The ring's wakeup pipes are inherited, so the producer has to be forked
+    context = multiprocessing.get_context("fork")
+    return {
+        "shm.queue.items_per_sec": queue_rate(context, items, item_size, False),
+        "shm.queue_batched.items_per_sec": queue_rate(context, items, item_size, True),
+        "shm.ring.items_per_sec": shm_rate(context, items, item_size),
+    }
+
+
+if __name__ == "__main__":
+    for name, rate in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<32} {1:>12,.0f}".format(name, rate))
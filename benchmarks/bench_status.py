@@ -0,0 +1,74 @@
+"""
+Measures how much of a pipeline's throughput goes on status tracking and metrics, by running the same
+pipeline with every StatusTracker and metrics recording method replaced by a no-op.
+
+    python -m benchmarks.bench_status [items] [stages]
+"""
+from asyncio import coroutine, get_event_loop
+import sys
+import time
+
+from aiopipes import Pipeline, IterableIO, Output
+from aiopipes.runner import FunctionRunner
+from aiopipes.metrics import Histogram, StageMetrics
+from aiopipes.status import StatusTracker
+
+
+class Sink(Output):
+    @coroutine
+    def write(self, data):
+        pass
+
+    @coroutine
+    def close(self):
+        pass
+
+
+def noop(item):
+    return item
+
+
+def run_pipeline(items, stages):
+    pipeline = Pipeline("bench")
+    for _ in range(stages):
+        pipeline = pipeline | FunctionRunner(noop)
+
+    pipeline < IterableIO(range(items))
+    pipeline > Sink()
+
+    started = time.perf_counter()
+    get_event_loop().run_until_complete(pipeline.start())
+    return items / (time.perf_counter() - started)
+
+
+def bench(items=100000, stages=3, repeat=3):
+    tracked = max(run_pipeline(items, stages) for _ in range(repeat))
+
+    patches = [
+        (StatusTracker, "inc", lambda self, *args: None),
+        (StatusTracker, "set", lambda self, *args: None),
+        (StatusTracker, "acquire_subtask", lambda self, *names: StatusTracker(*names)),
+        (StatusTracker, "release_subtask", lambda self, task: None),
+        (StageMetrics, "record", lambda self, *args: None),
+        (Histogram, "record", lambda self, *args: None),
+    ]
+    originals = [(klass, name, getattr(klass, name)) for klass, name, _ in patches]
+
+    for klass, name, method in patches:
+        setattr(klass, name, method)
+    try:
+        untracked = max(run_pipeline(items, stages) for _ in range(repeat))
+    finally:
+        for klass, name, method in originals:
+            setattr(klass, name, method)
+
+    return {
+        "status.tracked": tracked,
+        "status.untracked": untracked,
+        "status.overhead_percent": max(0.0, (untracked - tracked) / untracked * 100),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in sorted(bench(*map(int, sys.argv[1:])).items()):
+        print("{0:<28} {1:>12,.1f}".format(name, value))
@@ -0,0 +1,100 @@
+"""
+Runs every benchmark and prints the results as JSON, so runs from different commits can be compared.
+
+    python -m benchmarks.run [--quick] [--only NAME ...] [--output results.json] [--compare old.json]
+
+With --compare the results are checked against an earlier run and any metric that got more than
+--threshold percent worse is listed. The exit status is 1 if anything regressed.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from . import bench_fileio, bench_memory, bench_parallel, bench_pipeline, bench_shm, bench_status
+
+# The arguments to each bench() for a full run, and for a quick smoke run
+SUITES = {
+    "pipeline": (bench_pipeline, {"items": 100000}, {"items": 5000}),
+    "fileio": (bench_fileio, {"lines": 200000}, {"lines": 5000}),
+    "parallel": (bench_parallel, {"items": 2000}, {"items": 200}),
+    "status": (bench_status, {"items": 100000}, {"items": 5000, "repeat": 1}),
+    "memory": (bench_memory, {"items": 20000}, {"items": 2000}),
+    "shm": (bench_shm, {"items": 200000}, {"items": 10000}),
+}
+
+
+def lower_is_better(name):
+    return name.endswith((".us_per_item", "_percent")) or ".peak_bytes." in name
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, quick=False):
+    results = {}
+    for name in names:
+        module, full, smoke = SUITES[name]
+        results.update(module.bench(**(smoke if quick else full)))
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(old, new, threshold):
+    """
+    Metrics in new that are more than threshold percent worse than in old, as (name, old, new, percent)
+    """
+    regressions = []
+    for name, value in sorted(new["results"].items()):
+        before = old["results"].get(name)
+        if not before:
+            continue
+
+        change = (value - before) / before * 100
+        worse = change if lower_is_better(name) else -change
+        if worse > threshold:
+            regressions.append((name, before, value, worse))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the aiopipes benchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(SUITES), default=sorted(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Small inputs, to check the benchmarks work")
+    parser.add_argument("--output", help="Write the JSON results here as well as to stdout")
+    parser.add_argument("--compare", help="An earlier JSON results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent change that counts as a regression")
+    args = parser.parse_args(argv)
+
+    report = run(args.only, args.quick)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            fd.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare(json.load(fd), report, args.threshold)
+        for name, before, after, worse in regressions:
+            print("{0}: {1:,.2f} -> {2:,.2f} ({3:.1f}% worse)".format(name, before, after, worse), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
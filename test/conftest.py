@@ -1,3 +1,4 @@
+import sys
 import pytest
 from aiopipes import Pipeline
 from . import TestIO
@@ -21,3 +22,5 @@ def test_io(pipeline):
     return io
 
 
+# Native async syntax is a SyntaxError before Python 3.6 (async generators)
+collect_ignore = ["test_async.py"] if sys.version_info < (3, 6) else []
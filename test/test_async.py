@@ -0,0 +1,134 @@
+from asyncio import sleep
+
+from aiopipes import Pipeline, AsyncIterableIO, QueueIO
+from aiopipes.runner import FunctionRunner
+
+
+async def numbers(count):
+    for i in range(count):
+        await sleep(0)
+        yield i
+
+
+def test_async_iterable_input(pipeline, test_io, run):
+    pipeline < numbers(5)
+    pipeline = pipeline | (lambda x: x * 2)
+    pipeline > test_io
+    run(pipeline.start())
+
+    assert isinstance(pipeline.input, AsyncIterableIO)
+    assert test_io.q == [0, 2, 4, 6, 8]
+    assert pipeline.input.status.status_data["read_count"] == 5
+
+
+async def pairs(items):
+    # Fan-in: two items in, one out. Fan-out: each pair becomes its sum and its product
+    pending = None
+    async for item in items:
+        if pending is None:
+            pending = item
+            continue
+        yield pending + item
+        yield pending * item
+        pending = None
+
+
+def test_async_generator_stage(pipeline, test_io, run):
+    pipeline = pipeline | pairs
+    pipeline < range(6)
+    pipeline > test_io
+    run(pipeline.start())
+
+    assert test_io.q == [1, 0, 5, 6, 9, 20]
+    assert pipeline.pipes[0].status.status_data["done_count"] == 6
+
+
+def test_async_generator_stage_batched_parallel(run):
+    async def double(items):
+        async for item in items:
+            await sleep(0)
+            yield item
+            yield item
+
+    output = QueueIO()
+    pipeline = Pipeline("Test", batch_size=10) | FunctionRunner(double).parallel(3)
+    pipeline < numbers(100)
+    pipeline > output
+    run(pipeline.start())
+
+    assert output.queue.items_queued == 200
+
+
+def test_async_generator_stage_errors(pipeline, test_io, run):
+    async def fragile(items):
+        async for item in items:
+            if item == 2:
+                raise ValueError(item)
+            yield item
+
+    pipeline = pipeline | fragile
+    pipeline < range(5)
+    pipeline > test_io
+    run(pipeline.start())
+
+    assert test_io.q == [0, 1, 3, 4]
+    assert pipeline.pipes[0].status.error_list[0][1] == 2
+
+
+def test_async_generator_stage_returns_early(pipeline, test_io, run):
+    async def take_two(items):
+        taken = 0
+        async for item in items:
+            yield item
+            taken += 1
+            if taken == 2:
+                return
+
+    pipeline = pipeline | take_two
+    pipeline < range(7)
+    pipeline > test_io
+    run(pipeline.start())
+
+    assert test_io.q == [0, 1]
+
+
+def test_async_generator_stage_returns_early_from_batch(run):
+    async def take_one(items):
+        async for item in items:
+            yield item
+            return
+
+    output = QueueIO()
+    pipeline = Pipeline("Test", batch_size=10) | take_one
+    pipeline < range(20)
+    pipeline > output
+    run(pipeline.start())
+
+    runner = pipeline.runners[0]
+    assert runner.in_flight == 0
+    assert runner.idle()
+
+
+def test_async_generator_stage_takes_nothing(run):
+    async def nothing(items):
+        return
+        yield
+
+    output = QueueIO()
+    pipeline = Pipeline("Test") | nothing
+    pipeline < range(7)
+    pipeline > output
+    run(pipeline.start())
+
+    assert output.queue.items_queued == 0
+
+
+def test_async_generator_stage_not_checkpointed(tmpdir, run):
+    pipeline = Pipeline("Test") | pairs
+    pipeline < range(6)
+    pipeline > QueueIO()
+    pipeline.checkpoint(str(tmpdir.join("checkpoint")))
+    run(pipeline.start())
+
+    assert isinstance(pipeline.status.error_list[0][0], RuntimeError)
+    assert pipeline.output.queue.items_queued == 0
@@ -0,0 +1,104 @@
+from asyncio import coroutine, sleep
+
+from aiopipes import Pipeline, IterableIO, QueueIO
+from aiopipes.autoscale import Autoscaler
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+class RecordingAutoscaler(Autoscaler):
+    def __init__(self, *args, **kwargs):
+        self.seen = []
+        super().__init__(*args, **kwargs)
+
+    def step(self):
+        super().step()
+        self.seen.append([runner.concurrency for runner in self.pipe.pipes])
+
+
+def test_autoscaler_adds_workers_to_bottleneck(run):
+    @coroutine
+    def slow(item):
+        yield from sleep(0.01)
+        return item
+
+    pipeline = Pipeline("Test") | (lambda x: x) | FunctionRunner(slow).autoscale(1, 4)
+    pipeline < IterableIO(range(100))
+    output = QueueIO()
+    pipeline > output
+
+    scaler = RecordingAutoscaler(pipeline, interval=0.02)
+    run(scaler.monitor(pipeline.start()))
+
+    assert max(seen[1] for seen in scaler.seen) == 4
+    assert scaler.status.status_data["scale_up_count"] >= 3
+    assert output.queue.items_queued == 100
+
+
+def test_autoscaler_keeps_ordered_stage_in_order(run):
+    @coroutine
+    def jittery(item):
+        yield from sleep(0.01 if item % 3 else 0.02)
+        return item
+
+    stage = FunctionRunner(jittery).parallel(1, ordered=True).autoscale(1, 4)
+    pipeline = Pipeline("Test") | (lambda x: x) | stage
+    pipeline < IterableIO(range(100))
+    output = TestIO()
+    pipeline > output
+
+    scaler = RecordingAutoscaler(pipeline, interval=0.02)
+    run(scaler.monitor(pipeline.start()))
+
+    assert max(seen[1] for seen in scaler.seen) > 1
+    assert output.q == list(range(100))
+
+
+def test_autoscaler_retires_idle_workers(run):
+    def source():
+        for i in range(10):
+            yield i
+
+    @coroutine
+    def slow_source(item):
+        yield from sleep(0.02)
+        return item
+
+    stage = FunctionRunner(lambda x: x).parallel(3).autoscale(1, 3)
+    pipeline = Pipeline("Test") | slow_source | stage
+    pipeline < IterableIO(source())
+    output = QueueIO()
+    pipeline > output
+
+    scaler = RecordingAutoscaler(pipeline, interval=0.01, cooldown=2)
+    run(scaler.monitor(pipeline.start()))
+
+    assert scaler.seen[-1][1] == 1
+    assert scaler.status.status_data["scale_down_count"] == 2
+    assert output.queue.items_queued == 10
+
+
+def test_autoscaler_moves_workers_within_budget(run):
+    @coroutine
+    def slow_source(item):
+        yield from sleep(0.005)
+        return item
+
+    @coroutine
+    def slow_sink(item):
+        yield from sleep(0.03)
+        return item
+
+    idle = FunctionRunner(lambda x: x).parallel(3).autoscale(1, 3)
+    busy = FunctionRunner(slow_sink).autoscale(1, 3)
+    pipeline = Pipeline("Test") | slow_source | idle | busy
+    pipeline < IterableIO(range(40))
+    output = QueueIO()
+    pipeline > output
+
+    scaler = RecordingAutoscaler(pipeline, interval=0.01, cooldown=100, max_total_workers=5)
+    run(scaler.monitor(pipeline.start()))
+
+    assert all(sum(seen) <= 5 for seen in scaler.seen)
+    assert max(seen[2] for seen in scaler.seen) == 3
+    assert output.queue.items_queued == 40
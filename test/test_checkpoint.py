@@ -0,0 +1,115 @@
+from asyncio import coroutine, sleep
+import json
+
+import pytest
+
+from aiopipes import Pipeline, IterableIO, FileIO
+from aiopipes.checkpoint import Checkpointer, load_checkpoint
+from aiopipes.filters import group_by
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+class RecordingCheckpointer(Checkpointer):
+    def __init__(self, *args, **kwargs):
+        self.written = []
+        super().__init__(*args, **kwargs)
+
+    def write(self, checkpoint):
+        self.written.append(checkpoint)
+        super().write(checkpoint)
+
+
+@coroutine
+def slow(item):
+    yield from sleep(0.001)
+    return item
+
+
+def checkpointed(path, *stages):
+    pipeline = Pipeline("Test")
+    for stage in stages:
+        pipeline = pipeline | stage
+    pipeline.checkpointer = RecordingCheckpointer(path, interval=0.01)
+    return pipeline
+
+
+def test_resume_file_input(tmpdir, run):
+    source = tmpdir.join("input.jsonl")
+    source.write("".join(json.dumps(i) + "\n" for i in range(100)))
+    path = str(tmpdir.join("checkpoint"))
+
+    pipeline = checkpointed(path, FunctionRunner(slow).parallel(4))
+    output = TestIO()
+    pipeline < FileIO(open(str(source)))
+    pipeline > output
+    run(pipeline.start())
+
+    checkpoints = pipeline.checkpointer.written
+    assert len(checkpoints) > 2 and checkpoints[-1]["finished"]
+    assert pipeline.status.status_data["checkpoint_count"] == len(checkpoints) - 1
+    assert load_checkpoint(path)["finished"]
+    with pytest.raises(RuntimeError):
+        pipeline.resume(path)
+
+    # Everything before a checkpoint had been written when it was taken, and resuming reads the rest
+    checkpoint = checkpoints[len(checkpoints) // 2]
+    with open(str(source)) as fd:
+        done = fd.read(checkpoint["position"]).count("\n")
+    assert sorted(output.q[:done]) == list(range(done))
+
+    resumed = Pipeline("Test") | FunctionRunner(slow).parallel(4)
+    resumed.resume(checkpoint)
+    output = TestIO()
+    resumed < FileIO(open(str(source)))
+    resumed > output
+    run(resumed.start())
+
+    assert sorted(output.q) == list(range(done, 100))
+
+
+def test_checkpoint_output_is_on_disk(tmpdir, run):
+    source = tmpdir.join("input.jsonl")
+    source.write("".join(json.dumps(i) + "\n" for i in range(100)))
+    target = tmpdir.join("output.jsonl")
+    on_disk = []
+
+    class DiskCheckpointer(RecordingCheckpointer):
+        def write(self, checkpoint):
+            # What a resume after a crash right now would find
+            with open(str(target), "rb") as fd:
+                on_disk.append(fd.read().count(b"\n"))
+            super().write(checkpoint)
+
+    pipeline = Pipeline("Test") | FunctionRunner(slow).parallel(4)
+    pipeline.checkpointer = DiskCheckpointer(str(tmpdir.join("checkpoint")), interval=0.01)
+    pipeline < FileIO(open(str(source)))
+    pipeline > FileIO(open(str(target), "w"))
+    run(pipeline.start())
+
+    checkpoints = pipeline.checkpointer.written[:-1]
+    assert len(checkpoints) > 2
+    with open(str(source)) as fd:
+        text = fd.read()
+    for checkpoint, lines in zip(checkpoints, on_disk):
+        assert lines == text[:checkpoint["position"]].count("\n")
+
+
+def test_resume_restores_stage_state(tmpdir, run):
+    path = str(tmpdir.join("checkpoint"))
+    pipeline = checkpointed(path, slow, group_by(lambda x: x % 3))
+    pipeline < IterableIO(range(60))
+    pipeline > TestIO()
+    run(pipeline.start())
+
+    checkpoint = pipeline.checkpointer.written[0]
+    assert 0 < checkpoint["position"] < 60
+    assert sum(checkpoint["states"][1][0].values()) == checkpoint["position"]
+
+    resumed = (Pipeline("Test") | slow | group_by(lambda x: x % 3)).resume(checkpoint)
+    output = TestIO()
+    resumed < IterableIO(range(60))
+    resumed > output
+    run(resumed.start())
+
+    assert output.q == [{0: 20, 1: 20, 2: 20}]
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.pipeio import IOFinished
+from aiopipes.columnar import ColumnarFileInput, ColumnarFileOutput, ArrayIO, batch_rows, to_rows
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+def test_columnar_counts_rows(run):
+    batches = [{"a": list(range(i, i + 5)), "b": [1] * 5} for i in range(0, 50, 5)]
+
+    def total(batch):
+        return {"total": [a + b for a, b in zip(batch["a"], batch["b"])]}
+
+    output = TestIO()
+    pipeline = Pipeline("Test", columnar=True) | FunctionRunner(total) | FunctionRunner(lambda batch: batch)
+    pipeline < IterableIO(batches)
+    pipeline > output
+    run(pipeline.start())
+
+    assert [row["total"] for batch in output.q for row in to_rows(batch)] == [i + 1 for i in range(50)]
+    assert [runner.status.get_stats()["done_count"] for runner in pipeline.pipes] == [50, 50]
+    assert batch_rows([1, 2, 3]) == 3
+
+
+def test_columnar_metrics_count_rows(run):
+    batches = [{"a": list(range(1000))} for _ in range(80)]
+
+    pipeline = Pipeline("Test", columnar=True) | FunctionRunner(lambda batch: batch)
+    pipeline < IterableIO(batches)
+    pipeline > TestIO()
+    run(pipeline.start())
+
+    stats = pipeline.pipes[0].status.get_stats()
+    assert stats["done_count"] == 80000
+    # Only one batch in eight is timed, but it stands for the rows of all eight
+    assert stats["service_time"]["count"] == 80000
+
+
+def test_numpy_batches(tmpdir, run):
+    numpy = pytest.importorskip("numpy")
+    dtype = [("id", "i8"), ("value", "f8")]
+
+    def double(batch):
+        batch = batch.copy()
+        batch["value"] *= 2
+        return batch
+
+    output = TestIO()
+    pipeline = Pipeline("Test", columnar=True) | FunctionRunner(double)
+    pipeline < ArrayIO(numpy.array([(i, i / 2) for i in range(1000)], dtype=dtype), batch_rows=300)
+    pipeline > output
+    run(pipeline.start())
+
+    assert [len(batch) for batch in output.q] == [300, 300, 300, 100]
+    assert numpy.concatenate(output.q)["value"].tolist() == [float(i) for i in range(1000)]
+    assert pipeline.pipes[0].status.get_stats()["done_count"] == 1000
+
+    # JSONL straight into structured arrays, without pyarrow
+    path = tmpdir.join("rows.jsonl")
+    path.write("".join(json.dumps({"id": i, "value": i / 4, "other": "x"}) + "\n" for i in range(10)))
+    inp = ColumnarFileInput(str(path), batch_rows=4, dtype=dtype)
+    batches = [run(inp.read()) for _ in range(3)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert numpy.concatenate(batches)["id"].tolist() == list(range(10))
+    assert inp.status.get_stats()["read_count"] == 10
+
+
+def test_numpy_columns_to_jsonl(tmpdir, run):
+    numpy = pytest.importorskip("numpy")
+    path = str(tmpdir.join("rows.jsonl"))
+    batch = {"id": numpy.arange(5), "value": numpy.arange(5) / 2}
+
+    output = ColumnarFileOutput(path)
+    run(output.write(batch))
+    run(output.close())
+
+    with open(path) as fd:
+        assert [json.loads(line) for line in fd] == [{"id": i, "value": i / 2} for i in range(5)]
+    batch = run(ColumnarFileInput(path, dtype=[("id", "i8"), ("value", "f8")]).read())
+    assert batch["id"].tolist() == list(range(5))
+
+
+def test_arrow_files(tmpdir, run):
+    pyarrow = pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.parquet")
+    table = pyarrow.Table.from_arrays([pyarrow.array(range(100)), pyarrow.array([str(i) for i in range(100)])],
+                                      names=["id", "name"])
+
+    path = str(tmpdir.join("rows.parquet"))
+    pipeline = Pipeline("Test", columnar=True) | FunctionRunner(lambda batch: batch)
+    pipeline < ArrayIO(table, batch_rows=30)
+    output = ColumnarFileOutput(path)
+    pipeline > output
+    run(pipeline.start())
+    assert output.status.get_stats()["write_count"] == 100
+
+    inp = ColumnarFileInput(path, batch_rows=40, columns=["id"])
+    ids = []
+    with pytest.raises(IOFinished):
+        while True:
+            ids.extend(run(inp.read()).column(0).to_pylist())
+    assert ids == list(range(100))
+    assert inp.status.get_stats()["percentage_done"]["percent"] == 100
+
+    jsonl = str(tmpdir.join("rows.jsonl"))
+    output = ColumnarFileOutput(jsonl)
+    run(output.write(table.to_batches()[0]))
+    run(output.close())
+    assert run(ColumnarFileInput(jsonl).read()).to_pydict() == table.to_pydict()
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.dedup import LRUBackend, BloomBackend, SqliteBackend
+from aiopipes.filters import unique
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+def test_unique_reports_stats(run):
+    stage = FunctionRunner(unique("id"))
+    pipeline = Pipeline("Test") | stage
+    output = TestIO()
+
+    pipeline < IterableIO([{"id": i % 3} for i in range(9)])
+    pipeline > output
+    run(pipeline.start())
+
+    assert output.q == [{"id": 0}, {"id": 1}, {"id": 2}]
+    stats = stage.status.get_stats()["func_stats"]
+    assert (stats["checked"], stats["duplicates"], stats["keys"]) == (9, 6, 3)
+    assert abs(stats["hit_rate"] - 6 / 9) < 1e-9
+    assert stats["memory_bytes"] > 0
+
+
+def test_lru_backend_forgets():
+    backend = LRUBackend(max_keys=2)
+    assert [backend.add(k) for k in [1, 2, 1, 3, 1, 2]] == [True, True, False, True, False, True]
+    assert backend.get_stats()["evicted"] == 2
+
+    expiring = LRUBackend(ttl=0)
+    assert expiring.add("a") and expiring.add("a")
+
+
+def test_bloom_backend_scales():
+    backend = BloomBackend(capacity=100, error_rate=0.01)
+    added = sum(backend.add(i) for i in range(1000))
+
+    assert added >= 990
+    assert not any(backend.add(i) for i in range(1000))
+    assert backend.get_stats()["filters"] > 1
+
+
+def test_sqlite_backend_persists(tmpdir, run):
+    path = str(tmpdir.join("seen.db"))
+
+    for ids, expected in [([1, 2, 1], [1, 2]), ([1, 2, 3], [3])]:
+        pipeline = Pipeline("Test") | unique("id", SqliteBackend(path, commit_every=100))
+        output = TestIO()
+        pipeline < IterableIO([{"id": i} for i in ids])
+        pipeline > output
+        run(pipeline.start())
+        assert [item["id"] for item in output.q] == expected
+
+    assert SqliteBackend(path).get_stats()["keys"] == 3
+
+
+def test_backends_keep_key_types_apart(tmpdir):
+    for backend in [BloomBackend(), SqliteBackend(str(tmpdir.join("seen.db")))]:
+        assert [backend.add(key) for key in [1, "1", b"1", (1,), ("1",), 1]] == [True] * 5 + [False]
+        backend.close()
+
+    backend = SqliteBackend(str(tmpdir.join("seen.db")))
+    backend.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        backend.connection.execute("SELECT 1")
+    assert backend.get_stats()["keys"] == 5
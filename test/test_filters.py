@@ -0,0 +1,87 @@
+import pytest
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.filters import window, time_window, group_by, total, minimum, top_k, approx_count, distinct_count
+from aiopipes.sketches import CountMinSketch, HyperLogLog, hash64
+from . import TestIO
+
+
+def run_stage(run, stage, items, **options):
+    pipeline = Pipeline("Test", **options) | stage
+    output = TestIO()
+    pipeline < IterableIO(items)
+    pipeline > output
+    run(pipeline.start())
+    return output.q
+
+
+def test_count_windows(run):
+    assert run_stage(run, window(3), range(8)) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert run_stage(run, window(3, step=1), range(5)) == [[0, 1, 2], [1, 2, 3], [2, 3, 4]]
+    assert run_stage(run, window(2, step=3), range(8)) == [[0, 1], [3, 4], [6, 7]]
+
+
+def test_time_window(run):
+    ticks = iter([0, 0.5, 1.2, 1.9, 5])
+    assert run_stage(run, time_window(1, clock=lambda: next(ticks)), "abcde") == [["a", "b"], ["c", "d"], ["e"]]
+
+    # Two second windows every second: one item can close two of them, and the stream ending closes the rest
+    ticks = iter([0, 0.5, 1.5, 3])
+    assert run_stage(run, time_window(2, step=1, clock=lambda: next(ticks)), "abcd") \
+        == [["a", "b"], ["a", "b", "c"], ["c"], ["d"], ["d"]]
+    ticks = iter([0, 0.5, 2.5, 3.2])
+    assert run_stage(run, time_window(1, step=2, clock=lambda: next(ticks)), "abcd") == [["a", "b"], ["c"]]
+
+
+def test_group_by(run):
+    items = [{"k": k, "v": v} for k, v in [("a", 1), ("b", 5), ("a", 3)]]
+    assert run_stage(run, group_by("k"), items) == [{"a": 2, "b": 1}]
+    assert run_stage(run, group_by("k", total("v")), items, batch_size=2) == [{"a": 4, "b": 5}]
+    assert run_stage(run, group_by(lambda i: i["k"], lambda c, i: minimum(c, i["v"]), None, emit_every=2), items) \
+        == [{"a": 1, "b": 5}, {"a": 1, "b": 5}]
+
+
+def test_top_k(run):
+    assert run_stage(run, top_k(3), [5, 1, 9, 3, 7]) == [[9, 7, 5]]
+    assert run_stage(run, top_k(1, key="n"), [{"n": 2}, {"n": 8}]) == [[{"n": 8}]]
+
+
+def test_sketches(run):
+    counter = approx_count()
+    distinct = distinct_count(precision=12)
+    items = [i % 100 for i in range(5000)]
+
+    assert run_stage(run, counter, items) == items
+    assert 50 <= counter.sketch.estimate(7) <= 60
+    assert counter.sketch.get_stats()["total"] == 5000
+
+    run_stage(run, distinct, items)
+    assert 95 <= distinct.sketch.count() <= 105
+
+    large = HyperLogLog()
+    for i in range(100000):
+        large.add("key{0}".format(i))
+    assert abs(large.count() - 100000) < 3000
+
+    assert len({hash64(key) for key in [1.5, "1.5", b"1.5", "x", b"x"]}) == 5
+
+
+def test_sketches_with_numpy():
+    numpy = pytest.importorskip("numpy")
+    values = numpy.arange(10000) % 500
+
+    sketch, hll = CountMinSketch(), HyperLogLog()
+    sketch.add_many(values)
+    hll.add_many(values)
+    assert sketch.estimate(3) >= 20
+    assert 480 <= hll.count() <= 520
+
+    # Vector and scalar hashing agree
+    single = HyperLogLog()
+    for value in range(500):
+        single.add(value)
+    assert (single.registers == hll.registers).all()
+
+    stage = top_k(3)
+    stage(numpy.array([4, 8, 1, 9]))
+    assert stage.flush() == [[9, 8, 4]]
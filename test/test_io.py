@@ -1,6 +1,15 @@
-from aiopipes.pipeio import FileIO
-from io import StringIO
+from aiopipes import Pipeline, MmapFileIO, SharedMemoryQueueIO
+from aiopipes.pipeio import FileIO, BinaryFileIO, QueueIO, IOFinished
+from aiopipes.runner import FunctionRunner
+from aiopipes.queue import MemoryBudget
+from . import TestIO
+from aiopipes.streams import PipeReader, PipeWriter, ThreadReader
+from asyncio import coroutine, wait_for, TimeoutError, ensure_future
+import pytest
+from io import StringIO, BytesIO
+import gzip
 import json
+import os
 
 
 class UnclosableStringIO(StringIO):
@@ -50,3 +59,375 @@ def test_fileio(tmpdir, pipeline, run):
     with out_file.open(mode="r") as fd:
         read = [int(l.strip()) for l in fd]
         assert read == list(range(10))
+
+
+def test_fileio_backends(tmpdir, run):
+    path = tmpdir.join("input")
+    path.write("".join(json.dumps({"text": "\u00e9" * i}) + "\n" for i in range(200)))
+
+    inp = FileIO(path.open(encoding="utf-8"), chunk_size=64)
+    items = []
+    with pytest.raises(IOFinished):
+        while True:
+            items.append(run(inp.read()))
+
+    assert items == [{"text": "\u00e9" * i} for i in range(200)]
+    assert isinstance(inp.reader, ThreadReader)
+    assert inp.status.get_stats()["percentage_read"]["percent"] == 100
+
+    read_fd, write_fd = os.pipe()
+    out = FileIO(os.fdopen(write_fd, "w"), flush_size=1)
+    run(out.write({"number": 1}))
+    run(out.close())
+    assert isinstance(out.writer, PipeWriter)
+    with os.fdopen(read_fd) as fd:
+        assert fd.read() == '{"number": 1}\n'
+
+
+def test_parallel_stage_reads_file_once(tmpdir, run):
+    path = tmpdir.join("input")
+    path.write("".join(json.dumps(i) + "\n" for i in range(5000)))
+
+    for inp in [FileIO(path.open()), BinaryFileIO(path.open("rb"), codec="json", chunk_size=4096)]:
+        output = TestIO()
+        pipeline = Pipeline("Test") | FunctionRunner(lambda x: x).parallel(4)
+        pipeline < inp
+        pipeline > output
+        run(pipeline.start())
+
+        assert sorted(output.q) == list(range(5000))
+
+
+def test_queueio_batches(run):
+    queue_io = QueueIO(batch_size=4, linger=None)
+
+    @coroutine
+    def produce_and_consume():
+        yield from queue_io.write_many(list(range(6)))
+        yield from queue_io.write(6)
+        assert queue_io.queue._queue.qsize() == 1
+        yield from queue_io.close()
+
+        batches = []
+        while True:
+            try:
+                batches.append((yield from queue_io.read_many(3)))
+            except IOFinished:
+                return batches
+
+    assert run(produce_and_consume()) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert queue_io.status.get_stats()["read_count"] == 7
+
+
+def test_queueio_linger(run):
+    queue_io = QueueIO(batch_size=100, linger=0.01)
+
+    @coroutine
+    def produce_and_consume():
+        yield from queue_io.write(1)
+        yield from queue_io.write(2)
+        return (yield from wait_for(queue_io.read_many(10), 1))
+
+    assert run(produce_and_consume()) == [1, 2]
+
+
+def test_queueio_maxsize_blocks_writer(run):
+    queue_io = QueueIO(maxsize=2)
+
+    @coroutine
+    def fill():
+        yield from queue_io.write(1)
+        yield from queue_io.write(2)
+        yield from wait_for(queue_io.write(3), 0.05)
+
+    with pytest.raises(TimeoutError):
+        run(fill())
+
+    assert queue_io.status.get_stats()["queued"] == 2
+    assert queue_io.status.get_stats()["maxsize"] == 2
+
+
+def test_queueio_maxsize_counts_items(run):
+    queue_io = QueueIO(batch_size=3, maxsize=4, linger=None)
+
+    @coroutine
+    def fill():
+        yield from queue_io.write_many([1, 2, 3])
+        yield from wait_for(queue_io.write_many([4, 5, 6]), 0.05)
+
+    with pytest.raises(TimeoutError):
+        run(fill())
+
+    stats = queue_io.status.get_stats()
+    assert (stats["queued"], stats["maxsize"]) == (3, 4)
+
+
+def test_queueio_memory_budget(run):
+    budget = MemoryBudget(100, sizeof=len)
+    first, second = QueueIO(budget=budget), QueueIO(budget=budget)
+
+    @coroutine
+    def fill():
+        yield from first.write("a" * 60)
+        yield from second.write("b" * 10)
+        yield from wait_for(second.write("b" * 60), 0.05)
+
+    with pytest.raises(TimeoutError):
+        run(fill())
+
+    assert budget.used == 70
+    assert run(first.read()) == "a" * 60
+    assert budget.used == 10
+
+    # An empty queue always takes a write, so its consumer is never stuck behind memory held upstream
+    run(QueueIO(budget=budget).write("c" * 95))
+    assert budget.used == 105
+
+
+class UnclosableBytesIO(BytesIO):
+    def close(self, *args, **kwargs):
+        return
+
+
+def test_binary_fileio_roundtrip(pipeline, run):
+    inp = BytesIO(b"".join(json.dumps({"number": i}).encode() + b"\n" for i in range(100)) + b"not json\n")
+    out = UnclosableBytesIO()
+
+    pipeline = pipeline | (lambda d: d["number"] * 2)
+    pipeline < BinaryFileIO(inp, codec="json", chunk_size=7)
+    pipeline > BinaryFileIO(out, codec="json", flush_size=16)
+
+    run(pipeline.start())
+
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [i * 2 for i in range(100)]
+    assert len(pipeline.input.status.error_list) == 1
+
+
+def test_binary_fileio_broken_json_lines(run):
+    io = BinaryFileIO(BytesIO(b'[1\n2]\n3,4\n'), codec="json")
+
+    items = []
+    with pytest.raises(IOFinished):
+        while True:
+            items.extend(run(io.read_many(10)))
+
+    assert items == []
+    assert len(io.status.error_list) == 3
+
+
+def test_binary_fileio_text_codec(run):
+    io = BinaryFileIO(BytesIO(b"first\r\nsecond\nthird"), codec="text", chunk_size=4)
+
+    lines = []
+    with pytest.raises(IOFinished):
+        while True:
+            lines.extend(run(io.read_many(10)))
+
+    assert lines == ["first", "second", "third"]
+
+
+def test_binary_fileio_pipes(run):
+    read_fd, write_fd = os.pipe()
+    out = BinaryFileIO(os.fdopen(write_fd, "wb"), codec="json", flush_size=1)
+    inp = BinaryFileIO(os.fdopen(read_fd, "rb"), codec="json")
+
+    @coroutine
+    def produce():
+        yield from out.write_many([{"number": i} for i in range(1000)])
+        yield from out.close()
+
+    @coroutine
+    def consume():
+        items = []
+        while True:
+            try:
+                items.extend((yield from inp.read_many(100)))
+            except IOFinished:
+                return items
+
+    producer = ensure_future(produce())
+    items = run(consume())
+    run(producer)
+
+    assert items == [{"number": i} for i in range(1000)]
+    assert isinstance(out.writer, PipeWriter)
+    assert isinstance(inp.reader, PipeReader)
+
+
+def test_binary_fileio_threaded(tmpdir, run):
+    path = tmpdir.join("input")
+    path.write("\n".join(str(i) for i in range(1000)))
+
+    inp = BinaryFileIO(path.open("rb"), codec="json", chunk_size=64)
+    items = []
+    with pytest.raises(IOFinished):
+        while True:
+            items.extend(run(inp.read_many(100)))
+
+    assert items == list(range(1000))
+    assert isinstance(inp.reader, ThreadReader)
+    assert inp.status.get_stats()["read_count"] == 1000
+
+
+def test_mmap_shards(tmpdir, run):
+    path = tmpdir.join("input")
+    path.write("".join(json.dumps({"number": i}) + "\n" for i in range(1000)) + "{broken\n")
+
+    shards = MmapFileIO.shards(str(path), 4)
+    assert len(shards) == 4
+
+    items = []
+    for shard in shards:
+        assert "percentage_read" not in shard.status.get_stats()
+        items.extend(run(shard.read_many(10)))
+        assert 0 < shard.status.get_stats()["percentage_read"]["percent"] < 100
+
+        with pytest.raises(IOFinished):
+            while True:
+                items.extend(run(shard.read_many(100)))
+
+    assert items == [{"number": i} for i in range(1000)]
+    assert sum(len(shard.status.error_list) for shard in shards) == 1
+
+
+def test_mmap_pipeline(tmpdir, pipeline, run):
+    path = tmpdir.join("input")
+    path.write("\n".join(str(i) for i in range(100)))
+
+    output = TestIO()
+    pipeline = pipeline | FunctionRunner(lambda x: x * 2).parallel(4, ordered=True)
+    pipeline < MmapFileIO(str(path))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [i * 2 for i in range(100)]
+
+
+def test_shared_memory_queue(run):
+    queue = SharedMemoryQueueIO(size=1024)
+    items = [bytes([i % 256]) * (i % 50) for i in range(500)]
+
+    @coroutine
+    def write():
+        yield from queue.write_many(items[:250])
+        for item in items[250:]:
+            yield from queue.write(item)
+        yield from queue.close()
+
+    @coroutine
+    def read():
+        received = []
+        while True:
+            try:
+                received.extend((yield from queue.read_many(7)))
+            except IOFinished:
+                return received
+
+    # Far more data than fits in the ring, so both sides have to wait on each other
+    writer = ensure_future(write())
+    assert run(read()) == items
+    run(writer)
+    assert queue.status.get_stats()["read_count"] == 500
+
+    with pytest.raises(ValueError):
+        run(queue.write(b"x" * 1024))
+    with pytest.raises(TypeError):
+        run(queue.write("text"))
+    queue.release()
+
+
+def test_shared_memory_queue_processes(run):
+    queue = SharedMemoryQueueIO(size=4096, record="<qd")
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run(queue.write_many([(i, i / 2) for i in range(10000)]))
+            run(queue.close())
+        finally:
+            os._exit(0)
+
+    received = []
+    with pytest.raises(IOFinished):
+        while True:
+            received.extend(run(queue.read_many(100)))
+    os.waitpid(pid, 0)
+    queue.release()
+
+    assert received == [(i, i / 2) for i in range(10000)]
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".bz2", ".xz"])
+def test_compressed_files(tmpdir, run, suffix):
+    path = tmpdir.join("items.jsonl" + suffix)
+
+    out = BinaryFileIO(path.open("wb"), codec="json", flush_size=64, compression_level=1)
+    run(out.write_many([{"number": i} for i in range(1000)]))
+    run(out.close())
+    assert len(path.read_binary()) < len("".join(json.dumps({"number": i}) + "\n" for i in range(1000)))
+
+    # The name doesn't matter when reading, the format is recognised from the data
+    renamed = tmpdir.join("items")
+    path.rename(renamed)
+    inp = BinaryFileIO(renamed.open("rb"), codec="json", chunk_size=128)
+    items = []
+    with pytest.raises(IOFinished):
+        while True:
+            items.extend(run(inp.read_many(100)))
+
+    assert items == [{"number": i} for i in range(1000)]
+    assert inp.status.get_stats()["percentage_read"]["percent"] == 100
+
+
+def test_compressed_members(tmpdir, run):
+    path = tmpdir.join("items.gz")
+    path.write_binary(gzip.compress(b"1\n2\n") + gzip.compress(b"3\n"))
+
+    inp = BinaryFileIO(path.open("rb"), codec="json")
+    assert run(inp.read_many(10)) == [1, 2, 3]
+
+    # NUL padding after a member, in a separate chunk from the next one
+    path.write_binary(gzip.compress(b"1\n") + b"\0" * 100 + gzip.compress(b"2\n") + b"\0" * 10)
+    inp = BinaryFileIO(path.open("rb"), codec="json", chunk_size=64)
+    items = []
+    with pytest.raises(IOFinished):
+        while True:
+            items.extend(run(inp.read_many(10)))
+    assert items == [1, 2]
+
+    path.write_binary(gzip.compress(b"1\n2\n" * 1000)[:-20])
+    inp = BinaryFileIO(path.open("rb"), codec="json")
+    with pytest.raises(EOFError):
+        run(inp.read_many(10))
+
+
+def test_compressed_reads_are_bounded(tmpdir, run):
+    path = tmpdir.join("items.gz")
+    data = b"1" * (10 << 20) + b"\n"
+    path.write_binary(gzip.compress(data))
+
+    inp = BinaryFileIO(path.open("rb"), codec="text", chunk_size=4096)
+    reader = run(inp._open_reader())
+    sizes = []
+    while True:
+        chunk = run(reader.read())
+        if not chunk:
+            break
+        sizes.append(len(chunk))
+
+    assert sum(sizes) == len(data)
+    assert max(sizes) <= 4096
+
+
+def test_zstd_file(tmpdir, run):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmpdir.join("items.jsonl.zst")
+
+    out = BinaryFileIO(path.open("wb"), codec="json")
+    run(out.write_many(list(range(100))))
+    run(out.close())
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(path.read_binary()) == b"".join(b"%d\n" % i for i in range(100))
+
+    inp = BinaryFileIO(path.open("rb"), codec="json")
+    assert run(inp.read_many(1000)) == list(range(100))
@@ -0,0 +1,106 @@
+from asyncio import coroutine, sleep, open_connection
+import time
+
+from aiopipes import Pipeline, IterableIO, QueueIO
+from aiopipes.metrics import Histogram
+from aiopipes.monitor import ConsoleMonitor, MetricsMonitor
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.record(i / 1000)
+
+    stats = histogram.get_stats()
+    assert stats["count"] == 1000
+    assert abs(stats["mean"] - 0.5005) < 1e-9
+    assert 0.4 < stats["p50"] < 0.6
+    assert 0.8 < stats["p99"] <= 1
+    assert Histogram().get_stats() == {"count": 0}
+
+
+def test_monitor_finds_bottleneck(run):
+    @coroutine
+    def slow(item):
+        yield from sleep(0.002)
+        return item
+
+    def fast(item):
+        return item
+
+    pipeline = Pipeline("Test") | fast | slow | FunctionRunner(fast).parallel(2)
+    pipeline < IterableIO(range(20))
+    pipeline > QueueIO()
+    run(pipeline.start())
+
+    output = TestIO()
+    monitor = ConsoleMonitor(pipeline, output)
+    info = monitor.collect()
+
+    assert monitor.bottleneck(info) == "slow"
+    # Timings are sampled, but every sample is weighted by the items it stands for
+    assert 12 <= info["pipes"][1]["task"]["service_time"]["count"] <= 20
+    assert 12 <= info["pipes"][1]["input"]["queue_wait"]["count"] <= 20
+
+    run(monitor.display(info))
+    assert "slow  << bottleneck" in output.q[0]
+
+
+def test_monitor_counts_pool_workers(run):
+    @coroutine
+    def slow(item):
+        yield from sleep(0.002)
+        return item
+
+    def slower(item):
+        time.sleep(0.004)
+        return item
+
+    # Each item takes longer in the pool, but four of them run at once
+    pipeline = Pipeline("Test") | slow | FunctionRunner(slower).threads(4, chunk_size=1)
+    pipeline < IterableIO(range(40))
+    pipeline > QueueIO()
+    run(pipeline.start())
+
+    monitor = ConsoleMonitor(pipeline, TestIO())
+    info = monitor.collect()
+    assert info["pipes"][1]["workers"] == 4
+    assert monitor.bottleneck(info) == "slow"
+
+
+def test_metrics_monitor(tmpdir, run):
+    pipeline = Pipeline("Test", maxsize=5, memory_budget=10000) | (lambda x: x * 2) | FunctionRunner(lambda x: x).parallel(2)
+    pipeline < IterableIO(range(10))
+    pipeline > QueueIO()
+
+    textfile = str(tmpdir.join("aiopipes.prom"))
+    monitor = MetricsMonitor(pipeline, port=0, textfile=textfile, interval=0.01)
+
+    @coroutine
+    def scrape(port, path):
+        reader, writer = yield from open_connection("127.0.0.1", port)
+        writer.write("GET {0} HTTP/1.0\r\n\r\n".format(path).encode())
+        response = yield from reader.read()
+        writer.close()
+        return response.decode()
+
+    @coroutine
+    def run_and_scrape():
+        yield from monitor.monitor(pipeline.start())
+        port = yield from monitor.start_server()
+        try:
+            return (yield from scrape(port, "/metrics")), (yield from scrape(port, "/"))
+        finally:
+            yield from monitor.stop_server()
+
+    metrics, missing = run(run_and_scrape())
+
+    assert metrics.startswith("HTTP/1.0 200 OK")
+    assert missing.startswith("HTTP/1.0 404")
+    assert 'aiopipes_items_processed_total{pipeline="Test",stage="<lambda>",position="1"} 10' in metrics
+    assert 'aiopipes_queue_maxsize{pipeline="Test",stage="<lambda>",position="1"} 5' in metrics
+    assert 'aiopipes_service_time_seconds_bucket{pipeline="Test",stage="<lambda>",position="0",le="+Inf"}' in metrics
+    assert "# TYPE aiopipes_queue_wait_seconds histogram" in metrics
+    assert "aiopipes_memory_budget_bytes" in tmpdir.join("aiopipes.prom").read()
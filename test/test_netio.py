@@ -0,0 +1,56 @@
+from asyncio import coroutine, gather, sleep
+
+from aiopipes import Pipeline, IterableIO, SocketInput, SocketOutput
+from aiopipes.pipeio import IOFinished
+from aiopipes.runner import FunctionRunner
+from . import TestIO
+
+
+def test_pipeline_to_pipeline(run):
+    source = SocketInput(window=50)
+    run(source.listen())
+
+    sender = Pipeline("sender") | FunctionRunner(lambda x: x * 2)
+    sender < IterableIO(range(1000))
+    sender > SocketOutput(port=source.port, batch_size=64)
+
+    output = TestIO()
+    receiver = Pipeline("receiver") | FunctionRunner(lambda x: x + 1)
+    receiver < source
+    receiver > output
+
+    run(gather(sender.start(), receiver.start()))
+
+    assert output.q == [i * 2 + 1 for i in range(1000)]
+    assert output.closed
+    assert source.status.get_stats()["read_count"] == 1000
+
+
+def test_pooled_producers(tmpdir, run):
+    path = str(tmpdir.join("socket"))
+    source = SocketInput(path=path, producers=2, window=10, buffer=2)
+    outputs = [SocketOutput(path=path, batch_size=5, connections=3) for _ in range(2)]
+
+    @coroutine
+    def produce(output, start):
+        for i in range(start, start + 200):
+            yield from output.write(i)
+        yield from output.close()
+
+    @coroutine
+    def consume():
+        items = []
+        while True:
+            try:
+                items.extend((yield from source.read_many(10)))
+            except IOFinished:
+                return items
+            # A slow consumer, so producers run out of credit
+            yield from sleep(0)
+
+    run(source.listen())
+    items, _, _ = run(gather(consume(), produce(outputs[0], 0), produce(outputs[1], 200)))
+
+    assert sorted(items) == list(range(400))
+    assert all(output.status.get_stats()["credit_wait_count"] > 0 for output in outputs)
+    assert source.queue.items_queued == 0
@@ -1,8 +1,9 @@
-from asyncio import coroutine, get_event_loop
+from asyncio import coroutine, get_event_loop, wait_for
 import io
 
 from aiopipes import Pipeline
-from aiopipes.pipeio import Output, IterableIO, FileIO
+from aiopipes.runner import FunctionRunner, FusedRunner
+from aiopipes.pipeio import Output, IterableIO, FileIO, BinaryFileIO
 from . import TestIO
 import pytest
 
@@ -40,6 +41,9 @@ def test_shorthand_io(pipeline):
     assert isinstance(pipeline.input, IterableIO)
     assert isinstance(pipeline.output, FileIO)
 
+    pipeline > io.BytesIO()
+    assert isinstance(pipeline.output, BinaryFileIO)
+
 
 def test_return(pipeline, run):
     """
@@ -96,3 +100,101 @@ def test_pipes(pipeline, test_io, run):
     run(new_pipeline.start())
 
     assert test_io.q == [i + 1 for i in range(10)]
+
+
+def test_batched_pipeline(run):
+    pipeline = Pipeline("Test", batch_size=3) | (lambda x: x + 1) | (lambda x: x * 2 if x % 2 else None)
+    output = TestIO()
+
+    pipeline < IterableIO(range(10))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [i * 2 for i in range(1, 11) if i % 2]
+    assert all(p.batch_size == 3 for p in pipeline.pipes)
+
+
+def test_bounded_pipeline(run):
+    pipeline = Pipeline("Test", maxsize=1, memory_budget=1024) | (lambda x: x + 1) | FunctionRunner(lambda x: x).buffered(3)
+    output = TestIO()
+
+    pipeline < IterableIO(range(10))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == list(range(1, 11))
+    assert [p.input.queue.maxsize for p in pipeline.pipes[1:]] == [3]
+    assert pipeline.status.get_stats()["memory_budget"] == 1024
+
+
+def test_memory_budget_with_growing_items(run):
+    # The middle stage's outputs are far bigger than its inputs, the queue behind it fills the budget
+    pipeline = Pipeline("Test", memory_budget=20000) | (lambda x: x) | (lambda x: "y" * 5000) | (lambda x: x)
+    output = TestIO()
+
+    pipeline < IterableIO(range(2000))
+    pipeline > output
+
+    run(wait_for(pipeline.start(), 20))
+
+    assert len(output.q) == 2000
+
+
+def test_fused_pipeline(run):
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+
+    @coroutine
+    def slow(x):
+        return x
+
+    dead_letter = TestIO()
+    pipeline = Pipeline("Test") | (lambda x: x + 1) | FunctionRunner(fail_on_three).errors_to(dead_letter) \
+        | (lambda x: x * 2) | slow | (lambda x: x)
+    output = TestIO()
+
+    pipeline < IterableIO(range(5))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [2, 4, 8, 10]
+    assert [type(r).__name__ for r in pipeline.runners] == ["FusedRunner", "FunctionRunner", "FunctionRunner"]
+    assert pipeline.runners[0].name == "<lambda>+fail_on_three+<lambda>"
+    assert [p.status.status_data["done_count"] for p in pipeline.pipes] == [5, 4, 4, 4, 4]
+    assert pipeline.pipes[1].status.error_total == 1
+    assert dead_letter.q[0]["data"] == 3 and dead_letter.closed
+
+
+def test_fused_stage_returning_coroutine(run):
+    @coroutine
+    def double(x):
+        return x * 2
+
+    pipeline = Pipeline("Test") | (lambda x: x + 1) | (lambda x: double(x))
+    output = TestIO()
+
+    pipeline < IterableIO(range(3))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [2, 4, 6]
+    assert isinstance(pipeline.runners[0], FusedRunner)
+
+
+def test_unfused_pipeline(run):
+    pipeline = Pipeline("Test", fuse=False) | (lambda x: x + 1) | (lambda x: x * 2)
+    output = TestIO()
+
+    pipeline < IterableIO(range(5))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [2, 4, 6, 8, 10]
+    assert not any(isinstance(r, FusedRunner) for r in pipeline.runners)
@@ -1,6 +1,9 @@
+from aiopipes import Pipeline, IterableIO
 from aiopipes.runner import FunctionRunner
+from . import TestIO
 import functools
-from asyncio import coroutine
+import pytest
+from asyncio import coroutine, sleep, wait_for, Task
 from decorator import decorator
 
 
@@ -40,4 +43,144 @@ def test_get_wrapped_args():
         return
 
     runner = FunctionRunner(test_function2)
-    assert runner._get_params(test_function2, {"output"}) == {"output"}
\ No newline at end of file
+    assert runner._get_params(test_function2, {"output"}) == {"output"}
+
+def square_evens(number, output):
+    if number % 2:
+        raise ValueError(number)
+    output(number)
+    return number * number
+
+
+def test_executor_runner(run):
+    pipeline = Pipeline("Test") | FunctionRunner(square_evens).processes(2, chunk_size=3, ordered=True)
+    output = TestIO()
+
+    pipeline < IterableIO(range(20))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == [x for i in range(0, 20, 2) for x in (i, i * i)]
+    assert len(pipeline.pipes[0].status.error_list) == 10
+    # Where the error was raised in the worker process, which the pickled exception has lost
+    assert "square_evens" in str(pipeline.pipes[0].status.error_list[0][0].__cause__)
+
+
+def test_processes_need_picklable_function():
+    with pytest.raises(RuntimeError):
+        FunctionRunner(lambda x: x + 1).processes(2)
+
+
+def test_threaded_runner_unordered(run):
+    pipeline = Pipeline("Test") | FunctionRunner(lambda x: x + 1).threads(4, chunk_size=2)
+    output = TestIO()
+
+    pipeline < IterableIO(range(20))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert sorted(output.q) == list(range(1, 21))
+
+
+def test_ordered_parallel(run):
+    @coroutine
+    def slow_for_small(number):
+        yield from sleep((10 - number % 10) / 1000)
+        return number
+
+    runner = FunctionRunner(slow_for_small).parallel(5, ordered=True, reorder_buffer=8)
+    pipeline = Pipeline("Test") | (lambda x: x) | runner
+    output = TestIO()
+
+    pipeline < IterableIO(range(50))
+    pipeline > output
+
+    run(pipeline.start())
+
+    assert output.q == list(range(50))
+    assert runner.status.get_stats()["hol_blocked_count"] > 0
+    assert not runner._reorder
+
+
+def test_partitioned_stage_keeps_key_order(run):
+    workers = {}
+
+    @coroutine
+    def handle(item):
+        key, seq = item
+        workers.setdefault(key, set()).add(Task.current_task())
+        yield from sleep(0.001 * ((seq * 7 + key) % 3))
+        return item
+
+    pipeline = Pipeline("Test") | FunctionRunner(handle).partition_by(lambda item: item[0], 4, maxsize=5)
+    output = TestIO()
+    pipeline < IterableIO([(i % 5, i // 5) for i in range(100)])
+    pipeline > output
+    run(pipeline.start())
+
+    assert len(output.q) == 100
+    for key in range(5):
+        assert [seq for k, seq in output.q if k == key] == list(range(20))
+        assert len(workers[key]) == 1
+    assert len(set.union(*workers.values())) > 1
+
+
+def test_partitioned_stage_stops_when_a_worker_dies(run):
+    class BrokenIO(TestIO):
+        @coroutine
+        def write(self, data):
+            if data == 0:
+                raise IOError("disk full")
+            yield from super().write(data)
+
+    runner = FunctionRunner(lambda x: x).partition_by(lambda item: item % 2, 2, maxsize=2)
+    runner < IterableIO(range(1000))
+    runner > BrokenIO()
+    run(wait_for(runner.start(), 5))
+
+    errors = [str(error[0]) for error in runner.status.error_list]
+    assert any("exited early" in error for error in errors)
+
+    with pytest.raises(RuntimeError):
+        FunctionRunner(lambda x: x).partition_by(lambda item: item, 2).parallel(2, ordered=True)
+
+
+def test_ordered_stage_survives_failed_write(run):
+    class BrokenIO(TestIO):
+        @coroutine
+        def write(self, data):
+            if data == 3:
+                raise IOError("disk full")
+            yield from super().write(data)
+
+    @coroutine
+    def jittery(item):
+        yield from sleep(0.001 * (item % 3))
+        return item
+
+    runner = FunctionRunner(jittery).parallel(2, ordered=True)
+    runner < IterableIO(range(10))
+    output = BrokenIO()
+    runner > output
+    run(wait_for(runner.start(), 5))
+
+    assert output.q == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert runner.status.error_list[0][1] == 3
+    assert runner.in_flight == 0
+
+
+def test_failed_write_releases_in_flight(run):
+    class BrokenIO(TestIO):
+        @coroutine
+        def write(self, data):
+            raise IOError("disk full")
+
+    runner = FunctionRunner(lambda x: x)
+    runner < IterableIO(range(3))
+    runner > BrokenIO()
+
+    run(runner.start())
+    assert isinstance(runner.status.error_list[0][0], IOError)
+    assert runner.in_flight == 0
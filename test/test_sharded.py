@@ -0,0 +1,75 @@
+from asyncio import wait_for
+import json
+import os
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.monitor import ConsoleMonitor
+from aiopipes.runner import FunctionRunner
+from aiopipes.sharded import ShardedPipeline, merge_stats
+from . import TestIO
+
+
+def double(x):
+    return x * 2
+
+
+def make_pipeline():
+    return Pipeline("shard") | FunctionRunner(double) | FunctionRunner(lambda x: x + 1).parallel(2)
+
+
+def test_sharded_by_bytes(tmpdir, run):
+    source = tmpdir.join("input.jsonl")
+    source.write("".join(json.dumps(i) + "\n" for i in range(1000)))
+
+    output = TestIO()
+    pipeline = ShardedPipeline("Test", make_pipeline, shards=3, input=str(source), output=output)
+    run(pipeline.start())
+
+    assert sorted(output.q) == [i * 2 + 1 for i in range(1000)]
+    assert output.closed
+
+    info = ConsoleMonitor(pipeline, TestIO()).collect()
+    assert [p["name"] for p in info["pipes"]] == ["double", "<lambda>"]
+    assert info["pipes"][0]["task"]["done_count"] == 1000
+    assert info["pipes"][0]["input"]["percentage_read"]["percent"] == 100
+    assert info["pipes"][1]["concurrency"] == 6
+
+
+def test_sharded_round_robin(run):
+    output = TestIO()
+    pipeline = ShardedPipeline("Test", make_pipeline, shards=2, input=IterableIO(range(500)), output=output,
+                               batch_size=16)
+    run(pipeline.start())
+
+    assert sorted(output.q) == [i * 2 + 1 for i in range(500)]
+    assert pipeline.pipes[1].status.get_stats()["done_count"] == 500
+
+
+def die_on_zero(x):
+    if x == 0:
+        os._exit(3)
+    return x
+
+
+def test_sharded_round_robin_shard_dies(run):
+    output = TestIO()
+    pipeline = ShardedPipeline("Test", lambda: Pipeline("shard") | die_on_zero, shards=2,
+                               input=IterableIO(range(5000)), output=output, batch_size=16)
+    run(wait_for(pipeline.start(), 30))
+
+    errors = [str(error[0]) for error in pipeline.status.error_list]
+    assert "Shard 0 exited with code 3" in errors
+    assert 0 not in output.q
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        {"done_count": 3, "service_time": {"count": 1, "mean": 1.0, "p99": 1.0, "min": 1.0}, "error_list": ["a"]},
+        {"done_count": 4, "service_time": {"count": 3, "mean": 2.0, "p99": 5.0, "min": 0.5}, "error_list": ["b"],
+         "percentage_done": {"percent": 50, "data": (1, 2)}},
+    ])
+
+    assert merged["done_count"] == 7
+    assert merged["service_time"] == {"count": 4, "mean": 1.75, "p99": 5.0, "min": 0.5}
+    assert merged["error_list"] == ["a", "b"]
+    assert merged["percentage_done"] == {"percent": 50, "data": (1, 2)}
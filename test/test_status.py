@@ -0,0 +1,80 @@
+from asyncio import coroutine
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.runner import FunctionRunner
+from aiopipes.status import StatusTracker
+from . import TestIO
+
+
+def test_subtasks_are_pooled():
+    tracker = StatusTracker("done_count")
+
+    with tracker.subtask("percentage_done", "done_count", "max_count") as first:
+        first.inc("done_count")
+        assert tracker.get_stats()["subtasks"][0]["done_count"] == 1
+
+    with tracker.subtask("percentage_done", "done_count", "max_count") as second:
+        assert second is first
+        assert second.snapshot()["done_count"] == 0
+
+    assert tracker.task_list == []
+
+
+def test_subtasks_only_for_continue(run):
+    seen = []
+
+    def plain(number):
+        seen.append(len(runner.status.task_list))
+        return number
+
+    @coroutine
+    def continued(number, _continue):
+        seen.append(len(continued_runner.status.task_list))
+        if number > 0:
+            return _continue(number - 1)
+        return number
+
+    runner, continued_runner = FunctionRunner(plain), FunctionRunner(continued)
+    pipeline = Pipeline("Test") | runner | continued_runner
+    pipeline < IterableIO(range(3))
+    pipeline > TestIO()
+
+    run(pipeline.start())
+
+    assert seen[:3] == [0, 0, 0]
+    assert set(seen[3:]) == {1}
+    assert runner.status.snapshot()["done_count"] == 3
+    assert continued_runner.status.snapshot()["done_count"] == 3
+
+
+def test_errors_are_bounded_and_rate_limited(caplog, monkeypatch):
+    monkeypatch.setattr(StatusTracker, "max_errors", 5)
+    monkeypatch.setattr(StatusTracker, "log_burst", 2)
+    tracker = StatusTracker("error_count")
+
+    with tracker.subtask("done_count") as subtask:
+        for i in range(20):
+            subtask.error(ValueError(i), i)
+        tracker.error(KeyError("key"))
+
+    stats = tracker.get_stats()
+    assert [e.args[0] for e in stats["error_list"]] == [16, 17, 18, 19, "key"]
+    assert stats["error_counts"] == {"ValueError": 20, "KeyError": 1}
+    assert stats["error_total"] == stats["error_count"] == 21
+    assert len([r for r in caplog.records if r.name == "aiopipes"]) == 2
+
+
+def test_dead_letter_output(run):
+    def invert(number):
+        return 1 / number
+
+    failed = TestIO()
+    pipeline = Pipeline("Test") | FunctionRunner(invert).errors_to(failed)
+    pipeline < IterableIO([1, 0, 2])
+    pipeline > TestIO()
+
+    run(pipeline.start())
+
+    assert [(f["type"], f["data"]) for f in failed.q] == [("ZeroDivisionError", 0)]
+    assert failed.q[0]["error"].startswith("ZeroDivisionError(")
+    assert failed.closed
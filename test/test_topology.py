@@ -0,0 +1,60 @@
+from asyncio import coroutine, sleep
+
+from aiopipes import Pipeline, IterableIO
+from aiopipes.topology import tee, route, merge, MergeIO
+from . import TestIO
+
+
+def test_tee_shares_items(run):
+    parsed = []
+
+    def parse(x):
+        item = {"n": x}
+        parsed.append(item)
+        return item
+
+    @coroutine
+    def slow(item):
+        yield from sleep(0.001)
+        return item
+
+    evens, everything, passthrough = TestIO(), TestIO(), TestIO()
+    pipeline = Pipeline("Test") | parse | tee(
+        Pipeline("evens") | (lambda i: i if i["n"] % 2 == 0 else None) > evens,
+        (Pipeline("slow") | slow) > everything,
+        maxsize=2
+    )
+    pipeline < IterableIO(range(10))
+    pipeline > passthrough
+    run(pipeline.start())
+
+    assert [i["n"] for i in evens.q] == [0, 2, 4, 6, 8]
+    assert everything.q == parsed == passthrough.q
+    # Every branch saw the same objects, parsed once
+    assert all(a is b for a, b in zip(everything.q, parsed))
+    assert evens.closed and everything.closed and passthrough.closed
+
+
+def test_route_and_merge(run):
+    merged = MergeIO(producers=2)
+    small, other = TestIO(), TestIO()
+    pipeline = Pipeline("Test", batch_size=4) | route(lambda x: "small" if x < 5 else "big" if x < 10 else None, {
+        "small": small,
+        "big": Pipeline("big") | (lambda x: x * 10) > merged,
+    })
+    pipeline < IterableIO(range(12))
+    pipeline > other
+    downstream = Pipeline("down") | (lambda x: x + 1)
+    downstream < merge(merged, [1000])
+    collected = TestIO()
+    downstream > collected
+
+    run(pipeline.start())
+    assert small.q == [0, 1, 2, 3, 4]
+    assert other.q == [10, 11]
+    # Only one of the two producers has closed it
+    assert not merged.queue.finished
+
+    run(merged.close())
+    run(downstream.start())
+    assert sorted(collected.q) == [51, 61, 71, 81, 91, 1001]